@@ -0,0 +1,279 @@
+import io
+import json
+import os
+import threading
+import time
+
+
+# =========================================================
+# بک‌اند بکاپ: گروه تلگرام (Telethon) یا پوشه‌ی محلی
+# =========================================================
+# همه‌ی بکاپ/ریستورها فقط از این متدها استفاده می‌کنند:
+#   send_file / send_message / edit_message / pin_message
+#   get_pinned / get_messages / iter_messages / download
+# متدها async هستند و روی حلقه Telethon اجرا می‌شوند (run_telethon).
+#
+# بک‌اند local برای اجرای آفلاین و بنچمارک است: هر chat یک پوشه،
+# هر پیام یک فایل متادیتا (شناسه‌ی افزایشی، کپشن، reply_to) و فایل پیوست.
+
+BACKENDS = ("telegram", "local")
+
+
+class BackupMessage:
+    """
+    نمای مشترک پیام برای هر دو بک‌اند.
+    text: متن/کپشن ؛ file_name: نام فایل پیوست (بدون فایل None)
+    """
+
+    __slots__ = ("id", "text", "file_name", "reply_to", "date", "source")
+
+    def __init__(self, id, text="", file_name=None, reply_to=None, date=None, source=None):
+        self.id = id
+        self.text = text or ""
+        self.file_name = file_name
+        self.reply_to = reply_to
+        self.date = date
+        self.source = source
+
+
+# ---------- Telegram ----------
+class TelegramBackupBackend:
+    """
+    client_getter: تابعی که کلاینت Telethon را برمی‌گرداند
+    (کلاینت داخل ترد Telethon ساخته می‌شود، بعد از ساخته شدن این شیء).
+    """
+
+    name = "telegram"
+
+    def __init__(self, client_getter):
+        self._client_getter = client_getter
+
+    @property
+    def client(self):
+        return self._client_getter()
+
+    @staticmethod
+    def _wrap(message):
+        if message is None:
+            return None
+
+        file_name = None
+        if message.file:
+            file_name = message.file.name or ""
+
+        return BackupMessage(
+            id=message.id,
+            text=message.message or "",
+            file_name=file_name,
+            reply_to=getattr(message, "reply_to_msg_id", None),
+            date=message.date,
+            source=message,
+        )
+
+    async def send_file(self, chat_id, filename, raw, caption=None, parse_mode=None, reply_to=None):
+        file = io.BytesIO(raw)
+        file.name = filename
+
+        message = await self.client.send_file(
+            entity=chat_id,
+            file=file,
+            caption=caption,
+            parse_mode=parse_mode,
+            force_document=True,
+            reply_to=reply_to,
+        )
+        return self._wrap(message)
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_to=None):
+        message = await self.client.send_message(
+            entity=chat_id,
+            message=text,
+            parse_mode=parse_mode,
+            link_preview=False,
+            reply_to=reply_to,
+        )
+        return self._wrap(message)
+
+    async def edit_message(self, chat_id, message_id, text):
+        await self.client.edit_message(chat_id, message_id, text, parse_mode=None)
+
+    async def pin_message(self, chat_id, message_id):
+        await self.client.pin_message(chat_id, message_id, notify=False)
+
+    async def get_pinned(self, chat_id):
+        from telethon.tl.types import InputMessagePinned
+
+        message = await self.client.get_messages(chat_id, ids=InputMessagePinned())
+        return self._wrap(message)
+
+    async def get_messages(self, chat_id, ids):
+        """
+        ids: لیست شناسه‌ها -> لیست پیام‌ها (پیام حذف‌شده None)
+        """
+        messages = await self.client.get_messages(chat_id, ids=list(ids))
+        return [self._wrap(message) for message in messages]
+
+    async def iter_messages(self, chat_id, limit=200, search=None):
+        async for message in self.client.iter_messages(chat_id, limit=limit, search=search):
+            yield self._wrap(message)
+
+    async def download(self, message, save_path=None):
+        if save_path:
+            await message.source.download_media(file=save_path)
+            return save_path
+        return await message.source.download_media(file=bytes)
+
+
+# ---------- پوشه‌ی محلی ----------
+class LocalBackupBackend:
+    """
+    root/<chat_id>/<message_id>.json   متادیتا
+    root/<chat_id>/<message_id>.bin    فایل پیوست
+    root/<chat_id>/pinned              شناسه‌ی پیام پین‌شده
+    شناسه‌ی پیام‌ها مثل تلگرام برای هر chat افزایشی است.
+    """
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._next_ids = {}
+
+    def _chat_dir(self, chat_id):
+        path = os.path.join(self.root, str(chat_id))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _message_ids(self, chat_id):
+        ids = []
+        for name in os.listdir(self._chat_dir(chat_id)):
+            if name.endswith(".json"):
+                ids.append(int(name[:-5]))
+        return ids
+
+    def _allocate_id(self, chat_id):
+        with self._lock:
+            next_id = self._next_ids.get(chat_id)
+            if next_id is None:
+                next_id = max(self._message_ids(chat_id), default=0) + 1
+            self._next_ids[chat_id] = next_id + 1
+            return next_id
+
+    def _meta_path(self, chat_id, message_id):
+        return os.path.join(self._chat_dir(chat_id), f"{message_id}.json")
+
+    def _write_meta(self, chat_id, meta):
+        path = self._meta_path(chat_id, meta["id"])
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read(self, chat_id, message_id):
+        try:
+            with open(self._meta_path(chat_id, message_id), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return BackupMessage(
+            id=meta["id"],
+            text=meta.get("text", ""),
+            file_name=meta.get("file_name"),
+            reply_to=meta.get("reply_to"),
+            date=meta.get("date"),
+            source=(chat_id, meta["id"]),
+        )
+
+    def _store(self, chat_id, text, file_name=None, raw=None, reply_to=None):
+        message_id = self._allocate_id(chat_id)
+
+        if raw is not None:
+            bin_path = os.path.join(self._chat_dir(chat_id), f"{message_id}.bin")
+            with open(bin_path, "wb") as f:
+                f.write(raw)
+
+        meta = {
+            "id": message_id,
+            "text": text or "",
+            "file_name": file_name,
+            "reply_to": reply_to,
+            "date": time.time(),
+        }
+        self._write_meta(chat_id, meta)
+        return self._read(chat_id, message_id)
+
+    async def send_file(self, chat_id, filename, raw, caption=None, parse_mode=None, reply_to=None):
+        return self._store(chat_id, caption, file_name=filename, raw=raw, reply_to=reply_to)
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_to=None):
+        return self._store(chat_id, text, reply_to=reply_to)
+
+    async def edit_message(self, chat_id, message_id, text):
+        message = self._read(chat_id, message_id)
+        if message is None:
+            raise ValueError(f"message {message_id} not found in {chat_id}")
+
+        self._write_meta(chat_id, {
+            "id": message.id,
+            "text": text,
+            "file_name": message.file_name,
+            "reply_to": message.reply_to,
+            "date": message.date,
+        })
+
+    async def pin_message(self, chat_id, message_id):
+        with open(os.path.join(self._chat_dir(chat_id), "pinned"), "w") as f:
+            f.write(str(message_id))
+
+    async def get_pinned(self, chat_id):
+        try:
+            with open(os.path.join(self._chat_dir(chat_id), "pinned"), "r") as f:
+                return self._read(chat_id, int(f.read().strip()))
+        except (OSError, ValueError):
+            return None
+
+    async def get_messages(self, chat_id, ids):
+        return [self._read(chat_id, message_id) for message_id in ids]
+
+    async def iter_messages(self, chat_id, limit=200, search=None):
+        count = 0
+
+        for message_id in sorted(self._message_ids(chat_id), reverse=True):
+            if limit is not None and count >= limit:
+                return
+
+            message = self._read(chat_id, message_id)
+            if message is None:
+                continue
+            if search and search not in message.text:
+                continue
+
+            count += 1
+            yield message
+
+    async def download(self, message, save_path=None):
+        chat_id, message_id = message.source
+        bin_path = os.path.join(self._chat_dir(chat_id), f"{message_id}.bin")
+
+        with open(bin_path, "rb") as f:
+            raw = f.read()
+
+        if save_path:
+            with open(save_path, "wb") as f:
+                f.write(raw)
+            return save_path
+
+        return raw
+
+
+def create_backup_backend(backend, client_getter=None, local_dir=None):
+    if backend == "local":
+        return LocalBackupBackend(local_dir)
+
+    if backend == "telegram":
+        return TelegramBackupBackend(client_getter)
+
+    raise ValueError(f"unknown backup backend: {backend}")
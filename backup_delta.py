@@ -0,0 +1,209 @@
+import copy
+import hashlib
+import json
+
+
+# =========================================================
+# بکاپ تفاضلی دیتابیس (delta نسبت به آخرین snapshot آپلودشده)
+# =========================================================
+# ساختار patch:
+#   add:      {node_id: نود کامل}                 نودهای جدید
+#   update:   {node_id: نود بدون contents}        نودهایی که فیلدهایشان عوض شده
+#   contents: {node_id: {start, delete, items}}   بازه‌ی تغییرکرده‌ی محتوا
+#   remove:   [node_id, ...]                      نودهای حذف‌شده
+#
+# فایل delta زنجیره‌ای است: base = شناسه‌ی فایل قبلی (checkpoint یا delta)
+# و شناسه‌ی هر فایل sha1 بایت‌های خودش است؛ پس ریستور بدون محاسبه‌ی
+# hash کل دیتابیس، ترتیب و پیوستگی را چک می‌کند.
+
+DELTA_FILENAME = "database.delta.json"
+DELTA_KIND = "library_delta"
+
+
+def file_id(raw):
+    return hashlib.sha1(raw).hexdigest()
+
+
+def _contents_range(old, new):
+    """
+    کوچک‌ترین بازه‌ی پیوسته‌ای که old را به new تبدیل می‌کند (پیشوند/پسوند مشترک).
+    """
+    start = 0
+    limit = min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+
+    end = 0
+    limit -= start
+    while end < limit and old[-1 - end] == new[-1 - end]:
+        end += 1
+
+    return {
+        "start": start,
+        "delete": len(old) - start - end,
+        "items": copy.deepcopy(new[start:len(new) - end]),
+    }
+
+
+def _without_contents(node):
+    return {k: copy.deepcopy(v) for k, v in node.items() if k != "contents"}
+
+
+def diff(old, new):
+    """
+    روی ترد حلقه اصلی صدا زده شود (new همان دیکشنری زنده است)؛
+    همه‌ی مقادیر patch کپی هستند.
+    """
+    patch = {"add": {}, "update": {}, "contents": {}, "remove": []}
+
+    for node_id, node in new.items():
+        prev = old.get(node_id)
+
+        if prev is None:
+            patch["add"][node_id] = copy.deepcopy(node)
+            continue
+
+        if prev == node:
+            continue
+
+        prev_contents = prev.get("contents", [])
+        contents = node.get("contents", [])
+
+        if prev_contents != contents:
+            patch["contents"][node_id] = _contents_range(prev_contents, contents)
+
+        prev_fields = {k: v for k, v in prev.items() if k != "contents"}
+        fields = {k: v for k, v in node.items() if k != "contents"}
+
+        if prev_fields != fields:
+            patch["update"][node_id] = _without_contents(node)
+
+    patch["remove"] = [node_id for node_id in old if node_id not in new]
+    return patch
+
+
+def is_empty(patch):
+    return not (patch["add"] or patch["update"] or patch["contents"] or patch["remove"])
+
+
+def apply_patch(data, patch):
+    for node_id in patch["remove"]:
+        data.pop(node_id, None)
+
+    for node_id, node in patch["add"].items():
+        data[node_id] = copy.deepcopy(node)
+
+    for node_id, fields in patch["update"].items():
+        contents = data.get(node_id, {}).get("contents", [])
+        node = copy.deepcopy(fields)
+        node["contents"] = contents
+        data[node_id] = node
+
+    for node_id, change in patch["contents"].items():
+        node = data.get(node_id)
+        if node is None:
+            continue
+
+        contents = node.setdefault("contents", [])
+        start = change["start"]
+        contents[start:start + change["delete"]] = copy.deepcopy(change["items"])
+
+    return data
+
+
+def encode_delta(patch, base, seq):
+    return json.dumps(
+        {"kind": DELTA_KIND, "base": base, "seq": seq, "patch": patch},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def decode_delta(raw):
+    payload = json.loads(raw.decode("utf-8"))
+    if payload.get("kind") != DELTA_KIND:
+        raise ValueError("not a library delta file")
+    return payload
+
+
+def rebuild(checkpoint, checkpoint_raw, deltas):
+    """
+    checkpoint: دیکشنری دیتابیس؛ checkpoint_raw: بایت‌های همان فایل
+    deltas: بایت‌های فایل‌های delta بعد از checkpoint به ترتیب قدیمی -> جدید
+
+    خروجی: (data, last_id, applied) ؛ با اولین حلقه‌ی گسسته متوقف می‌شود.
+    """
+    last_id = file_id(checkpoint_raw)
+    applied = 0
+
+    for raw in deltas:
+        payload = decode_delta(raw)
+        if payload["base"] != last_id:
+            print(f"⚠️ Delta chain broken at seq {payload.get('seq')}, stopping replay")
+            break
+
+        apply_patch(checkpoint, payload["patch"])
+        last_id = file_id(raw)
+        applied += 1
+
+    return checkpoint, last_id, applied
+
+
+def chain_ok(checkpoint_raw, deltas, tail):
+    """
+    آیا deltaها پشت سر هم روی همین checkpoint بنا شده‌اند و به tail می‌رسند؟
+    """
+    last_id = file_id(checkpoint_raw)
+
+    for raw in deltas:
+        if decode_delta(raw)["base"] != last_id:
+            return False
+        last_id = file_id(raw)
+
+    return not deltas or last_id == tail
+
+
+class DeltaTracker:
+    """
+    وضعیت آخرین بکاپ آپلودشده: کپی خصوصی دیتابیس (base)، شناسه‌ی فایل آخر
+    و تعداد delta از آخرین checkpoint.
+    base فقط از طریق patch جلو می‌رود، پس هر بکاپ کپی کامل لازم ندارد.
+    """
+
+    def __init__(self, checkpoint_every=50):
+        self.checkpoint_every = checkpoint_every
+        self.reset()
+
+    def reset(self):
+        self.base = None
+        self.base_id = None
+        self.deltas = 0
+        self.force_checkpoint = False
+
+    def needs_checkpoint(self):
+        return (
+            self.base is None
+            or self.force_checkpoint
+            or self.deltas >= self.checkpoint_every
+        )
+
+    def make_delta(self, data):
+        """
+        -> (patch, raw) ؛ روی ترد حلقه اصلی.
+        """
+        patch = diff(self.base, data)
+        return patch, encode_delta(patch, self.base_id, self.deltas + 1)
+
+    def delta_uploaded(self, patch, raw):
+        apply_patch(self.base, patch)
+        self.base_id = file_id(raw)
+        self.deltas += 1
+
+    def checkpoint_uploaded(self, data, base_id, deltas=0):
+        """
+        data باید کپی خصوصی باشد (مثلاً decode همان فایل آپلودشده).
+        """
+        self.base = data
+        self.base_id = base_id
+        self.deltas = deltas
+        self.force_checkpoint = False
@@ -0,0 +1,58 @@
+import hashlib
+import json
+
+
+# =========================================================
+# پیام manifest پین‌شده در گروه بکاپ
+# =========================================================
+# یک پیام متنی برای هر گروه بکاپ که آخرین snapshot هر فایل را نشان می‌دهد:
+#   {"database.json": {"msg_id", "size", "sha256", "deltas": [msg_id...], "tail"},
+#    "userdata.json": {"msg_id", "size", "sha256"}}
+# ریستور با یک درخواست پیام پین‌شده را می‌خواند و مستقیم همان پیام را دانلود می‌کند؛
+# جستجو در پیام‌های اخیر فقط وقتی manifest نیست (یا با فایل نمی‌خواند) انجام می‌شود.
+
+MANIFEST_TAG = "#backup_manifest"
+
+# سقف طول متن پیام تلگرام ۴۰۹۶ است
+MAX_TEXT_LEN = 4000
+
+
+def checksum(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def make_entry(message_id, raw):
+    return {"msg_id": message_id, "size": len(raw), "sha256": checksum(raw)}
+
+
+def verify(entry, raw):
+    return len(raw) == entry.get("size") and checksum(raw) == entry.get("sha256")
+
+
+def render(manifest):
+    text = f"{MANIFEST_TAG}\n" + json.dumps(manifest, separators=(",", ":"), sort_keys=True)
+
+    if len(text) > MAX_TEXT_LEN:
+        # لیست deltaها جا نمی‌شود: ریستور آن فایل به جستجو برمی‌گردد
+        manifest = {
+            name: dict(entry, deltas=None) if "deltas" in entry else entry
+            for name, entry in manifest.items()
+        }
+        text = f"{MANIFEST_TAG}\n" + json.dumps(manifest, separators=(",", ":"), sort_keys=True)
+
+    return text
+
+
+def parse(text):
+    """
+    متن پیام -> دیکشنری manifest ؛ اگر پیام manifest نباشد None.
+    """
+    if not text or not text.startswith(MANIFEST_TAG):
+        return None
+
+    try:
+        manifest = json.loads(text[len(MANIFEST_TAG):].strip())
+    except ValueError:
+        return None
+
+    return manifest if isinstance(manifest, dict) else None
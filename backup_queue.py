@@ -0,0 +1,176 @@
+import asyncio
+import time
+
+
+# =========================================================
+# صف بکاپ: هندلرها فقط رویداد «snapshot لازم است» را ثبت می‌کنند
+# =========================================================
+class BackupQueue:
+    """
+    یک worker async روی حلقه اصلی رویدادها را به ترتیب پردازش می‌کند
+    (نوشتن فایل بکاپ + آپلود + ریپلای لاگ‌ها) تا هندلرها منتظر تلگرام نمانند.
+
+    handler(event) -> bool
+    on_result(event, ok) -> awaitable (اختیاری؛ گزارش موفقیت/شکست)
+
+    debounce: رویدادهایی که با فاصله‌ی کمتر از debounce ثانیه می‌رسند
+    یکی می‌شوند (حداکثر تا max_delay ثانیه بعد از اولین رویداد)؛
+    merge(events) -> event رویداد ادغام‌شده را می‌سازد (پیش‌فرض: آخرین رویداد).
+    """
+
+    def __init__(self, handler, name="backup", debounce=0, max_delay=None, merge=None):
+        self.handler = handler
+        self.name = name
+        self.on_result = None
+
+        self.debounce = debounce
+        self.max_delay = max_delay if max_delay is not None else debounce * 4
+        self.merge = merge
+
+        self.uploaded = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.last_ok_at = None
+        self.last_error = None
+
+        self._loop = None
+        self._queue = None
+        self._task = None
+        self._flushing = False
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self, on_result=None):
+        self.on_result = on_result
+        self._flushing = False
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = self._loop.create_task(self._worker(), name=f"{self.name}_worker")
+
+    def submit(self, event):
+        """
+        از هر تردی قابل صدا زدن است؛ اگر worker روشن نباشد False برمی‌گرداند.
+        """
+        if not self.is_running():
+            return False
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        event.setdefault("queued_at", time.time())
+
+        if running_loop is self._loop:
+            self._queue.put_nowait(event)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+        return True
+
+    async def _collect(self, first):
+        """
+        رویدادهای پشت سر هم را تا آرام شدن صف (debounce) جمع می‌کند.
+        None در صف یعنی «همین حالا flush کن» (هنگام stop).
+        """
+        events = [first]
+        deadline = self._loop.time() + self.max_delay
+
+        while True:
+            if self._flushing:
+                timeout = 0
+            else:
+                timeout = min(self.debounce, deadline - self._loop.time())
+
+            if timeout <= 0:
+                if self._queue.empty():
+                    break
+                event = self._queue.get_nowait()
+            else:
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            if event is None:
+                self._queue.task_done()
+                continue
+
+            events.append(event)
+
+        return events
+
+    async def _worker(self):
+        while True:
+            first = await self._queue.get()
+
+            if first is None:
+                self._queue.task_done()
+                continue
+
+            events = [first]
+            ok = False
+
+            try:
+                if self.debounce > 0:
+                    events = await self._collect(first)
+
+                if len(events) > 1:
+                    self.coalesced += len(events) - 1
+                    print(f"🧩 {self.name}: {len(events)} events coalesced")
+
+                event = self.merge(events) if self.merge else events[-1]
+
+                ok = bool(await self.handler(event))
+                if not ok:
+                    self.last_error = "handler returned failure"
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                event = events[-1]
+                self.last_error = str(e)
+                print(f"❌ {self.name} worker error: {e}")
+
+            finally:
+                for _ in events:
+                    self._queue.task_done()
+
+            if ok:
+                self.uploaded += 1
+                self.last_ok_at = time.time()
+            else:
+                self.failed += 1
+
+            if self.on_result:
+                try:
+                    await self.on_result(event, ok)
+                except Exception as e:
+                    print(f"❌ {self.name} result report failed: {e}")
+
+    async def stop(self, timeout=120):
+        """
+        قبل از خاموش شدن: صبر برای خالی شدن صف (حداکثر timeout ثانیه).
+        """
+        if not self.is_running():
+            return
+
+        # پنجره‌ی debounce منتظر نماند
+        self._flushing = True
+        self._queue.put_nowait(None)
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ {self.name} queue not drained, {self.pending()} events left")
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,275 @@
+import json
+import os
+import threading
+import time
+
+
+# =========================================================
+# circuit breaker و صف روی دیسک برای بکاپ‌ها
+# =========================================================
+# وقتی مقصد بکاپ (تلگرام) در دسترس نیست، breaker باز می‌شود و
+# بکاپ‌ها به جای انتظار/از دست رفتن در پوشه‌ی spool به ترتیب ذخیره می‌شوند.
+# بعد از reset_timeout یک تلاش آزمایشی (half-open) مجاز است؛ اگر موفق شد
+# breaker بسته می‌شود و spool به همان ترتیب دوباره ارسال می‌شود.
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold خطای پشت سر هم) -> open
+    open -> (بعد از reset_timeout ثانیه) -> half_open: فقط یک تلاش
+    half_open -> موفق: closed ؛ ناموفق: open
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=60, name="backup"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """
+        بدون مصرف تلاش آزمایشی: آیا فعلاً نباید هیچ درخواستی فرستاد؟
+        """
+        with self._lock:
+            if self.state == "closed":
+                return False
+            if self.state == "half_open":
+                return True
+            return time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # فقط همین یک درخواست، تا نتیجه‌اش معلوم شود
+                self.state = "half_open"
+                print(f"🔌 {self.name} circuit half-open, probing")
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"✅ {self.name} circuit closed")
+            self.state = "closed"
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"⚡ {self.name} circuit open after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class BackupSpool:
+    """
+    directory/<seq>.json  متادیتا (نوع بکاپ، کپشن، لاگ، ...)
+    directory/<seq>.bin   بایت‌های فایل
+    ترتیب ارسال همان ترتیب seq است و بعد از ری‌استارت هم حفظ می‌شود.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._seqs = None
+
+    def _load(self):
+        if self._seqs is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._seqs = sorted(
+                int(name[:-5]) for name in os.listdir(self.directory) if name.endswith(".json")
+            )
+        return self._seqs
+
+    def _paths(self, seq):
+        base = os.path.join(self.directory, f"{seq:010d}")
+        return f"{base}.json", f"{base}.bin"
+
+    def pending(self):
+        with self._lock:
+            return len(self._load())
+
+    def push(self, meta, raw, coalesce=False):
+        """
+        coalesce=True: موارد قبلی همین kind حذف می‌شوند (فقط آخرین نسخه مهم است).
+        """
+        with self._lock:
+            seqs = self._load()
+
+            if coalesce:
+                for seq in list(seqs):
+                    if self._read_meta(seq).get("kind") == meta.get("kind"):
+                        self._delete(seq)
+
+            seq = (seqs[-1] + 1) if seqs else 1
+            meta_path, bin_path = self._paths(seq)
+
+            with open(bin_path, "wb") as f:
+                f.write(raw)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # متادیتا آخر نوشته می‌شود: بدون آن، فایل bin نیمه‌کاره دیده نمی‌شود
+            tmp_path = f"{meta_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, meta_path)
+
+            seqs.append(seq)
+            return seq
+
+    def first(self):
+        """
+        -> (seq, meta, raw) قدیمی‌ترین مورد، یا None
+        """
+        with self._lock:
+            seqs = self._load()
+            if not seqs:
+                return None
+
+            seq = seqs[0]
+            with open(self._paths(seq)[1], "rb") as f:
+                raw = f.read()
+            return seq, self._read_meta(seq), raw
+
+    def remove(self, seq):
+        with self._lock:
+            self._delete(seq)
+
+    def _read_meta(self, seq):
+        with open(self._paths(seq)[0], "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _delete(self, seq):
+        for path in self._paths(seq):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        if seq in self._seqs:
+            self._seqs.remove(seq)
+
+
+class BackupDelivery:
+    """
+    ارسال بکاپ روی حلقه Telethon، یا ذخیره در spool وقتی مقصد در دسترس نیست.
+    runner: TelethonRunner ؛ upload(meta, raw) -> کوروتین ارسال یک مورد
+    """
+
+    def __init__(self, spool, breaker, runner, upload):
+        self.spool = spool
+        self.breaker = breaker
+        self.runner = runner
+        self.upload = upload
+        self._tasks = set()
+
+    def _spool(self, meta, raw):
+        # userdata همیشه کامل است: فقط آخرین نسخه نگه داشته می‌شود
+        self.spool.push(meta, raw, coalesce=(meta["kind"] == "userdata"))
+        print(f"📥 Backup spooled ({meta['kind']}), {self.spool.pending()} waiting")
+        return True
+
+    def _should_spool(self):
+        # تا spool خالی نشده، بکاپ‌های جدید پشت همان صف می‌مانند (حفظ ترتیب)
+        return self.spool.pending() > 0 or not self.breaker.allow()
+
+    def _after(self, meta, raw, ok):
+        if ok:
+            self.breaker.record_success()
+            return True
+
+        self.breaker.record_failure()
+        return self._spool(meta, raw)
+
+    async def deliver(self, meta, raw):
+        """
+        از کد async: True یعنی بکاپ یا ارسال شد یا روی دیسک در صف است.
+        """
+        if self._should_spool():
+            return self._spool(meta, raw)
+
+        try:
+            ok = await self.runner.run_async(self.upload(meta, raw))
+        except Exception as e:
+            print(f"❌ Backup upload error: {e}")
+            ok = False
+
+        return self._after(meta, raw, ok)
+
+    def deliver_sync(self, meta, raw):
+        """
+        همان deliver برای کد همزمان و تردها.
+        روی خود حلقه Telethon (حالت حلقه‌ی اصلی) نمی‌شود بلاک کرد:
+        deliver در پس‌زمینه‌ی همان حلقه اجرا می‌شود و خطای breaker ثبت نمی‌شود.
+        """
+        if self.runner.on_loop():
+            task = self.runner.loop.create_task(self.deliver(meta, raw))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return True
+
+        if self._should_spool():
+            return self._spool(meta, raw)
+
+        try:
+            ok = self.runner.run(self.upload(meta, raw))
+        except Exception as e:
+            print(f"❌ Backup upload error: {e}")
+            ok = False
+
+        return self._after(meta, raw, ok)
+
+    async def replay(self):
+        async def send(meta, raw):
+            return await self.runner.run_async(self.upload(meta, raw))
+
+        return await replay(self.spool, self.breaker, send)
+
+
+async def replay(spool, breaker, send):
+    """
+    ارسال دوباره‌ی spool به ترتیب seq؛ send(meta, raw) -> bool (awaitable)
+    با اولین خطا متوقف می‌شود تا ترتیب بکاپ‌ها به هم نخورد.
+    -> تعداد موارد ارسال‌شده
+    """
+    if not spool.pending() or not breaker.allow():
+        return 0
+
+    replayed = 0
+
+    while True:
+        item = spool.first()
+        if item is None:
+            break
+
+        seq, meta, raw = item
+
+        try:
+            ok = await send(meta, raw)
+        except Exception as e:
+            print(f"❌ Spool replay error: {e}")
+            ok = False
+
+        if not ok:
+            breaker.record_failure()
+            break
+
+        breaker.record_success()
+        spool.remove(seq)
+        replayed += 1
+
+    return replayed
@@ -0,0 +1,120 @@
+"""
+بنچمارک بکاپ/ریستور با بک‌اند محلی (بدون شبکه):
+- توان آپلود بکاپ کامل در برابر delta برای یک سری ویرایش
+- زمان ریستور با manifest در برابر جستجو در پیام‌ها
+
+اجرا:
+    python bench_backup.py
+    python bench_backup.py 10000 200
+"""
+import asyncio
+import random
+import sys
+import tempfile
+import time
+
+import backup_delta
+import backup_manifest
+import snapshot_format
+from backup_backend import LocalBackupBackend
+from bench_snapshot import build_library
+
+CHAT_ID = -1001
+
+
+def _edit(db, rng, step):
+    node_id = rng.choice([n for n in db if n != "root"])
+    node = db[node_id]
+
+    if step % 3 == 0:
+        node["name"] += " *"
+    elif step % 3 == 1:
+        node.setdefault("contents", []).append({"type": "text", "caption": f"edit {step}"})
+    else:
+        new_id = f"bench-{step}"
+        db[new_id] = {"name": "پوشه جدید", "parent": node_id, "children": [], "contents": []}
+        node.setdefault("children", []).append(new_id)
+
+
+async def bench_uploads(backend, db, edits, mode):
+    rng = random.Random(7)
+    tracker = backup_delta.DeltaTracker(checkpoint_every=50)
+    total_bytes = 0
+    start = time.perf_counter()
+
+    for step in range(edits):
+        _edit(db, rng, step)
+
+        if mode == "delta" and not tracker.needs_checkpoint():
+            patch, raw = tracker.make_delta(db)
+            await backend.send_file(CHAT_ID, backup_delta.DELTA_FILENAME, raw, caption="database.json")
+            tracker.delta_uploaded(patch, raw)
+        else:
+            raw = snapshot_format.encode(db, "json")
+            message = await backend.send_file(CHAT_ID, "database.json", raw, caption="database.json")
+            if mode == "delta":
+                tracker.checkpoint_uploaded(snapshot_format.decode(raw), backup_delta.file_id(raw))
+
+            manifest = {"database.json": backup_manifest.make_entry(message.id, raw)}
+            pinned = await backend.get_pinned(CHAT_ID)
+            if pinned:
+                await backend.edit_message(CHAT_ID, pinned.id, backup_manifest.render(manifest))
+            else:
+                sent = await backend.send_message(CHAT_ID, backup_manifest.render(manifest))
+                await backend.pin_message(CHAT_ID, sent.id)
+
+        total_bytes += len(raw)
+
+    elapsed = time.perf_counter() - start
+    return elapsed, total_bytes
+
+
+async def bench_restore(backend):
+    # با manifest: یک پیام پین‌شده + یک دانلود مستقیم
+    start = time.perf_counter()
+    pinned = await backend.get_pinned(CHAT_ID)
+    entry = backup_manifest.parse(pinned.text)["database.json"]
+    message = (await backend.get_messages(CHAT_ID, [entry["msg_id"]]))[0]
+    raw = await backend.download(message)
+    assert backup_manifest.verify(entry, raw)
+    manifest_time = time.perf_counter() - start
+
+    # جستجو: از جدید به قدیم تا اولین database.json
+    start = time.perf_counter()
+    deltas = []
+    async for message in backend.iter_messages(CHAT_ID, limit=None):
+        if message.file_name == backup_delta.DELTA_FILENAME:
+            deltas.append(await backend.download(message))
+        elif message.file_name == "database.json":
+            raw = await backend.download(message)
+            break
+    deltas.reverse()
+    backup_delta.rebuild(snapshot_format.decode(raw), raw, deltas)
+    scan_time = time.perf_counter() - start
+
+    return manifest_time, scan_time, len(deltas)
+
+
+async def bench(nodes, edits):
+    print(f"{'mode':>6} {'edits':>6} {'upload s':>9} {'per edit ms':>12} {'MB sent':>8} "
+          f"{'manifest ms':>12} {'scan+replay ms':>15} {'deltas':>7}")
+
+    for mode in ("full", "delta"):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = LocalBackupBackend(tmp)
+            db = build_library(nodes)
+
+            elapsed, total_bytes = await bench_uploads(backend, db, edits, mode)
+            manifest_time, scan_time, delta_count = await bench_restore(backend)
+
+            print(
+                f"{mode:>6} {edits:>6} {elapsed:>9.2f} {elapsed / edits * 1000:>12.1f} "
+                f"{total_bytes / 1048576:>8.1f} {manifest_time * 1000:>12.1f} "
+                f"{scan_time * 1000:>15.1f} {delta_count:>7}"
+            )
+
+
+if __name__ == "__main__":
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    edits = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.run(bench(nodes, edits))
@@ -0,0 +1,130 @@
+"""
+میکروبنچمارک normalize_text روی یک پیکره‌ی فارسی پزشکی مصنوعی:
+- پیاده‌سازی قبلی (replaceهای پشت سر هم + re.sub با الگوی رشته‌ای) به عنوان مرجع
+- normalize_text فعلی بدون کش (اولین بار) و با کش (تکرار نام‌ها)
+- normalize_many
+خروجی همه‌ی نسخه‌ها با مرجع مقایسه می‌شود.
+
+اجرا:
+    python bench_normalize.py
+    python bench_normalize.py 200000
+"""
+import random
+import re
+import sys
+import time
+
+import smart_search
+from bench_snapshot import PERSIAN_WORDS
+
+EXTENSIONS = [".pdf", ".PDF", ".pptx", ".mp4", ".mp3", ".docx", ".jpg", ""]
+
+# واریانت‌های عربی/نیم‌فاصله که نرمال‌ساز باید یکدست کند
+VARIANTS = ["كتاب", "يادداشت", "آزمون", "بافت‌شناسی", "جنين‌شناسی", "ادرار_ها", "قلب-ریه", "مؤلف", "إسلاید", "جلسۀ", "صفحة"]
+
+
+def build_corpus(size, seed=11):
+    rng = random.Random(seed)
+    words = PERSIAN_WORDS + VARIANTS + [
+        term for key, values in smart_search.MEDICAL_SYNONYMS.items() for term in [key] + values
+    ]
+
+    def phrase(count):
+        return " ".join(rng.choice(words) for _ in range(count))
+
+    # نام پوشه‌ها زیاد تکرار می‌شوند؛ کپشن‌ها و متن‌ها بیشتر یکتا هستند
+    folder_names = [phrase(rng.randint(1, 3)) for _ in range(max(50, size // 50))]
+    corpus = []
+
+    for i in range(size):
+        kind = rng.random()
+        if kind < 0.4:
+            corpus.append(rng.choice(folder_names))
+        elif kind < 0.7:
+            corpus.append(f"{phrase(rng.randint(1, 4))} جلسه {rng.randint(1, 30)}{rng.choice(EXTENSIONS)}")
+        elif kind < 0.9:
+            corpus.append(f"<b>{phrase(3)}</b> {phrase(rng.randint(3, 15))} (صفحه {i % 300})!")
+        else:
+            corpus.append(phrase(rng.randint(10, 40)))
+
+    return corpus
+
+
+def legacy_normalize_text(text):
+    if not text:
+        return ""
+
+    text = str(text)
+    replacements = {
+        "ي": "ی",
+        "ك": "ک",
+        "ۀ": "ه",
+        "ة": "ه",
+        "ؤ": "و",
+        "إ": "ا",
+        "أ": "ا",
+        "آ": "ا",
+        "\u200c": " ",
+        "_": " ",
+        "-": " ",
+    }
+
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+
+    text = text.lower()
+    text = re.sub(r"<[^>]+>", " ", text)
+    text = re.sub(
+        r"\.(pdf|doc|docx|ppt|pptx|xls|xlsx|zip|rar|mp3|mp4|mkv|avi|jpg|jpeg|png)$",
+        " ",
+        text,
+        flags=re.IGNORECASE
+    )
+    text = re.sub(r"[^\w\sآ-ی]", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+
+    return text
+
+
+def _time(func, corpus):
+    start = time.perf_counter()
+    output = func(corpus)
+    return time.perf_counter() - start, output
+
+
+def bench(size):
+    corpus = build_corpus(size)
+    expected = [legacy_normalize_text(text) for text in corpus]
+
+    rows = []
+
+    legacy_time, _ = _time(lambda texts: [legacy_normalize_text(t) for t in texts], corpus)
+    rows.append(("legacy", legacy_time, True))
+
+    smart_search._normalize_cached.cache_clear()
+    uncached_time, output = _time(lambda texts: [smart_search._normalize(str(t)) for t in texts], corpus)
+    rows.append(("uncached", uncached_time, output == expected))
+
+    smart_search._normalize_cached.cache_clear()
+    cold_time, output = _time(lambda texts: [smart_search.normalize_text(t) for t in texts], corpus)
+    rows.append(("memo cold", cold_time, output == expected))
+
+    warm_time, output = _time(lambda texts: [smart_search.normalize_text(t) for t in texts], corpus)
+    rows.append(("memo warm", warm_time, output == expected))
+
+    many_time, output = _time(smart_search.normalize_many, corpus)
+    rows.append(("normalize_many", many_time, output == expected))
+
+    print(f"{size} strings, {sum(map(len, corpus)) / 1e6:.1f}M chars, "
+          f"cache {smart_search._normalize_cached.cache_info().currsize} entries")
+    print(f"{'variant':>15} {'ms':>9} {'us/str':>8} {'speedup':>8} {'same':>5}")
+
+    for name, elapsed, same in rows:
+        print(
+            f"{name:>15} {elapsed * 1000:>9.1f} {elapsed / size * 1e6:>8.2f} "
+            f"{legacy_time / elapsed:>7.1f}x {str(same):>5}"
+        )
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
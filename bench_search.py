@@ -0,0 +1,373 @@
+"""
+بنچمارک سرچ هوشمند روی کتابخانه‌ی مصنوعی:
+- زمان امتیازدهی کامل (همه‌ی نودها) در برابر پیش‌فیلتر توکن/سه‌حرفی
+- recall پیش‌فیلتر نسبت به امتیازدهی کامل:
+    top-k  : چه سهمی از k نتیجه‌ی اول امتیازدهی کامل در خروجی پیش‌فیلتر هست
+    strong : همان top-k فقط برای نتایج با امتیاز حداقل STRONG_SCORE
+    all    : چه سهمی از همه‌ی نتایج بالای min_score در مجموعه‌ی کاندیدها هست
+- حالت batch: امتیازدهی تکی (score_items) در برابر دسته‌ای (cdist + NumPy) روی همه‌ی
+  نودها، با و بدون score_cutoff، و بیشترین اختلاف امتیاز نسبت به مسیر تکی
+- حالت pool: تأخیر حلقه‌ی اصلی (شبیه ناوبری کاربران) وقتی چند کاربر هم‌زمان جستجو
+  می‌کنند، با اجرای مستقیم روی حلقه در برابر search_pool
+- حالت budget: تأخیر p50/p99 جستجوی کامل (بدون پیش‌فیلتر، بدترین حالت) با و بدون
+  time_budget، سهم نتایج ناقص و recall top-k نسبت به جستجوی بدون بودجه
+- حالت synonyms: بونوس مترادف همه‌ی آیتم‌ها (روی همه‌ی فایل‌ها/کپشن‌ها/متن‌ها) با
+  بررسی in تو در تو (پیاده‌سازی قبلی) در برابر یک پیمایش اتوماتای Aho-Corasick
+
+اجرا:
+    python bench_search.py
+    python bench_search.py 1000 10000 50000
+    python bench_search.py batch 10000 50000 200000
+    python bench_search.py pool 20000
+    python bench_search.py synonyms 20000
+    python bench_search.py budget 20000
+"""
+import asyncio
+import random
+import sys
+import time
+import uuid
+
+import smart_search
+from bench_snapshot import PERSIAN_WORDS
+from search_index import SearchIndex
+from search_pool import SearchPool
+
+LIMIT = 15
+MIN_SCORE = 45
+STRONG_SCORE = 80
+
+SYLLABLES = ["کا", "ر", "دی", "و", "لو", "ژی", "نو", "ما", "سا", "تو", "فا", "رم", "پا", "تی", "زا", "مو", "نه", "گی"]
+EXTENSIONS = [".pdf", ".pptx", ".mp4", ".mp3", ".docx"]
+
+
+def build_search_library(node_count, seed=1, max_depth=6):
+    """
+    کتابخانه‌ی مصنوعی نزدیک به واقعی برای سرچ: عمق محدود، واژگان بزرگ
+    (واژه‌های تخصصی + واژه‌های ساختگی) و فایل‌هایی با نام و کپشن.
+    """
+    rng = random.Random(seed)
+    vocabulary = PERSIAN_WORDS + [
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        for _ in range(max(200, node_count // 5))
+    ]
+
+    def words(count):
+        return " ".join(rng.choice(vocabulary) for _ in range(count))
+
+    db = {"root": {"name": "خانه", "parent": None, "children": [], "contents": []}}
+    depth = {"root": 0}
+    folders = ["root"]
+
+    for _ in range(node_count - 1):
+        parent = rng.choice(folders)
+        node_id = str(uuid.UUID(int=rng.getrandbits(128)))
+
+        contents = []
+        for _ in range(rng.randint(0, 4)):
+            item_type = rng.choice(["document", "video", "audio", "text"])
+            item = {"type": item_type, "caption": words(rng.randint(0, 8))}
+            if item_type == "text":
+                item["text"] = words(rng.randint(5, 15))
+            else:
+                item["file_name"] = f"{words(rng.randint(1, 3))} جلسه {rng.randint(1, 30)}{rng.choice(EXTENSIONS)}"
+            contents.append(item)
+
+        db[node_id] = {"name": words(rng.randint(1, 3)), "parent": parent, "children": [], "contents": contents}
+        db[parent]["children"].append(node_id)
+
+        depth[node_id] = depth[parent] + 1
+        if depth[node_id] < max_depth:
+            folders.append(node_id)
+
+    return db
+
+
+def _typo(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+def build_queries(count=12, seed=3):
+    rng = random.Random(seed)
+    queries = ["کالبد شناسی", "داروشناسی", "امتحان", "جزوه قلب", "pathology"]
+
+    while len(queries) < count:
+        words = rng.sample(PERSIAN_WORDS, rng.randint(1, 3))
+        if rng.random() < 0.3:
+            words[0] = _typo(words[0], rng)
+        queries.append(" ".join(words))
+
+    return queries
+
+
+def measure_recall(index, queries, scope="root", limit=LIMIT, min_score=MIN_SCORE):
+    """
+    -> (top-k recall, strong recall, all-results recall, میانگین تعداد کاندیدها)
+    """
+    topk_hit = topk_total = strong_hit = strong_total = all_hit = all_total = candidate_total = 0
+
+    for query in queries:
+        full = index.search(query, scope, limit=None, min_score=min_score, prefilter=False)
+        fast = index.search(query, scope, limit=limit, min_score=min_score)
+        candidates = index.candidates(query, scope)
+
+        found = {r["node_id"] for r in fast}
+        expected = {r["node_id"] for r in full[:limit]}
+        topk_hit += len(expected & found)
+        topk_total += len(expected)
+
+        strong = {r["node_id"] for r in full[:limit] if r["score"] >= STRONG_SCORE}
+        strong_hit += len(strong & found)
+        strong_total += len(strong)
+
+        all_hit += sum(1 for r in full if r["node_id"] in candidates)
+        all_total += len(full)
+        candidate_total += len(candidates)
+
+    return (
+        topk_hit / topk_total if topk_total else 1.0,
+        strong_hit / strong_total if strong_total else 1.0,
+        all_hit / all_total if all_total else 1.0,
+        candidate_total / len(queries),
+    )
+
+
+def _time(index, queries, prefilter):
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query, limit=LIMIT, min_score=MIN_SCORE, prefilter=prefilter)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def bench(sizes):
+    queries = build_queries()
+
+    print(f"{'nodes':>8} {'build s':>8} {'full ms':>9} {'prefilter ms':>13} "
+          f"{'candidates':>11} {'top-k recall':>13} {'strong recall':>14} {'all recall':>11}")
+
+    for size in sizes:
+        db = build_search_library(size)
+
+        start = time.perf_counter()
+        index = SearchIndex().build(db)
+        build_time = time.perf_counter() - start
+
+        full_time = _time(index, queries, prefilter=False)
+        fast_time = _time(index, queries, prefilter=True)
+        topk_recall, strong_recall, all_recall, candidates = measure_recall(index, queries)
+
+        print(
+            f"{size:>8} {build_time:>8.2f} {full_time * 1000:>9.1f} {fast_time * 1000:>13.1f} "
+            f"{candidates:>11.0f} {topk_recall:>13.3f} {strong_recall:>14.3f} {all_recall:>11.3f}"
+        )
+
+
+def _max_score_diff(expected, actual):
+    """
+    بیشترین اختلاف امتیاز رتبه به رتبه‌ی top-k (رتبه‌ی خالی = ۰)
+    """
+    expected_scores = [r["score"] for r in expected]
+    actual_scores = [r["score"] for r in actual]
+    size = max(len(expected_scores), len(actual_scores))
+
+    expected_scores += [0] * (size - len(expected_scores))
+    actual_scores += [0] * (size - len(actual_scores))
+
+    return max((abs(a - b) for a, b in zip(expected_scores, actual_scores)), default=0)
+
+
+def bench_batch(sizes, query_count=3, score_cutoff=40):
+    queries = build_queries()[:query_count]
+
+    print(f"{'nodes':>8} {'scalar ms':>10} {'batch ms':>9} {'speedup':>8} "
+          f"{'cutoff ms':>10} {'max diff':>9} {'cutoff diff':>12}")
+
+    for size in sizes:
+        index = SearchIndex().build(build_search_library(size))
+        timings = {"scalar": 0.0, "batch": 0.0, "cutoff": 0.0}
+        diff = cutoff_diff = 0
+
+        for query in queries:
+            start = time.perf_counter()
+            scalar = index.search(query, limit=LIMIT, min_score=MIN_SCORE, prefilter=False)
+            timings["scalar"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            batch = index.search(query, limit=LIMIT, min_score=MIN_SCORE, prefilter=False, batch=True)
+            timings["batch"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            cutoff = index.search(
+                query, limit=LIMIT, min_score=MIN_SCORE, prefilter=False,
+                batch=True, score_cutoff=score_cutoff,
+            )
+            timings["cutoff"] += time.perf_counter() - start
+
+            diff = max(diff, _max_score_diff(scalar, batch))
+            cutoff_diff = max(cutoff_diff, _max_score_diff(scalar, cutoff))
+
+        scalar_ms, batch_ms, cutoff_ms = (timings[key] / len(queries) * 1000 for key in ("scalar", "batch", "cutoff"))
+        print(
+            f"{size:>8} {scalar_ms:>10.1f} {batch_ms:>9.1f} {scalar_ms / batch_ms:>7.1f}x "
+            f"{cutoff_ms:>10.1f} {diff:>9} {cutoff_diff:>12}"
+        )
+
+
+async def _loop_lag(stop, interval=0.01):
+    """
+    -> (میانگین، بیشترین) تأخیر بیدار شدن یک تسک ۱۰ میلی‌ثانیه‌ای (ms)
+    """
+    lags = []
+    loop = asyncio.get_running_loop()
+
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - start - interval) * 1000)
+
+    return (sum(lags) / len(lags), max(lags)) if lags else (0.0, 0.0)
+
+
+async def _concurrent_searches(index, pool, users):
+    queries = build_queries()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_loop_lag(stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        pool.run(user, index.search, queries[user % len(queries)], limit=LIMIT, min_score=MIN_SCORE, batch=True)
+        for user in range(users)
+    ))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    mean_lag, max_lag = await lag_task
+    return elapsed, mean_lag, max_lag
+
+
+def bench_pool(sizes, users=6):
+    print(f"{'nodes':>8} {'workers':>8} {'users':>6} {'total s':>8} {'loop lag ms':>12} {'max lag ms':>11}")
+
+    for size in sizes:
+        index = SearchIndex().build(build_search_library(size))
+
+        for workers in (0, 2):
+            pool = SearchPool(workers=workers, max_in_flight=4, per_user_limit=1)
+            elapsed, mean_lag, max_lag = asyncio.run(_concurrent_searches(index, pool, users))
+            pool.shutdown()
+
+            print(f"{size:>8} {workers:>8} {users:>6} {elapsed:>8.2f} {mean_lag:>12.1f} {max_lag:>11.1f}")
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def bench_budget(sizes, budgets=(None, 0.2, 0.05), query_count=30):
+    queries = build_queries(query_count)
+
+    print(f"{'nodes':>8} {'budget ms':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'partial':>8} {'top-k recall':>13}")
+
+    for size in sizes:
+        index = SearchIndex().build(build_search_library(size))
+        expected = {
+            query: {r["node_id"] for r in index.search(query, limit=LIMIT, min_score=MIN_SCORE, prefilter=False)}
+            for query in queries
+        }
+
+        for budget in budgets:
+            latencies = []
+            partial = hit = total = 0
+
+            for query in queries:
+                start = time.perf_counter()
+                results = index.search(query, limit=LIMIT, min_score=MIN_SCORE, prefilter=False, time_budget=budget)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+                partial += results.partial
+                hit += len(expected[query] & {r["node_id"] for r in results})
+                total += len(expected[query])
+
+            budget_label = f"{budget * 1000:.0f}" if budget else "-"
+            print(
+                f"{size:>8} {budget_label:>10} {_percentile(latencies, 0.5):>8.1f} "
+                f"{_percentile(latencies, 0.99):>8.1f} {max(latencies):>8.1f} "
+                f"{partial / len(queries):>8.2f} {hit / total if total else 1.0:>13.3f}"
+            )
+
+
+def _nested_synonym_bonus(synonym_terms, item):
+    synonym_bonus = 0
+    for term in synonym_terms:
+        if any(term in f_name for f_name in item["file_names_norm"]):
+            synonym_bonus += 8
+        elif term in item["node_name_norm"]:
+            synonym_bonus += 6
+        elif term in item["path_norm"]:
+            synonym_bonus += 4
+        elif any(term in caption for caption in item["captions_norm"]):
+            synonym_bonus += 3
+        elif any(term in txt for txt in item["short_texts_norm"]):
+            synonym_bonus += 2
+    return synonym_bonus
+
+
+def _automaton_synonym_bonus(synonym_automaton, item):
+    return smart_search._synonym_bonus(synonym_automaton, (
+        item["file_names_norm"], [item["node_name_norm"]], [item["path_norm"]],
+        item["captions_norm"], item["short_texts_norm"],
+    ))
+
+
+def bench_synonyms(sizes):
+    queries = build_queries() + ["نمونه سوال داخلی", "جزوه زنان و زایمان", "ویس جلسه قلب"]
+
+    print(f"{'nodes':>8} {'terms':>6} {'nested ms':>10} {'automaton ms':>13} {'speedup':>8} {'same':>5}")
+
+    for size in sizes:
+        items = smart_search.flatten_db_for_search(build_search_library(size))
+        nested_time = automaton_time = 0.0
+        term_count = 0
+        same = True
+
+        for query in queries:
+            query_norm = smart_search.normalize_text(query)
+            synonym_terms = [t for t in smart_search.expand_query_terms(query) if t and t != query_norm]
+            term_count += len(synonym_terms)
+
+            start = time.perf_counter()
+            expected = [_nested_synonym_bonus(synonym_terms, item) for item in items]
+            nested_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            synonym_automaton = smart_search.build_term_automaton(synonym_terms)
+            actual = [_automaton_synonym_bonus(synonym_automaton, item) for item in items]
+            automaton_time += time.perf_counter() - start
+
+            same = same and expected == actual
+
+        nested_ms, automaton_ms = (t / len(queries) * 1000 for t in (nested_time, automaton_time))
+        print(
+            f"{size:>8} {term_count / len(queries):>6.1f} {nested_ms:>10.1f} {automaton_ms:>13.1f} "
+            f"{nested_ms / automaton_ms:>7.1f}x {str(same):>5}"
+        )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    if args and args[0] == "budget":
+        bench_budget([int(arg) for arg in args[1:]] or [20000])
+    elif args and args[0] == "synonyms":
+        bench_synonyms([int(arg) for arg in args[1:]] or [20000])
+    elif args and args[0] == "pool":
+        bench_pool([int(arg) for arg in args[1:]] or [20000])
+    elif args and args[0] == "batch":
+        bench_batch([int(arg) for arg in args[1:]] or [10000, 50000, 200000])
+    else:
+        bench([int(arg) for arg in args] or [1000, 5000])
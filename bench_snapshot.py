@@ -0,0 +1,102 @@
+"""
+بنچمارک فرمت‌های snapshot دیتابیس (زمان save / load و حجم فایل).
+
+اجرا:
+    python bench_snapshot.py
+    python bench_snapshot.py 1000 10000 50000
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+import snapshot_format
+
+
+PERSIAN_WORDS = [
+    "قلب", "ریه", "کلیه", "کبد", "مغز", "اعصاب", "فارماکولوژی", "فیزیولوژی",
+    "آناتومی", "پاتولوژی", "جزوه", "خلاصه", "نمونه", "سوال", "آزمون", "درسنامه",
+    "داخلی", "جراحی", "اطفال", "زنان", "عفونی", "رادیولوژی", "بیوشیمی", "ایمنی",
+]
+
+
+def _name(rng, words=3):
+    return " ".join(rng.choice(PERSIAN_WORDS) for _ in range(words))
+
+
+def build_library(node_count, seed=1):
+    """
+    درخت مصنوعی با ساختار database.json واقعی (نام فارسی، کپشن و entities).
+    """
+    rng = random.Random(seed)
+    db = {"root": {"name": "خانه", "parent": None, "children": [], "contents": []}}
+    ids = ["root"]
+
+    for _ in range(node_count - 1):
+        parent = rng.choice(ids[-200:])
+        node_id = str(uuid.UUID(int=rng.getrandbits(128)))
+
+        contents = []
+        for _ in range(rng.randint(0, 4)):
+            caption = _name(rng, rng.randint(4, 20))
+            contents.append({
+                "type": rng.choice(["document", "photo", "video", "text"]),
+                "file_id": "BQACAgQAAxkBAAI" + uuid.UUID(int=rng.getrandbits(128)).hex,
+                "caption": caption,
+                "caption_entities": [
+                    {"type": "bold", "offset": 0, "length": min(len(caption), 8)}
+                ],
+            })
+
+        db[node_id] = {
+            "name": _name(rng),
+            "parent": parent,
+            "children": [],
+            "contents": contents,
+        }
+        db[parent]["children"].append(node_id)
+        ids.append(node_id)
+
+    return db
+
+
+def _best_of(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench(sizes):
+    print(f"{'nodes':>8} {'format':>8} {'size KB':>10} {'save ms':>9} {'load ms':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.json")
+
+        for size in sizes:
+            db = build_library(size)
+
+            for fmt in snapshot_format.FORMATS:
+                def save():
+                    with open(path, "wb") as f:
+                        f.write(snapshot_format.encode(db, fmt))
+
+                def load():
+                    with open(path, "rb") as f:
+                        snapshot_format.decode(f.read())
+
+                save_time = _best_of(save)
+                load_time = _best_of(load)
+                size_kb = os.path.getsize(path) / 1024
+
+                print(f"{size:>8} {fmt:>8} {size_kb:>10.1f} {save_time * 1000:>9.1f} {load_time * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(x) for x in sys.argv[1:]] or [1000, 10000, 50000]
+    bench(sizes)
@@ -0,0 +1,228 @@
+import uuid
+
+import library_ops
+
+
+# =========================================================
+# ویرایش‌های ادمین روی درخت کتابخانه
+# =========================================================
+# هر تابع دیکشنری زنده (خروجی load_db) را درجا تغییر می‌دهد و رکوردهای library_ops
+# همان تغییر را برمی‌گرداند تا هندلر به save_db(..., ops=...) بدهد.
+# با ژورنال روشن، بعد از ری‌استارت کتابخانه فقط از snapshot + همین رکوردها ساخته
+# می‌شود؛ پس تغییر درجا و رکوردها کنار هم در یک جا نوشته می‌شوند و تست‌ها بررسی
+# می‌کنند که apply_op روی snapshot دقیقاً به همان دیکشنری تغییرکرده برسد.
+
+
+def delete_node_recursive(db, node_id):
+    # اگر نود وجود نداشت
+    if node_id not in db:
+        return
+
+    # اول بچه‌هاش رو حذف کن
+    children = db[node_id].get("children", [])
+    for child_id in children:
+        delete_node_recursive(db, child_id)
+
+    # بعد خود نود
+    del db[node_id]
+
+
+def cleanup_node_layout(node: dict):
+    """
+    لایوت پوشه را با children سینک می‌کند:
+    - هر دکمه‌ای که دیگر در children نیست از layout حذف می‌شود
+    - ردیف‌های خالی حذف می‌شوند
+    - اگر layout خالی شد، کل فیلد layout حذف می‌شود
+    """
+    children = node.get("children", [])
+    layout = node.get("layout")
+
+    if not layout:
+        return
+
+    valid_children = set(children)
+    cleaned_layout = []
+
+    for row in layout:
+        if not isinstance(row, list):
+            continue
+        cleaned_row = [child_id for child_id in row if child_id in valid_children]
+        if cleaned_row:
+            cleaned_layout.append(cleaned_row)
+
+    if cleaned_layout:
+        node["layout"] = cleaned_layout
+    else:
+        node.pop("layout", None)
+
+
+def _layout_op(node_id, node):
+    """
+    رکورد وضعیت فعلی layout نود (بعد از cleanup_node_layout).
+    """
+    if "layout" in node:
+        return library_ops.set_fields(node_id, {"layout": node["layout"]})
+    return library_ops.set_fields(node_id, unset=["layout"])
+
+
+# ---------- دکمه‌ها (نودها) ----------
+def add_child(db, parent_id, name, node_id=None):
+    """
+    دکمه‌ی جدید خالی زیر parent_id -> (شناسه‌ی نود جدید، رکوردها)
+    """
+    node_id = node_id or str(uuid.uuid4())
+    db[node_id] = {
+        "name": name,
+        "parent": parent_id,
+        "children": [],
+        "contents": []
+    }
+    db[parent_id]["children"].append(node_id)
+
+    return node_id, [library_ops.add_node(node_id, db[node_id])]
+
+
+def clone_subtree(db, source_id, parent_id, new_id=None):
+    """
+    کپی کامل source_id و همه‌ی زیرشاخه‌هایش زیر parent_id -> (شناسه‌ی ریشه‌ی کپی، رکوردها)
+    new_id: تابع ساخت شناسه‌ی جدید (پیش‌فرض uuid4)
+    """
+    new_id = new_id or (lambda: str(uuid.uuid4()))
+
+    def clone_node(old_id, new_parent):
+        node_id = new_id()
+        old = db[old_id]
+
+        # 💡 کپی کردن تمام فیلدها از جمله style
+        db[node_id] = {
+            "name": old["name"],
+            "parent": new_parent,
+            "children": [],
+            "contents": old.get("contents", []).copy(),
+            "style": old.get("style")
+        }
+
+        for child in old.get("children", []):
+            child_new_id = clone_node(child, node_id)
+            db[node_id]["children"].append(child_new_id)
+
+        return node_id
+
+    root_id = clone_node(source_id, parent_id)
+    db[parent_id]["children"].append(root_id)
+
+    # هر نود کپی‌شده یک رکورد add_node (والد قبل از فرزندان)
+    ops = []
+    stack = [root_id]
+    while stack:
+        node_id = stack.pop()
+        ops.append(library_ops.add_node(node_id, db[node_id]))
+        stack.extend(db[node_id]["children"])
+
+    return root_id, ops
+
+
+def rename(db, node_id, name):
+    db[node_id]["name"] = name
+    return [library_ops.rename(node_id, name)]
+
+
+def delete_child(db, parent_id, child_id):
+    """
+    حذف دکمه و کل زیرشاخه‌اش از parent_id (و پاکسازی چیدمان والد)
+    """
+    db[parent_id]["children"].remove(child_id)
+    cleanup_node_layout(db[parent_id])
+    delete_node_recursive(db, child_id)
+
+    return [
+        library_ops.delete_subtree(child_id, parent_id),
+        _layout_op(parent_id, db[parent_id]),
+    ]
+
+
+def reorder_children(db, node_id, children):
+    db[node_id]["children"] = children
+    return [library_ops.set_children(node_id, children)]
+
+
+# ---------- ظاهر پوشه ----------
+def set_layout(db, node_id, layout):
+    """
+    چیدمان دستی؛ ترتیب children هم به ترتیب همین چیدمان می‌شود
+    """
+    ordered_children = [child_id for row in layout for child_id in row]
+
+    db[node_id]["layout"] = layout
+    db[node_id]["children"] = ordered_children
+
+    return [
+        library_ops.set_fields(node_id, {"layout": layout}),
+        library_ops.set_children(node_id, ordered_children),
+    ]
+
+
+def remove_layout(db, node_id):
+    db[node_id].pop("layout", None)
+    return [library_ops.set_fields(node_id, unset=["layout"])]
+
+
+def set_row_count(db, node_id, count):
+    db[node_id]["row_count"] = count
+    return [library_ops.set_fields(node_id, {"row_count": count})]
+
+
+def set_style(db, node_id, style):
+    """
+    style=None: حذف رنگ
+    """
+    if style is None:
+        db[node_id].pop("style", None)
+        return [library_ops.set_fields(node_id, unset=["style"])]
+
+    db[node_id]["style"] = style
+    return [library_ops.set_fields(node_id, {"style": style})]
+
+
+# ---------- محتوا ----------
+def append_contents(db, node_id, items):
+    contents = db[node_id].setdefault("contents", [])
+    ops = [library_ops.append_contents(node_id, items, len(contents))]
+    contents.extend(items)
+    return ops
+
+
+def remove_contents(db, node_id, index, count):
+    """
+    حذف contents[index:index+count] -> (موارد حذف‌شده، رکوردها)
+    """
+    contents = db[node_id]["contents"]
+    removed = contents[index:index + count]
+    ops = [library_ops.remove_contents(node_id, index, len(removed), len(contents))]
+    del contents[index:index + count]
+    return removed, ops
+
+
+def clear_contents(db, node_id):
+    """
+    حذف همه‌ی محتوای پوشه -> (موارد حذف‌شده، رکوردها)
+    """
+    removed = list(db[node_id].get("contents", []))
+    db[node_id]["contents"] = []
+    return removed, [library_ops.remove_contents(node_id, 0, len(removed), len(removed))]
+
+
+def replace_contents(db, node_id, index, count, items):
+    """
+    جایگزینی contents[index:index+count] با items -> (موارد قبلی، رکوردها)
+    """
+    contents = db[node_id]["contents"]
+    old_items = contents[index:index + count]
+    old_len = len(contents)
+    ops = [
+        library_ops.remove_contents(node_id, index, len(old_items), old_len),
+        library_ops.insert_contents(node_id, index, items, old_len - len(old_items)),
+    ]
+
+    contents[index:index + count] = items
+    return old_items, ops
@@ -0,0 +1,157 @@
+import copy
+
+
+# =========================================================
+# تغییرات تایپ‌دار روی درخت کتابخانه (برای ژورنال و نوشتن ردیفی)
+# =========================================================
+# هر تغییر یک دیکشنری ساده و JSON‌پذیر است: {"op": نوع، ...}
+# هندلرها اول دیکشنری حافظه را تغییر می‌دهند و بعد همین رکوردها را به save_db می‌دهند.
+# apply_op باید دقیقاً همان تغییر را روی snapshot تکرار کند (هنگام replay ژورنال).
+#
+# تغییرات محتوا expected_len دارند: اگر طول فعلی با آن نخواند، رکورد قبلاً
+# اعمال شده و دوباره اعمال نمی‌شود (replay دوباره‌ی ژورنال امن است).
+
+
+def add_node(node_id, node):
+    return {"op": "add_node", "node_id": node_id, "node": copy.deepcopy(node)}
+
+
+def rename(node_id, name):
+    return {"op": "rename", "node_id": node_id, "name": name}
+
+
+def delete_subtree(node_id, parent_id):
+    return {"op": "delete_subtree", "node_id": node_id, "parent": parent_id}
+
+
+def append_contents(node_id, items, expected_len):
+    return {
+        "op": "append_contents",
+        "node_id": node_id,
+        "items": copy.deepcopy(items),
+        "expected_len": expected_len,
+    }
+
+
+def remove_contents(node_id, index, count, expected_len):
+    return {
+        "op": "remove_contents",
+        "node_id": node_id,
+        "index": index,
+        "count": count,
+        "expected_len": expected_len,
+    }
+
+
+def insert_contents(node_id, index, items, expected_len):
+    return {
+        "op": "insert_contents",
+        "node_id": node_id,
+        "index": index,
+        "items": copy.deepcopy(items),
+        "expected_len": expected_len,
+    }
+
+
+def set_children(node_id, children):
+    return {"op": "set_children", "node_id": node_id, "children": list(children)}
+
+
+def set_fields(node_id, fields=None, unset=None):
+    """
+    برای style / layout / row_count و سایر کلیدهای ساده‌ی نود.
+    """
+    return {
+        "op": "set_fields",
+        "node_id": node_id,
+        "fields": copy.deepcopy(fields or {}),
+        "unset": list(unset or []),
+    }
+
+
+# ---------- اعمال روی دیکشنری ----------
+def _collect_subtree(data, node_id):
+    result = []
+    stack = [node_id]
+
+    while stack:
+        current = stack.pop()
+        node = data.get(current)
+        if not node:
+            continue
+        result.append(current)
+        stack.extend(node.get("children", []))
+
+    return result
+
+
+def apply_op(data, op):
+    kind = op["op"]
+    node_id = op["node_id"]
+
+    if kind == "add_node":
+        node = copy.deepcopy(op["node"])
+        data[node_id] = node
+
+        parent = data.get(node.get("parent"))
+        if parent is not None and node_id not in parent.setdefault("children", []):
+            parent["children"].append(node_id)
+        return
+
+    if kind == "delete_subtree":
+        parent = data.get(op.get("parent"))
+        if parent is not None and node_id in parent.get("children", []):
+            parent["children"].remove(node_id)
+
+        for sub_id in _collect_subtree(data, node_id):
+            data.pop(sub_id, None)
+        return
+
+    node = data.get(node_id)
+    if node is None:
+        return
+
+    if kind == "rename":
+        node["name"] = op["name"]
+
+    elif kind == "set_children":
+        node["children"] = list(op["children"])
+
+    elif kind == "set_fields":
+        node.update(copy.deepcopy(op["fields"]))
+        for key in op["unset"]:
+            node.pop(key, None)
+
+    elif kind in ("append_contents", "remove_contents", "insert_contents"):
+        contents = node.setdefault("contents", [])
+        if len(contents) != op["expected_len"]:
+            return
+
+        if kind == "append_contents":
+            contents.extend(copy.deepcopy(op["items"]))
+        elif kind == "remove_contents":
+            del contents[op["index"]: op["index"] + op["count"]]
+        else:
+            contents[op["index"]:op["index"]] = copy.deepcopy(op["items"])
+
+    else:
+        raise ValueError(f"unknown library op: {kind}")
+
+
+def touched_nodes(ops):
+    """
+    نودهایی که ردیفشان ممکن است عوض شده باشد (برای موتور SQLite).
+    """
+    result = set()
+
+    for op in ops:
+        result.add(op["node_id"])
+
+        if op["op"] == "add_node":
+            parent = op["node"].get("parent")
+            if parent:
+                result.add(parent)
+        elif op["op"] == "delete_subtree" and op.get("parent"):
+            result.add(op["parent"])
+
+    return result
@@ -0,0 +1,625 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import snapshot_format
+from library_ops import apply_op, touched_nodes
+
+
+# =========================================================
+# ۱) نگهداری درخت کتابخانه در حافظه (به جای خواندن فایل در هر هندلر)
+# =========================================================
+class LibraryStore:
+    """
+    درخت کتابخانه را یک بار از فایل می‌خواند و در حافظه نگه می‌دارد.
+
+    - هر ذخیره‌ی موفق، شمارنده generation را یکی بالا می‌برد.
+    - فقط وقتی فایل روی دیسک عوض شده باشد (mtime / size / inode)
+      دوباره از دیسک خوانده می‌شود.
+    - خروجی load یک دیکشنری مشترک است؛ هرکس آن را تغییر می‌دهد
+      باید در پایان save را صدا بزند.
+
+    ژورنال (اگر journal_path داده شود):
+    - save با ops فقط همان تغییرات تایپ‌دار را به انتهای ژورنال اضافه و fsync می‌کند.
+    - فشرده‌سازی (compaction) ژورنال را در snapshot جدید (database.json) ادغام می‌کند.
+    - خط اول هر ژورنال hash همان snapshotی است که روی آن replay می‌شود؛
+      پس اگر وسط فشرده‌سازی کرش شود، ژورنال کهنه دوباره اعمال نمی‌شود.
+    """
+
+    def __init__(self, path, journal_path=None, compact_every=200, fmt="json"):
+        self.path = path
+        # فرمت نوشتن snapshot (خواندن همیشه خودکار تشخیص داده می‌شود)
+        self.fmt = fmt
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.generation = 0
+        self._data = None
+        self._signature = None
+        self._base_hash = None
+        self._journal_records = 0
+        self._pending = None
+        self._lock = threading.RLock()
+        # ترتیب قفل‌ها همیشه: اول _write_lock بعد _lock
+        self._write_lock = threading.RLock()
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get_cached(self):
+        """
+        اگر نسخه حافظه هنوز با فایل روی دیسک یکی است همان را برمی‌گرداند،
+        در غیر این صورت None.
+        """
+        with self._lock:
+            signature = self._file_signature()
+            if self._data is not None and signature is not None and signature == self._signature:
+                return self._data
+
+        return None
+
+    def reload(self):
+        with self._lock:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+
+            data = snapshot_format.decode(raw)
+            self._base_hash = hashlib.sha1(raw).hexdigest()
+            self._journal_records = self._replay(data)
+
+            self._data = data
+            self._signature = self._file_signature()
+            self.generation += 1
+            return data
+
+    # ---------- ژورنال ----------
+    def _read_journal(self, path):
+        """
+        خروجی: (base_hash, [ops]) ؛ خط ناقص انتهایی (کرش حین نوشتن) نادیده گرفته می‌شود.
+        """
+        if not path or not os.path.exists(path):
+            return None, []
+
+        base = None
+        ops = []
+
+        with open(path, "r", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+
+                if i == 0:
+                    base = record.get("base")
+                else:
+                    ops.append(record)
+
+        return base, ops
+
+    def _replay(self, data):
+        if not self.journal_path:
+            return 0
+
+        count = 0
+        old_base, old_ops = self._read_journal(f"{self.journal_path}.old")
+        base, ops = self._read_journal(self.journal_path)
+
+        # ژورنال کهنه فقط وقتی که فشرده‌سازی نیمه‌کاره مانده باشد
+        replayed_old = old_base is not None and old_base == self._base_hash
+        if replayed_old:
+            for op in old_ops:
+                apply_op(data, op)
+            count += len(old_ops)
+
+        if base is not None and (base == self._base_hash or replayed_old):
+            for op in ops:
+                apply_op(data, op)
+            count += len(ops)
+
+        if count:
+            print(f"📜 Replayed {count} journal records")
+
+        return count
+
+    def _append_journal(self, ops):
+        is_new = not os.path.exists(self.journal_path)
+
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            if is_new:
+                f.write(json.dumps({"base": self._base_hash}) + "\n")
+            for op in ops:
+                f.write(json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._journal_records += len(ops)
+
+    def needs_compaction(self):
+        return bool(self.journal_path) and self._pending is None and self._journal_records >= self.compact_every
+
+    def take_compaction(self):
+        """
+        روی ترد حلقه اصلی: serialize وضعیت فعلی + چرخاندن ژورنال.
+        از این لحظه تغییرات تازه در ژورنال جدید (بر پایه snapshot جدید) نوشته می‌شوند.
+        """
+        with self._lock:
+            if self._data is None or self._pending is not None:
+                return False
+
+            payload = snapshot_format.encode(self._data, self.fmt)
+
+            if self.journal_path and os.path.exists(self.journal_path):
+                os.replace(self.journal_path, f"{self.journal_path}.old")
+
+            self._base_hash = hashlib.sha1(payload).hexdigest()
+            self._journal_records = 0
+            self._pending = payload
+            return True
+
+    def write_compaction(self):
+        """
+        نوشتن snapshot گرفته‌شده؛ می‌تواند داخل ترد جدا اجرا شود.
+        """
+        with self._write_lock:
+            payload = self._pending
+            if payload is None:
+                return
+
+            tmp_path = f"{self.path}.tmp"
+
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with self._lock:
+                os.replace(tmp_path, self.path)
+                self._signature = self._file_signature()
+                self._pending = None
+
+            if self.journal_path and os.path.exists(f"{self.journal_path}.old"):
+                os.remove(f"{self.journal_path}.old")
+
+    def _write_full(self):
+        with self._write_lock:
+            # اگر فشرده‌سازی پس‌زمینه هنوز نوشته نشده، اول همان
+            self.write_compaction()
+            if self.take_compaction():
+                self.write_compaction()
+
+    def compact(self):
+        """
+        ادغام فوری ژورنال در snapshot (اگر رکوردی باشد).
+        """
+        with self._write_lock:
+            self.write_compaction()
+            if self._journal_records:
+                self._write_full()
+
+    # ---------- ذخیره ----------
+    def save(self, data, ops=None):
+        """
+        ops: لیست تغییرات تایپ‌دار (library_ops). اگر ژورنال فعال باشد فقط همین‌ها نوشته می‌شوند؛
+        بدون ops (ریستور، undo/redo) کل snapshot بازنویسی می‌شود.
+        """
+        with self._lock:
+            journal_ready = (
+                self.journal_path
+                and ops is not None
+                and self._data is data
+                and self._base_hash is not None
+            )
+
+            if journal_ready:
+                if ops:
+                    self._append_journal(ops)
+                self.generation += 1
+                return
+
+        with self._write_lock:
+            with self._lock:
+                self._data = data
+            self._write_full()
+            self.generation += 1
+
+    # ---------- رابط مشترک با موتور SQLite ----------
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def view(self):
+        """
+        دسترسی خواندنی به نودها (برای هندلرهای پرتکرار).
+        در موتور JSON همان دیکشنری حافظه است.
+        """
+        data = self.get_cached()
+        if data is None:
+            data = self.reload()
+        return data
+
+    def take_backup_snapshot(self):
+        """
+        روی ترد حلقه اصلی: اگر ژورنال رکورد دارد، snapshot جدید گرفته می‌شود.
+        فایل snapshot خودش همان فایل بکاپ است.
+        """
+        with self._write_lock:
+            if self._journal_records:
+                # فشرده‌سازی پس‌زمینه‌ی نیمه‌کاره اول نوشته شود
+                self.write_compaction()
+                self.take_compaction()
+        return self.path
+
+    def write_backup_snapshot(self, token):
+        """
+        می‌تواند داخل ترد جدا اجرا شود؛ مسیر فایل آماده‌ی آپلود را برمی‌گرداند.
+        """
+        self.write_compaction()
+        return self.path
+
+    def write_backup_file(self):
+        return self.write_backup_snapshot(self.take_backup_snapshot())
+
+
+# =========================================================
+# ۲) موتور SQLite (اختیاری): هر نود یک ردیف، هر محتوا یک ردیف
+# =========================================================
+_LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id TEXT PRIMARY KEY,
+    parent TEXT,
+    position INTEGER,
+    name TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_parent ON nodes(parent, position);
+
+CREATE TABLE IF NOT EXISTS contents (
+    node_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (node_id, position)
+);
+"""
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class NodeView:
+    """
+    نمای فقط‌خواندنی شبیه dict روی جدول nodes؛
+    هر نود فقط وقتی لازم شد (با کلید اصلی) خوانده می‌شود.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._nodes = {}
+
+    def get(self, node_id, default=None):
+        if node_id not in self._nodes:
+            self._nodes[node_id] = self._store.get_node(node_id)
+
+        node = self._nodes[node_id]
+        return default if node is None else node
+
+    def __getitem__(self, node_id):
+        node = self.get(node_id)
+        if node is None:
+            raise KeyError(node_id)
+        return node
+
+    def __contains__(self, node_id):
+        return self.get(node_id) is not None
+
+    def menu(self, node_id):
+        return self._store.get_menu(node_id)
+
+
+def node_menu(view, node_id):
+    """
+    (متادیتای نود، [(id فرزند، متادیتای فرزند) ...]) برای ساخت کیبورد؛
+    در موتور SQLite جدول contents اصلاً خوانده نمی‌شود. نود ناموجود: None
+    """
+    if isinstance(view, NodeView):
+        return view.menu(node_id)
+
+    node = view.get(node_id)
+    if node is None:
+        return None
+    children = [(c_id, view[c_id]) for c_id in node.get("children", []) if c_id in view]
+    return node, children
+
+
+class SqliteLibraryStore:
+    """
+    درخت کتابخانه داخل SQLite:
+    - nodes: هر نود یک ردیف، با ایندکس (parent, position) برای ترتیب دکمه‌ها
+    - contents: هر آیتم محتوا یک ردیف، به ترتیب position
+
+    هندلرهای پرتکرار با get_node / view فقط نود لازم را می‌خوانند.
+    load (برای جستجو و ویرایش ادمین) کل درخت را یک بار در حافظه می‌سازد.
+    در save فقط ردیف‌هایی که واقعاً عوض شده‌اند نوشته می‌شوند.
+
+    فایل JSON (self.path) فقط برای بکاپ تلگرام و ریستور ساخته می‌شود.
+    """
+
+    def __init__(self, path, db_path, fmt="json"):
+        self.path = path
+        self.fmt = fmt
+        self.db_path = db_path
+        self.generation = 0
+        self._data = None
+        self._conn = None
+        # اثر انگشت آخرین وضعیت نوشته‌شده هر نود: (ردیف نود، [محتواها])
+        self._fingerprints = None
+        self._lock = threading.RLock()
+
+    def exists(self):
+        return os.path.exists(self.db_path) or os.path.exists(self.path)
+
+    def _db(self):
+        with self._lock:
+            if self._conn is not None:
+                return self._conn
+
+            is_new = not os.path.exists(self.db_path)
+
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_LIBRARY_SCHEMA)
+            self._conn = conn
+
+            # اولین اجرا: database.json موجود (یا دانلودشده از تلگرام) را وارد کن
+            if is_new and os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    self._write_all(snapshot_format.decode(f.read()))
+                print("📥 Library imported into SQLite")
+
+            return conn
+
+    # ---------- تبدیل نود <-> ردیف ----------
+    @staticmethod
+    def _positions(data):
+        """
+        parent و position ساختاری هر نود از روی لیست children والدش.
+        """
+        positions = {}
+        for parent_id, node in data.items():
+            for index, child_id in enumerate(node.get("children", [])):
+                positions[child_id] = (parent_id, index)
+        return positions
+
+    @staticmethod
+    def _fingerprint(node, placement):
+        meta = {k: v for k, v in node.items() if k not in ("children", "contents")}
+        parent, position = placement or (None, None)
+        row = (parent, position, meta.get("name"), _dumps(meta))
+        contents = [_dumps(item) for item in node.get("contents", [])]
+        return row, contents
+
+    def _sync_node(self, conn, node_id, new_fp, old_fp):
+        row, contents = new_fp
+        old_row, old_contents = old_fp if old_fp else (None, [])
+
+        if row != old_row:
+            conn.execute(
+                "INSERT INTO nodes (id, parent, position, name, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET parent=excluded.parent, position=excluded.position, "
+                "name=excluded.name, data=excluded.data",
+                (node_id, *row)
+            )
+
+        # فقط آیتم‌هایی که عوض شده‌اند (افزودن یک فایل = یک ردیف)
+        for position, item in enumerate(contents):
+            if position < len(old_contents) and old_contents[position] == item:
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO contents (node_id, position, data) VALUES (?, ?, ?)",
+                (node_id, position, item)
+            )
+
+        if len(old_contents) > len(contents):
+            conn.execute(
+                "DELETE FROM contents WHERE node_id = ? AND position >= ?",
+                (node_id, len(contents))
+            )
+
+    def _write_all(self, data, changed_nodes=None):
+        conn = self._conn
+        old = self._fingerprints or {}
+        positions = self._positions(data)
+
+        if changed_nodes is None or not old:
+            candidates = data.keys()
+        else:
+            # نودهای تغییرکرده + فرزندانشان (ترتیب) + نودهای تازه
+            candidates = set()
+            for node_id in changed_nodes:
+                if node_id in data:
+                    candidates.add(node_id)
+                    candidates.update(data[node_id].get("children", []))
+            candidates.update(k for k in data.keys() if k not in old)
+
+        removed = [k for k in old if k not in data]
+
+        new = dict(old)
+        conn.execute("BEGIN")
+        try:
+            if not old:
+                conn.execute("DELETE FROM nodes")
+                conn.execute("DELETE FROM contents")
+
+            for node_id in candidates:
+                node = data.get(node_id)
+                if not isinstance(node, dict):
+                    continue
+
+                fp = self._fingerprint(node, positions.get(node_id))
+                if fp != old.get(node_id):
+                    self._sync_node(conn, node_id, fp, old.get(node_id))
+                new[node_id] = fp
+
+            for node_id in removed:
+                conn.execute("DELETE FROM nodes WHERE id = ?", (node_id,))
+                conn.execute("DELETE FROM contents WHERE node_id = ?", (node_id,))
+                new.pop(node_id, None)
+
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._fingerprints = new
+
+    # ---------- خواندن ----------
+    def _materialize(self):
+        # اتصال check_same_thread=False بین ترد حلقه و تردهای بکاپ مشترک است؛ خواندن هم زیر قفل
+        with self._lock:
+            conn = self._db()
+            data = {}
+            fingerprints = {}
+
+            rows = conn.execute("SELECT id, parent, position, name, data FROM nodes ORDER BY parent, position")
+            for node_id, parent, position, name, raw in rows:
+                node = json.loads(raw)
+                node["children"] = []
+                node["contents"] = []
+                data[node_id] = node
+                fingerprints[node_id] = ((parent, position, name, raw), [])
+
+            # ترتیب children از روی (parent, position)
+            for node_id, (row, _) in fingerprints.items():
+                parent, position = row[0], row[1]
+                if parent in data and position is not None:
+                    data[parent]["children"].append(node_id)
+
+            for node_id, position, raw in conn.execute("SELECT node_id, position, data FROM contents ORDER BY node_id, position"):
+                if node_id in data:
+                    data[node_id]["contents"].append(json.loads(raw))
+                    fingerprints[node_id][1].append(raw)
+
+            self._fingerprints = fingerprints
+            return data
+
+    def get_cached(self):
+        with self._lock:
+            return self._data
+
+    def reload(self):
+        with self._lock:
+            self._data = self._materialize()
+            self.generation += 1
+            return self._data
+
+    def get_node(self, node_id):
+        """
+        فقط یک نود (با children و contents) با ایندکس‌ها خوانده می‌شود.
+        """
+        with self._lock:
+            conn = self._db()
+
+            row = conn.execute("SELECT data FROM nodes WHERE id = ?", (node_id,)).fetchone()
+            if row is None:
+                return None
+
+            node = json.loads(row[0])
+            node["children"] = [
+                r[0] for r in conn.execute(
+                    "SELECT id FROM nodes WHERE parent = ? AND position IS NOT NULL ORDER BY position",
+                    (node_id,)
+                )
+            ]
+            node["contents"] = [
+                json.loads(r[0]) for r in conn.execute(
+                    "SELECT data FROM contents WHERE node_id = ? ORDER BY position",
+                    (node_id,)
+                )
+            ]
+            return node
+
+    def get_menu(self, node_id):
+        """
+        نود و فرزندانش بدون محتوا: دو کوئری روی nodes به جای get_node برای تک‌تک فرزندان.
+        """
+        with self._lock:
+            conn = self._db()
+
+            row = conn.execute("SELECT data FROM nodes WHERE id = ?", (node_id,)).fetchone()
+            if row is None:
+                return None
+
+            children = [
+                (r[0], json.loads(r[1])) for r in conn.execute(
+                    "SELECT id, data FROM nodes WHERE parent = ? AND position IS NOT NULL ORDER BY position",
+                    (node_id,)
+                )
+            ]
+            node = json.loads(row[0])
+            node["children"] = [c_id for c_id, _ in children]
+            return node, children
+
+    def view(self):
+        return NodeView(self)
+
+    # ---------- نوشتن ----------
+    def save(self, data, ops=None):
+        """
+        ops: اگر داده شود فقط نودهای همین تغییرات (و فرزندان/نودهای جدید/حذف‌شده) بررسی می‌شوند.
+        """
+        changed_nodes = touched_nodes(ops) if ops is not None else None
+
+        with self._lock:
+            self._db()
+            if self._fingerprints is None and self._data is None:
+                self._materialize()
+
+            self._write_all(data, changed_nodes=changed_nodes)
+            self._data = data
+            self.generation += 1
+
+    def take_backup_snapshot(self):
+        """
+        روی ترد حلقه اصلی: خروجی کل درخت (با فرمت snapshot) برای آپلود بکاپ.
+        """
+        with self._lock:
+            data = self._data if self._data is not None else self.reload()
+            return snapshot_format.encode(data, self.fmt)
+
+    def write_backup_snapshot(self, payload):
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+        return self.path
+
+    def write_backup_file(self):
+        return self.write_backup_snapshot(self.take_backup_snapshot())
+
+
+    # موتور SQLite ژورنال ندارد (هر تغییر همان لحظه ردیفی نوشته می‌شود)
+    def needs_compaction(self):
+        return False
+
+    def take_compaction(self):
+        return False
+
+    def write_compaction(self):
+        return None
+
+    def compact(self):
+        return None
+
+
+def create_library_store(backend, path, db_path=None, journal_path=None, compact_every=200, fmt="json"):
+    if backend == "sqlite":
+        return SqliteLibraryStore(path, db_path, fmt=fmt)
+    return LibraryStore(path, journal_path=journal_path, compact_every=compact_every, fmt=fmt)
@@ -0,0 +1,220 @@
+import asyncio
+import html
+import io
+import time
+import zipfile
+
+
+# =========================================================
+# ارسال لاگ تغییرات ادمین به صورت ریپلای روی پیام بکاپ
+# =========================================================
+# - تکه‌ها تا سقف ۴۰۹۶ کاراکتر تلگرام پر می‌شوند (مرز خط‌ها حفظ می‌شود تا HTML نشکند)
+# - ارسال با token bucket محدود می‌شود و روی FloodWait همان تکه دوباره فرستاده می‌شود
+# - لاگ خیلی بزرگ (اختیاری) یک فایل zip شامل log.html می‌شود، نه ده‌ها پیام
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+# جای فوتر «ادامه لاگ بخش i از n»
+FOOTER_RESERVE = 64
+
+MAX_FLOOD_WAIT = 300
+
+
+def pack_chunks(text, max_len=TELEGRAM_TEXT_LIMIT - FOOTER_RESERVE):
+    """
+    خط‌ها را پشت هم در تکه‌هایی تا max_len کاراکتر می‌چیند.
+    خطی که به تنهایی از max_len بلندتر است (مثلاً کپشن طولانی) بریده می‌شود.
+    """
+    if not text:
+        return []
+
+    chunks = []
+    current = []
+    current_len = 0
+
+    for line in text.split("\n"):
+        while len(line) > max_len:
+            if current:
+                chunks.append("\n".join(current))
+                current, current_len = [], 0
+            chunks.append(line[:max_len])
+            line = line[max_len:]
+
+        line_len = len(line) + 1
+
+        if current and current_len + line_len > max_len:
+            chunks.append("\n".join(current))
+            current, current_len = [], 0
+
+        current.append(line)
+        current_len += line_len
+
+    if current:
+        chunks.append("\n".join(current))
+
+    return chunks
+
+
+def build_html_attachment(text, title="admin log"):
+    """
+    لاگ کامل -> بایت‌های zip شامل log.html (متن لاگ خودش HTML تلگرامی است).
+    """
+    document = (
+        "<!DOCTYPE html>\n<html lang=\"fa\" dir=\"rtl\"><head><meta charset=\"utf-8\">"
+        f"<title>{html.escape(title)}</title>"
+        "<style>body{font-family:sans-serif;white-space:pre-wrap;line-height:1.6}</style>"
+        f"</head><body>{text}</body></html>\n"
+    )
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("log.html", document.encode("utf-8"))
+
+    return buffer.getvalue()
+
+
+def _flood_wait_seconds(error):
+    """
+    FloodWaitError تلگرام (بدون وابستگی مستقیم به Telethon) -> ثانیه‌ی انتظار
+    """
+    if type(error).__name__.startswith("FloodWait"):
+        return getattr(error, "seconds", None) or 1
+    return None
+
+
+class TokenBucket:
+    """
+    rate توکن در ثانیه، حداکثر capacity توکن ذخیره (اجازه‌ی چند ارسال پشت سر هم).
+    """
+
+    def __init__(self, rate=1.0, capacity=5):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds):
+        """
+        بعد از FloodWait: تا seconds ثانیه هیچ توکنی در دسترس نباشد.
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LogShipper:
+    """
+    backend: بک‌اند بکاپ (send_message / send_file)
+    attach_threshold: لاگ بلندتر از این (کاراکتر) فایل پیوست می‌شود؛ 0 یعنی هیچ‌وقت
+    """
+
+    def __init__(self, backend, bucket=None, attach_threshold=0, max_retries=3):
+        self.backend = backend
+        self.bucket = bucket or TokenBucket()
+        self.attach_threshold = attach_threshold
+        self.max_retries = max_retries
+
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+
+        self._tasks = set()
+
+    async def _call(self, func, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+
+            try:
+                return await func(*args, **kwargs)
+
+            except Exception as e:
+                seconds = _flood_wait_seconds(e)
+                if seconds is None or attempt == self.max_retries:
+                    raise
+
+                self.flood_waits += 1
+                seconds = min(seconds, MAX_FLOOD_WAIT)
+                print(f"⏳ FloodWait {seconds}s while shipping log, retrying")
+                self.bucket.pause(seconds)
+
+    async def ship(self, chat_id, text, reply_to=None, title="admin log"):
+        if not text:
+            return True
+
+        if self.attach_threshold and len(text) > self.attach_threshold:
+            try:
+                await self._call(
+                    self.backend.send_file,
+                    chat_id,
+                    f"log_{reply_to or 'backup'}.zip",
+                    build_html_attachment(text, title),
+                    caption=f"📄 لاگ کامل ({len(text)} کاراکتر) در فایل پیوست",
+                    reply_to=reply_to,
+                )
+                self.sent += 1
+                return True
+
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Error sending log attachment: {e}")
+                return False
+
+        chunks = pack_chunks(text)
+        total_parts = len(chunks)
+        ok = True
+
+        for i, chunk_text in enumerate(chunks, 1):
+            footer = (
+                f"\n\n<i>📄 ادامه لاگ "
+                f"بخش {i} از {total_parts}</i>"
+                if total_parts > 1
+                else ""
+            )
+
+            try:
+                await self._call(
+                    self.backend.send_message,
+                    chat_id,
+                    f"{chunk_text}{footer}",
+                    parse_mode="HTML",
+                    reply_to=reply_to,
+                )
+                self.sent += 1
+
+            except Exception as e:
+                self.failed += 1
+                ok = False
+                print(f"❌ Error sending log part {i}: {e}")
+
+        return ok
+
+    def spawn(self, chat_id, text, reply_to=None):
+        """
+        ارسال در پس‌زمینه روی حلقه‌ی جاری (بکاپ بعدی منتظر لاگ نمی‌ماند).
+        """
+        task = asyncio.get_running_loop().create_task(self.ship(chat_id, text, reply_to))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def drain(self, timeout=60):
+        if not self._tasks:
+            return
+        await asyncio.wait(set(self._tasks), timeout=timeout)
@@ -9,7 +9,6 @@ import json
 import os
 #import io
 import io as iolib
-import uuid
 import zipfile
 import html
 from datetime import datetime
@@ -41,34 +40,34 @@ from telegram.ext import (
 )
 
 import copy
+import functools
 from flask import Flask
 import threading
 import asyncio
+import signal
 from aiohttp import web
 import requests
 from telethon import TelegramClient
 from telethon.sessions import StringSession
-from smart_search import smart_search
+from search_index import SearchIndex
+from search_cache import SearchResultCache, search_key
+from search_pool import SearchBusyError, SearchPool
+from backup_queue import BackupQueue
+import library_edits
+import snapshot_format
+import backup_delta
+import backup_manifest
+from backup_backend import create_backup_backend
+from backup_spool import BackupDelivery, BackupSpool, CircuitBreaker
+from telethon_runner import TelethonRunner, TelethonUnavailable
+from log_shipper import LogShipper, TokenBucket
+from library_store import create_library_store, node_menu
+from userdata_store import create_userdata_store
 from html import escape
 from telegram.ext import MessageReactionHandler
 from telegram import MessageReactionUpdated
 
 
-def delete_node_recursive(db, node_id):
-    # اگر نود وجود نداشت
-    if node_id not in db:
-        return
-
-    # اول بچه‌هاش رو حذف کن
-    children = db[node_id].get("children", [])
-    for child_id in children:
-        delete_node_recursive(db, child_id)
-
-    # بعد خود نود
-    del db[node_id]
-
-
-
 MAX_HISTORY = 20  # 🔹 بیرون تابع (بالای فایل)
 
 def push_admin_history(context, db):
@@ -91,6 +90,9 @@ DEFAULT_START_TEXT = """🕊 به ربات کتابخانه دانشگاه خو
 # --- wewb port ---
 PORT = int(os.environ.get("PORT", 10000))
 
+# --- حداکثر آپدیت‌هایی که تا پایان ریستور اولیه (cold start) نگه داشته می‌شوند ---
+STARTUP_UPDATE_BUFFER = int(os.getenv("STARTUP_UPDATE_BUFFER", "500"))
+
 # ------ userdata -------
 USERDATA_FILE = "/tmp/userdata.json"
 
@@ -151,11 +153,109 @@ ADMIN_ACCESSIBILITY_NAME = os.getenv("ADMIN_ACCESSIBILITY_NAME")
 REPORT_GROUP_ID = int(os.getenv("REPORT_GROUP_ID", "0") or "0")
 MASSAGE_GROUP_ID = int(os.getenv("MASSAGE_GROUP_ID", "0") or "0")
 
+# --- userdata write-behind ---
+USERDATA_FLUSH_INTERVAL = int(os.getenv("USERDATA_FLUSH_INTERVAL", "30"))
+USERDATA_FLUSH_THRESHOLD = int(os.getenv("USERDATA_FLUSH_THRESHOLD", "50"))
+USERDATA_FLUSH_TICK = 5
+
+# --- userdata backend: "json" (پیش‌فرض) یا "sqlite" ---
+USERDATA_BACKEND = os.getenv("USERDATA_BACKEND", "json").lower()
+USERDATA_DB_FILE = os.getenv("USERDATA_DB_FILE", "/tmp/userdata.sqlite3")
+
+# --- library backend: "json" (پیش‌فرض) یا "sqlite" ---
+LIBRARY_BACKEND = os.getenv("LIBRARY_BACKEND", "json").lower()
+LIBRARY_DB_FILE = os.getenv("LIBRARY_DB_FILE", "/tmp/library.sqlite3")
+
+# --- ژورنال تغییرات دیتابیس (موتور JSON) ---
+DB_JOURNAL_ENABLED = os.getenv("DB_JOURNAL_ENABLED", "1") == "1"
+DB_JOURNAL_FILE = f"{DB_FILE}.journal"
+DB_JOURNAL_COMPACT_EVERY = int(os.getenv("DB_JOURNAL_COMPACT_EVERY", "200"))
+DB_COMPACT_TICK = 30
+
+# --- فرمت snapshot دیتابیس: json | compact | gzip | marshal ---
+DB_SNAPSHOT_FORMAT = os.getenv("DB_SNAPSHOT_FORMAT", "json").lower()
+
+# --- ادغام بکاپ‌های پشت سر هم: ذخیره‌هایی که با فاصله‌ی کمتر از DEBOUNCE ثانیه
+#     می‌رسند یک بکاپ می‌شوند (حداکثر MAX_DELAY ثانیه بعد از اولین ذخیره) ---
+DB_BACKUP_DEBOUNCE = float(os.getenv("DB_BACKUP_DEBOUNCE", "15"))
+DB_BACKUP_MAX_DELAY = float(os.getenv("DB_BACKUP_MAX_DELAY", "120"))
+
+# --- حالت بکاپ: full (کل فایل در هر بکاپ) | delta (فقط تغییرات نسبت به بکاپ قبلی
+#     و هر CHECKPOINT_EVERY بار یک فایل کامل) ---
+DB_BACKUP_MODE = os.getenv("DB_BACKUP_MODE", "full").lower()
+DB_BACKUP_CHECKPOINT_EVERY = int(os.getenv("DB_BACKUP_CHECKPOINT_EVERY", "50"))
+DB_BACKUP_SCAN_LIMIT = int(os.getenv("DB_BACKUP_SCAN_LIMIT", "2000"))
+
+# --- مقصد بکاپ‌ها: telegram (گروه‌های بکاپ با Telethon) | local (پوشه‌ی محلی،
+#     برای اجرای آفلاین و بنچمارک؛ شناسه‌ی پیام، کپشن و ریپلای شبیه‌سازی می‌شود) ---
+BACKUP_BACKEND = os.getenv("BACKUP_BACKEND", "telegram").lower()
+BACKUP_LOCAL_DIR = os.getenv("BACKUP_LOCAL_DIR", "/tmp/backup_chats")
+
+# --- circuit breaker مقصد بکاپ: بعد از FAILURES خطای پشت سر هم باز می‌شود و
+#     تا RESET ثانیه بکاپ‌ها مستقیم در SPOOL_DIR صف می‌شوند ---
+BACKUP_BREAKER_FAILURES = int(os.getenv("BACKUP_BREAKER_FAILURES", "3"))
+BACKUP_BREAKER_RESET = float(os.getenv("BACKUP_BREAKER_RESET", "60"))
+BACKUP_SPOOL_DIR = os.getenv("BACKUP_SPOOL_DIR", "/tmp/backup_spool")
+BACKUP_SPOOL_TICK = 30
+
+# --- اجرای Telethon روی همان حلقه‌ی اصلی (PTB + aiohttp) به جای ترد جدا؛
+#     کلاینت در main() و بدون بلاک کردن بالا آمدن وب‌سرور وصل می‌شود ---
+TELETHON_MAIN_LOOP = os.getenv("TELETHON_MAIN_LOOP", "0") == "1"
+
+# --- ارسال لاگ ادمین: RATE پیام در ثانیه (تا BURST پشت سر هم)؛ لاگ بلندتر از
+#     ATTACH_THRESHOLD کاراکتر یک فایل zip (log.html) می‌شود (0 = خاموش) ---
+LOG_SHIP_RATE = float(os.getenv("LOG_SHIP_RATE", "1"))
+LOG_SHIP_BURST = int(os.getenv("LOG_SHIP_BURST", "5"))
+LOG_ATTACH_THRESHOLD = int(os.getenv("LOG_ATTACH_THRESHOLD", "20000"))
+
+# --- سرچ هوشمند: فقط تا MAX_CANDIDATES نود محتمل (از ایندکس توکن/سه‌حرفی) با
+#     rapidfuzz امتیاز می‌گیرند؛ 0 = امتیازدهی کامل همه‌ی نودها ---
+#     افت recall: نودی که هیچ توکن/سه‌حرفی مشترکی با کوئری و مترادف‌هایش ندارد اصلاً
+#     امتیاز نمی‌گیرد (فقط شباهت fuzzy ضعیف، معمولاً زیر ۶۰، از دست می‌رود). با ۱۰۰۰ روی
+#     کتابخانه‌ی تست همه‌ی نتایج ۶۰+ امتیازدهی کامل پیدا می‌شوند؛ سقف خیلی کمتر از
+#     تعداد نودهای هم‌خوان (مثلاً ۲۰ از ۷۸) recall را تا حدود ۸۵-۹۰٪ پایین می‌آورد
+#     (tests/test_search_recall.py)
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+
+# --- امتیازدهی دسته‌ای سرچ (rapidfuzz cdist + NumPy) با WORKERS ترد (-1 = همه‌ی هسته‌ها)؛
+#     SCORE_CUTOFF > 0 امتیازهای ضعیف‌تر را صفر می‌کند (سریع‌تر ولی تقریبی) ---
+SEARCH_BATCH_SCORING = os.getenv("SEARCH_BATCH_SCORING", "1") == "1"
+SEARCH_SCORE_WORKERS = int(os.getenv("SEARCH_SCORE_WORKERS", "-1"))
+SEARCH_SCORE_CUTOFF = float(os.getenv("SEARCH_SCORE_CUTOFF", "0"))
+
+# --- کش نتایج سرچ (کوئری نرمال‌شده + ریشه‌ی جستجو + نسخه‌ی کتابخانه): حداکثر SIZE
+#     کوئری، هر کدام TTL ثانیه؛ هر save_db کش را خالی می‌کند (SIZE=0 یعنی خاموش) ---
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+
+# --- اجرای سرچ روی WORKERS ترد جدا (0 = روی همان حلقه)؛ حداکثر MAX_IN_FLIGHT جستجوی
+#     هم‌زمان و هر کاربر حداکثر USER_LIMIT جستجوی در صف/در حال اجرا ---
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "2"))
+SEARCH_MAX_IN_FLIGHT = int(os.getenv("SEARCH_MAX_IN_FLIGHT", "4"))
+SEARCH_USER_LIMIT = int(os.getenv("SEARCH_USER_LIMIT", "1"))
+
+# --- بودجه‌ی هر سرچ: کاندیدها به ترتیب امتیاز پیش‌فیلتر امتیاز می‌گیرند و بعد از
+#     TIME_BUDGET ثانیه یا MAX_SCORED نود، بهترین نتایج تا همان لحظه نمایش داده می‌شود
+#     (نتیجه‌ی ناقص کش نمی‌شود)؛ 0 = بدون سقف ---
+SEARCH_TIME_BUDGET = float(os.getenv("SEARCH_TIME_BUDGET", "2"))
+SEARCH_MAX_SCORED = int(os.getenv("SEARCH_MAX_SCORED", "0"))
+
 # ============ TELETHON SEPARATE EVENT LOOP ============
 
-telethon_loop = asyncio.new_event_loop()
 telethon_client = None
-telethon_ready = threading.Event()
+
+backup_breaker = CircuitBreaker(
+    failure_threshold=BACKUP_BREAKER_FAILURES,
+    reset_timeout=BACKUP_BREAKER_RESET,
+    name="backup",
+)
+backup_spool = BackupSpool(BACKUP_SPOOL_DIR)
+
+# در حالت TELETHON_MAIN_LOOP حلقه همان حلقه‌ی اصلی است و در main() مقدار می‌گیرد
+telethon_runner = TelethonRunner(
+    backup_breaker,
+    loop=None if TELETHON_MAIN_LOOP else asyncio.new_event_loop(),
+)
 
 
 def start_telethon_loop():
@@ -165,8 +265,15 @@ def start_telethon_loop():
     """
     global telethon_client
 
+    telethon_loop = telethon_runner.loop
     asyncio.set_event_loop(telethon_loop)
 
+    # بک‌اند محلی کلاینت لازم ندارد؛ فقط همین حلقه برای اجرای کوروتین‌ها
+    if BACKUP_BACKEND != "telegram":
+        telethon_runner.ready.set()
+        telethon_loop.run_forever()
+        return
+
     telethon_client = TelegramClient(
         StringSession(TG_SESSION_STRING),
         TG_API_ID,
@@ -177,48 +284,96 @@ def start_telethon_loop():
     async def init_client():
         await telethon_client.start()
         print("✅ Telethon User API client started")
-        telethon_ready.set()
+        telethon_runner.ready.set()
 
     telethon_loop.run_until_complete(init_client())
     telethon_loop.run_forever()
 
 
-telethon_thread = threading.Thread(target=start_telethon_loop, daemon=True)
-telethon_thread.start()
+def start_telethon_on_main_loop():
+    """
+    حالت TELETHON_MAIN_LOOP: کلاینت روی حلقه‌ی جاری ساخته و در پس‌زمینه وصل می‌شود؛
+    عملیات بکاپ مستقیم await می‌شوند (بدون run_coroutine_threadsafe).
+    """
+    telethon_runner.loop = asyncio.get_running_loop()
+
+    async def init_client():
+        global telethon_client
+
+        if BACKUP_BACKEND == "telegram":
+            telethon_client = TelegramClient(
+                StringSession(TG_SESSION_STRING),
+                TG_API_ID,
+                TG_API_HASH,
+            )
+            await telethon_client.start()
+            print("✅ Telethon User API client started (main loop)")
+
+        telethon_runner.ready.set()
+
+    telethon_runner.start_task = telethon_runner.loop.create_task(init_client(), name="telethon_start")
+
+
+async def stop_telethon_on_main_loop():
+    start_task = telethon_runner.start_task
+    if start_task is not None and not start_task.done():
+        start_task.cancel()
+
+    if telethon_client is not None:
+        try:
+            await telethon_client.disconnect()
+        except Exception as e:
+            print(f"❌ Failed to disconnect Telethon client: {e}")
+
+
+if not TELETHON_MAIN_LOOP:
+    telethon_thread = threading.Thread(target=start_telethon_loop, daemon=True)
+    telethon_thread.start()
+
+
+backup_backend = create_backup_backend(
+    BACKUP_BACKEND,
+    client_getter=lambda: telethon_client,
+    local_dir=BACKUP_LOCAL_DIR,
+)
+
+# روی حلقه Telethon اجرا می‌شود (spawn از داخل کوروتین‌های run_telethon)
+log_shipper = LogShipper(
+    backup_backend,
+    bucket=TokenBucket(rate=LOG_SHIP_RATE, capacity=LOG_SHIP_BURST),
+    attach_threshold=LOG_ATTACH_THRESHOLD,
+)
 
 
 def run_telethon(coro):
     """
     Run async Telethon functions from normal sync code.
+    اگر کوروتین اجرا نشود (مثلاً صدا زدن از خود حلقه Telethon) TelethonUnavailable می‌دهد.
     """
-    telethon_ready.wait(timeout=30)
+    return telethon_runner.run(coro)
 
-    if not telethon_ready.is_set():
-        print("❌ Telethon client not ready")
-        return None
 
-    future = asyncio.run_coroutine_threadsafe(coro, telethon_loop)
-    return future.result(timeout=120)
+async def run_telethon_async(coro, timeout=120):
+    """
+    همان run_telethon برای کدهای async حلقه اصلی؛
+    به جای بلاک کردن ترد، نتیجه‌ی حلقه Telethon await می‌شود.
+    """
+    return await telethon_runner.run_async(coro, timeout=timeout)
 
 
 # ============ TELEGRAM FILE BACKUP HELPERS ============
 
-async def _upload_file_to_telegram(chat_id, file_path, caption=None, parse_mode=None):
+async def _upload_bytes_to_telegram(chat_id, filename, raw, caption=None, parse_mode=None):
     try:
-        if not os.path.exists(file_path):
-            print(f"❌ File not found for upload: {file_path}")
-            return None
-
-        sent_message = await telethon_client.send_file(
-            entity=chat_id,
-            file=file_path,
-            caption=caption or f"backup: {os.path.basename(file_path)}",
+        sent_message = await backup_backend.send_file(
+            chat_id,
+            filename,
+            raw,
+            caption=caption or f"backup: {filename}",
             parse_mode=parse_mode
         )
 
-        print(f"⬆️ Uploaded to Telegram group: {file_path}")
-
-        # مهم: خود پیام آپلودشده را برگردان
+        print(f"⬆️ Uploaded to Telegram group: {filename} ({len(raw)} bytes)")
         return sent_message
 
     except Exception as e:
@@ -226,20 +381,19 @@ async def _upload_file_to_telegram(chat_id, file_path, caption=None, parse_mode=
         return None
 
 
-
 async def _download_latest_file_from_telegram(chat_id, filename, save_path):
     try:
         print(f"🔍 Searching latest {filename} in Telegram group {chat_id}...")
 
-        async for message in telethon_client.iter_messages(chat_id, limit=200):
-            if not message.file:
+        async for message in backup_backend.iter_messages(chat_id, limit=200):
+            if message.file_name is None:
                 continue
 
-            original_name = message.file.name if message.file.name else None
-            caption = message.message or ""
+            original_name = message.file_name or None
+            caption = message.text
 
             if original_name == filename or filename in caption:
-                await message.download_media(file=save_path)
+                await backup_backend.download(message, save_path=save_path)
                 print(f"⬇️ Downloaded latest {filename} from Telegram group")
                 return True
 
@@ -248,46 +402,372 @@ async def _download_latest_file_from_telegram(chat_id, filename, save_path):
 
     except Exception as e:
         print(f"❌ Failed to download file from Telegram: {e}")
-        return False
+        raise
 
 
-def upload_file_to_telegram(chat_id, file_path, caption=None, parse_mode=None):
-    return run_telethon(
-        _upload_file_to_telegram(chat_id, file_path, caption, parse_mode)
-    )
+# ============ BACKUP MANIFEST (PINNED MESSAGE) ============
+
+# chat_id -> (message_id, manifest) ؛ فقط روی حلقه Telethon خوانده/نوشته می‌شود
+_manifest_messages = {}
+_manifest_locks = {}
+
+
+def _manifest_lock(chat_id):
+    lock = _manifest_locks.get(chat_id)
+    if lock is None:
+        lock = _manifest_locks[chat_id] = asyncio.Lock()
+    return lock
 
 
-def download_latest_file_from_telegram(chat_id, filename, save_path):
-    return run_telethon(
-        _download_latest_file_from_telegram(chat_id, filename, save_path)
+async def _read_manifest(chat_id):
+    """
+    -> (message_id, manifest) ؛ اول پیام پین‌شده، بعد جستجوی سمت سرور روی تگ.
+    """
+    cached = _manifest_messages.get(chat_id)
+    if cached:
+        return cached
+
+    pinned = await backup_backend.get_pinned(chat_id)
+    manifest = backup_manifest.parse(getattr(pinned, "text", None))
+    if manifest is not None:
+        _manifest_messages[chat_id] = (pinned.id, manifest)
+        return pinned.id, manifest
+
+    async for message in backup_backend.iter_messages(
+        chat_id, limit=5, search=backup_manifest.MANIFEST_TAG
+    ):
+        manifest = backup_manifest.parse(message.text)
+        if manifest is not None:
+            _manifest_messages[chat_id] = (message.id, manifest)
+            return message.id, manifest
+
+    return None, {}
+
+
+async def _update_manifest(chat_id, name, update):
+    """
+    update(entry قبلی یا None) -> entry جدید ؛ None یعنی بدون تغییر.
+    خطای manifest بکاپ را خراب نمی‌کند (ریستور به جستجو برمی‌گردد).
+    """
+    try:
+        async with _manifest_lock(chat_id):
+            message_id, manifest = await _read_manifest(chat_id)
+
+            entry = update(manifest.get(name))
+            if entry is None:
+                return
+
+            manifest = dict(manifest)
+            manifest[name] = entry
+            text = backup_manifest.render(manifest)
+
+            if message_id:
+                await backup_backend.edit_message(chat_id, message_id, text)
+            else:
+                message = await backup_backend.send_message(chat_id, text)
+                message_id = message.id
+
+                try:
+                    await backup_backend.pin_message(chat_id, message_id)
+                except Exception as e:
+                    print(f"⚠️ Could not pin backup manifest: {e}")
+
+            _manifest_messages[chat_id] = (message_id, manifest)
+
+    except Exception as e:
+        _manifest_messages.pop(chat_id, None)
+        print(f"⚠️ Failed to update backup manifest: {e}")
+
+
+async def _fetch_manifest_file(chat_id, name):
+    """
+    دانلود مستقیم فایلی که manifest نشان می‌دهد و چک size/sha256 قبل از استفاده.
+    -> (entry, raw) یا None
+    """
+    try:
+        _, manifest = await _read_manifest(chat_id)
+        entry = manifest.get(name)
+        if not entry:
+            print(f"⚠️ No manifest entry for {name}, falling back to scan")
+            return None
+
+        message = (await backup_backend.get_messages(chat_id, [entry["msg_id"]]))[0]
+        if not message or message.file_name is None:
+            print(f"⚠️ Manifest points to missing {name} message, falling back to scan")
+            return None
+
+        raw = await backup_backend.download(message)
+        if not backup_manifest.verify(entry, raw):
+            print(f"⚠️ Checksum mismatch for {name} from manifest, falling back to scan")
+            return None
+
+        print(f"📌 Fetched {name} via manifest ({len(raw)} bytes)")
+        return entry, raw
+
+    except Exception as e:
+        print(f"⚠️ Failed to read backup manifest: {e}")
+        return None
+
+
+def _write_verified_file(save_path, raw):
+    tmp_path = f"{save_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+    os.replace(tmp_path, save_path)
+
+
+# ============ BACKUP CIRCUIT BREAKER + SPOOL ============
+
+async def _upload_backup_item(meta, raw):
+    """
+    روی حلقه Telethon: ارسال یک مورد بکاپ (مستقیم یا از spool).
+    """
+    if meta["kind"] == "userdata":
+        return bool(await _upload_userdata_bytes(raw))
+
+    return await _upload_db_backup(
+        meta["caption"],
+        meta.get("log_caption"),
+        (meta["filename"], raw),
+        kind=meta.get("manifest", "checkpoint"),
     )
 
 
+backup_delivery = BackupDelivery(backup_spool, backup_breaker, telethon_runner, _upload_backup_item)
+
+
+async def deliver_backup(meta, raw):
+    """
+    از حلقه اصلی: ارسال بکاپ، یا ذخیره در spool وقتی مقصد در دسترس نیست.
+    True یعنی بکاپ یا ارسال شد یا روی دیسک در صف است.
+    """
+    return await backup_delivery.deliver(meta, raw)
+
+
+def deliver_backup_sync(meta, raw):
+    """
+    همان deliver_backup برای کد همزمان و تردها
+    (روی خود حلقه Telethon در پس‌زمینه‌ی همان حلقه فرستاده می‌شود).
+    """
+    return backup_delivery.deliver_sync(meta, raw)
+
+
+async def replay_backup_spool_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    ارسال دوباره‌ی spool به ترتیب، وقتی breaker اجازه می‌دهد.
+    """
+    replayed = await backup_delivery.replay()
+
+    if replayed:
+        print(f"📤 Replayed {replayed} spooled backups, {backup_spool.pending()} left")
+
+
 # ============ DATABASE BACKUP WITH TELEGRAM ============
 
+db_delta_tracker = backup_delta.DeltaTracker(checkpoint_every=DB_BACKUP_CHECKPOINT_EVERY)
+
+
+async def _download_db_backup_chain():
+    """
+    اول از روی manifest (checkpoint + لیست deltaها، بدون جستجو)؛
+    اگر manifest نبود یا زنجیره کامل نبود، جستجو در پیام‌های اخیر.
+    """
+    found = await _fetch_manifest_file(DB_BACKUP_CHAT_ID, "database.json")
+
+    if found:
+        entry, checkpoint_raw = found
+        delta_ids = entry.get("deltas")
+
+        try:
+            deltas = []
+            if delta_ids:
+                messages = await backup_backend.get_messages(DB_BACKUP_CHAT_ID, delta_ids)
+                for message in messages:
+                    if not message or message.file_name is None:
+                        deltas = None
+                        break
+                    deltas.append(await backup_backend.download(message))
+
+            if (
+                delta_ids is not None
+                and deltas is not None
+                and backup_delta.chain_ok(checkpoint_raw, deltas, entry.get("tail"))
+            ):
+                return checkpoint_raw, deltas
+
+        except Exception as e:
+            print(f"⚠️ Failed to fetch deltas from manifest: {e}")
+
+        print("⚠️ Manifest delta chain incomplete, falling back to scan")
+
+    return await _scan_db_backup_chain()
+
+
+async def _scan_db_backup_chain():
+    """
+    از جدید به قدیم: همه‌ی فایل‌های delta تا رسیدن به آخرین checkpoint (database.json).
+    خروجی: (بایت‌های checkpoint, لیست بایت‌های delta از قدیم به جدید) یا None
+    """
+    try:
+        print(f"🔍 Searching latest database.json (+ deltas) in Telegram group {DB_BACKUP_CHAT_ID}...")
+        deltas = []
+
+        async for message in backup_backend.iter_messages(DB_BACKUP_CHAT_ID, limit=DB_BACKUP_SCAN_LIMIT):
+            if message.file_name is None:
+                continue
+
+            original_name = message.file_name or None
+            caption = message.text
+
+            # اول نام فایل: کپشن پیش‌فرض delta هم شامل database.json است
+            if original_name == backup_delta.DELTA_FILENAME:
+                deltas.append(await backup_backend.download(message))
+                continue
+
+            if original_name == "database.json" or "database.json" in caption:
+                checkpoint_raw = await backup_backend.download(message)
+                print(f"⬇️ Downloaded latest database.json checkpoint + {len(deltas)} deltas")
+                deltas.reverse()
+                return checkpoint_raw, deltas
+
+        print("⚠️ No file named database.json found in Telegram group")
+        return None
+
+    except Exception as e:
+        print(f"❌ Failed to download file from Telegram: {e}")
+        raise
+
+
 def download_db_from_telegram():
-    return download_latest_file_from_telegram(
-        chat_id=DB_BACKUP_CHAT_ID,
-        filename="database.json",
-        save_path=DB_FILE
-    )
+    """
+    False فقط یعنی «بکاپی در گروه نیست»؛ هر خطایی (از جمله اجرا نشدن روی حلقه Telethon) بالا می‌رود.
+    """
+    result = run_telethon(_download_db_backup_chain())
+    if not result:
+        return False
 
+    checkpoint_raw, deltas = result
 
-def upload_db_to_telegram(caption="database.json"):
-    return upload_file_to_telegram(
-        chat_id=DB_BACKUP_CHAT_ID,
-        file_path=DB_FILE,
-        caption=caption,
-        parse_mode="HTML"
+    try:
+        data = snapshot_format.decode(checkpoint_raw)
+        data, last_id, applied = backup_delta.rebuild(data, checkpoint_raw, deltas)
+
+        _write_verified_file(
+            DB_FILE,
+            snapshot_format.encode(data, DB_SNAPSHOT_FORMAT) if applied else checkpoint_raw
+        )
+
+    except Exception as e:
+        print(f"❌ Failed to rebuild DB from Telegram backups: {e}")
+        raise
+
+    if applied:
+        print(f"🧬 Applied {applied} delta backups on top of checkpoint")
+
+    # زنجیره‌ی delta از همین نقطه ادامه پیدا می‌کند
+    db_delta_tracker.checkpoint_uploaded(data, last_id, applied)
+    if applied < len(deltas):
+        db_delta_tracker.force_checkpoint = True
+
+    return True
+
+
+def _manifest_add_delta(message_id, tail, entry):
+    if not entry or entry.get("deltas") is None:
+        return None
+    return dict(entry, deltas=entry["deltas"] + [message_id], tail=tail)
+
+
+async def _upload_db_backup(backup_caption, log_caption, payload, kind="checkpoint"):
+    """
+    روی حلقه Telethon اجرا می‌شود: آپلود فایل بکاپ، به‌روزرسانی manifest
+    و بعد لاگ کامل به صورت چندتکه، ریپلای روی همان فایل بکاپ.
+    payload: (نام فایل, بایت‌ها) ؛ kind: checkpoint (فایل کامل) | delta
+    """
+    filename, raw = payload
+
+    backup_msg = await _upload_bytes_to_telegram(
+        DB_BACKUP_CHAT_ID, filename, raw, backup_caption, "HTML"
     )
 
+    if not backup_msg:
+        print("❌ Database file upload failed")
+        return False
+
+    backup_msg_id = getattr(backup_msg, "id", None)
+
+    if not backup_msg_id:
+        print("❌ Uploaded backup message has no message id")
+        return False
+
+    if kind == "delta":
+        await _update_manifest(
+            DB_BACKUP_CHAT_ID,
+            "database.json",
+            functools.partial(_manifest_add_delta, backup_msg_id, backup_delta.file_id(raw)),
+        )
+    else:
+        entry = backup_manifest.make_entry(backup_msg_id, raw)
+        entry.update(deltas=[], tail=None)
+        await _update_manifest(DB_BACKUP_CHAT_ID, "database.json", lambda _old: entry)
+
+    # لاگ‌ها در پس‌زمینه و با محدودیت نرخ، ریپلای روی همین بکاپ
+    if log_caption:
+        log_shipper.spawn(DB_BACKUP_CHAT_ID, log_caption, reply_to=backup_msg_id)
+
+    return True
+
+
+library_store = create_library_store(
+    LIBRARY_BACKEND,
+    DB_FILE,
+    db_path=LIBRARY_DB_FILE,
+    journal_path=DB_JOURNAL_FILE if DB_JOURNAL_ENABLED else None,
+    compact_every=DB_JOURNAL_COMPACT_EVERY,
+    fmt=DB_SNAPSHOT_FORMAT,
+)
+
+
+def get_db_generation():
+    return library_store.generation
+
+
+_local_restore_task = None
+
+
+def _restore_failed(name, error):
+    """
+    دانلود بکاپ اجرا نشد یا خطا داد (نه «بکاپی نیست»): فایل خالی ساخته نمی‌شود
+    تا بعداً روی بکاپ واقعی آپلود نشود. روی خود حلقه Telethon (حالت حلقه‌ی اصلی)
+    ریستور در پس‌زمینه با ترد جدا (restore_local_state) دوباره امتحان می‌شود.
+    """
+    global _local_restore_task
+
+    print(f"❌ Could not restore {name} from Telegram, not creating a new one: {error}")
+
+    if telethon_runner.on_loop() and (_local_restore_task is None or _local_restore_task.done()):
+        _local_restore_task = asyncio.get_running_loop().create_task(
+            restore_local_state(), name="local_restore"
+        )
+
 
 def load_db():
+    # اگر نسخه حافظه با فایل روی دیسک یکی است، بدون parse مجدد همان را برگردان
+    cached_db = library_store.get_cached()
+    if cached_db is not None:
+        return cached_db
+
     # اگر فایل محلی وجود ندارد، از گروه تلگرام دانلود کن
-    if not os.path.exists(DB_FILE):
+    if not library_store.exists():
         print("⚠️ Local DB not found. Restoring from Telegram group...")
 
-        if not download_db_from_telegram():
+        try:
+            found = download_db_from_telegram()
+        except Exception as e:
+            _restore_failed("database", e)
+            return {}
+
+        if not found:
             print("⚠️ Telegram DB backup not found, creating new DB")
 
             initial_db = {
@@ -302,25 +782,85 @@ def load_db():
             save_db(initial_db)
             return initial_db
 
-    # فایل محلی را لود کن
+    # فایل محلی را لود کن (فقط وقتی روی دیسک عوض شده باشد)
     try:
-        with open(DB_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return library_store.reload()
 
     except Exception as e:
         print("❌ Failed to load local DB:", e)
         return {}
 
 
-def save_db(data, context=None):
+# ایندکس سرچ هوشمند: یک‌بار ساخته می‌شود و با ops هر save_db به‌روز می‌ماند
+library_search_index = SearchIndex(max_candidates=SEARCH_MAX_CANDIDATES)
+
+# نتایج رتبه‌بندی‌شده و HTML آماده‌ی جستجوهای تکراری
+search_result_cache = SearchResultCache(max_entries=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+# امتیازدهی بیرون از حلقه‌ی اصلی تا ناوبری بقیه‌ی کاربران بلاک نشود
+search_pool = SearchPool(
+    workers=SEARCH_WORKERS,
+    max_in_flight=SEARCH_MAX_IN_FLIGHT,
+    per_user_limit=SEARCH_USER_LIMIT,
+)
+
+
+def get_search_index():
+    db = load_db()
+
+    # ذخیره‌ی کامل (undo/ریستور) یا reload از دیسک: ساخت دوباره
+    if library_search_index.generation != library_store.generation:
+        library_search_index.build(db, generation=library_store.generation)
+        print(f"🔎 Search index rebuilt ({len(library_search_index.entries)} nodes)")
+
+    return library_search_index
+
+
+def update_search_index(data, ops, previous_generation):
+    """
+    فقط وقتی ایندکس با نسخه‌ی قبل از همین ذخیره همگام بوده، ops روی آن اعمال می‌شود؛
+    در غیر این صورت در جستجوی بعدی از نو ساخته می‌شود.
+    """
+    if ops is None or library_search_index.generation != previous_generation:
+        return
+
+    try:
+        library_search_index.apply_ops(data, ops, generation=library_store.generation)
+    except Exception as e:
+        print(f"❌ Failed to update search index, rebuilding later: {e}")
+        library_search_index.generation = None
+
+
+def get_db_view():
+    """
+    دسترسی خواندنی نود به نود (برای ناوبری کاربران)؛
+    در موتور SQLite فقط نودهای لازم خوانده می‌شوند، نه کل درخت.
+    """
+    if not library_store.exists():
+        load_db()
+
+    return library_store.view()
+
+
+def save_db(data, context=None, ops=None):
+    """
+    ops: تغییرات تایپ‌دار (library_ops) همین ذخیره.
+    - موتور JSON فقط همین رکوردها را در ژورنال می‌نویسد (fsync)، نه کل فایل.
+    - موتور SQLite فقط ردیف‌های نودهای درگیر را بررسی/بازنویسی می‌کند.
+    بدون ops (ریستور، undo/redo) کل دیتابیس بازنویسی می‌شود.
+    """
+    previous_generation = library_store.generation
+
     try:
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        library_store.save(data, ops=ops)
         print("💾 DB saved locally")
     except Exception as e:
         print("❌ Failed to save DB locally:", e)
         return False
 
+    update_search_index(data, ops, previous_generation)
+    search_result_cache.clear()
+
     log_caption = None
     backup_caption = None
 
@@ -331,106 +871,392 @@ def save_db(data, context=None):
     if not backup_caption:
         backup_caption = "database.json"
 
-    # اول فایل بکاپ را آپلود کن و خود پیام آپلودشده را بگیر
-    backup_msg = upload_db_to_telegram(caption=backup_caption)
+    event = {"backup_caption": backup_caption, "log_caption": log_caption}
 
-    if not backup_msg:
-        print("❌ Database file upload failed")
+    # مسیر عادی: فقط رویداد بکاپ در صف ثبت می‌شود و هندلر منتظر تلگرام نمی‌ماند
+    if db_backup_queue.submit(event):
+        return True
+
+    # worker هنوز روشن نیست (مثلاً هنگام بالا آمدن): بکاپ کامل همزمان
+    try:
+        with open(library_store.write_backup_file(), "rb") as f:
+            raw = f.read()
+    except Exception as e:
+        print("❌ Failed to export DB backup file:", e)
         return False
 
-    backup_msg_id = getattr(backup_msg, "id", None)
+    # این بکاپ کامل خارج از زنجیره‌ی delta است؛ بکاپ بعدی checkpoint می‌شود
+    db_delta_tracker.reset()
 
-    if not backup_msg_id:
-        print("❌ Uploaded backup message has no message id")
-        return False
+    return deliver_backup_sync(
+        {
+            "kind": "db",
+            "filename": "database.json",
+            "caption": backup_caption,
+            "log_caption": log_caption,
+            "manifest": "checkpoint",
+        },
+        raw,
+    )
+
+
+async def process_db_backup_event(event):
+    """
+    worker صف بکاپ: snapshot روی همین حلقه، نوشتن فایل در ترد جدا،
+    و آپلود روی حلقه Telethon (await بدون بلاک کردن حلقه اصلی).
+    """
+    if DB_BACKUP_MODE != "delta":
+        token = library_store.take_backup_snapshot()
+        raw = await asyncio.to_thread(_export_db_backup, token)
+
+        return await deliver_backup(
+            {
+                "kind": "db",
+                "filename": "database.json",
+                "caption": event["backup_caption"],
+                "log_caption": event.get("log_caption"),
+                "manifest": "checkpoint",
+            },
+            raw,
+        )
+
+    if event.get("checkpoint"):
+        db_delta_tracker.force_checkpoint = True
+
+    if db_delta_tracker.needs_checkpoint():
+        return await upload_db_checkpoint(event)
+
+    return await upload_db_delta(event)
+
+
+def _export_db_backup(token):
+    """
+    داخل ترد: نوشتن فایل بکاپ و برگرداندن بایت‌های همان نسخه
+    (checksum و آپلود دقیقاً روی همین بایت‌ها انجام می‌شود).
+    """
+    path = library_store.write_backup_snapshot(token)
+
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _export_db_checkpoint(token):
+    """
+    بایت‌ها + کپی خصوصی همان نسخه برای زنجیره‌ی delta.
+    """
+    raw = _export_db_backup(token)
+    return raw, snapshot_format.decode(raw)
+
+
+async def upload_db_checkpoint(event):
+    token = library_store.take_backup_snapshot()
+    raw, data = await asyncio.to_thread(_export_db_checkpoint, token)
+
+    ok = await deliver_backup(
+        {
+            "kind": "db",
+            "filename": "database.json",
+            "caption": event["backup_caption"],
+            "log_caption": event.get("log_caption"),
+            "manifest": "checkpoint",
+        },
+        raw,
+    )
+
+    # ارسال‌شده یا در spool: زنجیره‌ی delta از همین checkpoint ادامه می‌یابد
+    if ok:
+        db_delta_tracker.checkpoint_uploaded(data, backup_delta.file_id(raw))
+        print("📦 DB checkpoint uploaded")
+
+    return ok
+
+
+async def _spawn_backup_log(log_caption):
+    # روی حلقه Telethon: لاگ ادمین بدون فایل بکاپ (ریپلای روی چیزی نیست)
+    log_shipper.spawn(DB_BACKUP_CHAT_ID, log_caption)
 
-    # بعد لاگ کامل را به صورت چندتکه، ریپلای روی همان فایل بکاپ بفرست
-    if log_caption:
-        chunks = split_html_message_by_lines(log_caption, max_len=3000)
-        total_parts = len(chunks)
-
-        for i, chunk_text in enumerate(chunks, 1):
-            footer = (
-                f"\n\n<i>📄 ادامه لاگ "
-                f"بخش {i} از {total_parts}</i>"
-                if total_parts > 1
-                else ""
-            )
 
-            final_text = f"{chunk_text}{footer}"
+async def upload_db_delta(event):
+    # diff روی همین حلقه (دیکشنری زنده)، قبل از هر await
+    patch, raw = db_delta_tracker.make_delta(load_db())
 
+    if backup_delta.is_empty(patch):
+        # چیزی نسبت به آخرین بکاپ عوض نشده: نه آپلود، نه جلو بردن زنجیره
+        print("⏭️ DB delta is empty, skipping backup upload")
+        if event.get("log_caption"):
             try:
-                run_telethon(
-                    telethon_client.send_message(
-                        entity=DB_BACKUP_CHAT_ID,
-                        message=final_text,
-                        parse_mode="HTML",
-                        link_preview=False,
-                        reply_to=backup_msg_id
-                    )
-                )
-            except Exception as e:
-                print(f"❌ Error sending log part {i}: {e}")
+                await run_telethon_async(_spawn_backup_log(event["log_caption"]))
+            except TelethonUnavailable as e:
+                print(f"❌ Failed to send DB backup log: {e}")
+        return True
 
-    return True
+    seq = db_delta_tracker.deltas + 1
+
+    backup_caption = (
+        f"{event['backup_caption']}\n"
+        f"🧬 delta <b>{seq}</b>/{db_delta_tracker.checkpoint_every}"
+    )
+
+    ok = await deliver_backup(
+        {
+            "kind": "db",
+            "filename": backup_delta.DELTA_FILENAME,
+            "caption": backup_caption,
+            "log_caption": event.get("log_caption"),
+            "manifest": "delta",
+        },
+        raw,
+    )
+
+    if ok:
+        db_delta_tracker.delta_uploaded(patch, raw)
+
+    return ok
+
+
+async def report_backup_result(bot, event, ok):
+    if ok:
+        if backup_spool.pending():
+            print(f"📥 DB backup kept in spool ({backup_spool.pending()} waiting)")
+        else:
+            print("✅ DB backup uploaded")
+        return
+
+    print(f"❌ DB backup failed: {db_backup_queue.last_error}")
 
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(
+                chat_id=admin_id,
+                text="⚠️ آپلود بکاپ دیتابیس در گروه تلگرام ناموفق بود.\n"
+                     "تغییرات به صورت محلی ذخیره شده‌اند."
+            )
+        except Exception as e:
+            print(f"❌ Failed to notify admin {admin_id}: {e}")
+
+
+def merge_db_backup_events(events):
+    """
+    چند ذخیره‌ی پشت سر هم -> یک بکاپ.
+    کپشن آخرین ذخیره روی فایل می‌ماند و لاگ همه‌ی ذخیره‌ها (هر کدام با هدر خودش)
+    به ترتیب، ریپلای همان یک بکاپ می‌شوند.
+    """
+    if len(events) == 1:
+        return events[0]
+
+    backup_caption = (
+        f"{events[-1]['backup_caption']}\n"
+        f"🧩 ادغام <b>{len(events)}</b> ذخیره‌ی پشت سر هم"
+    )
+
+    log_parts = []
+    for event in events:
+        if not event.get("log_caption"):
+            continue
+
+        if event["backup_caption"] != "database.json":
+            log_parts.append(f"{event['backup_caption']}\n\n{event['log_caption']}")
+        else:
+            log_parts.append(event["log_caption"])
+
+    return {
+        "backup_caption": backup_caption,
+        "log_caption": "\n\n➖➖➖➖➖\n\n".join(log_parts) or None,
+        "queued_at": events[0].get("queued_at"),
+        "merged": len(events),
+        "checkpoint": any(event.get("checkpoint") for event in events),
+    }
+
+
+async def db_checkpoint_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /checkpoint : بکاپ کامل دستی (شروع زنجیره‌ی delta جدید).
+    """
+    user = update.effective_user
+    if not user or user.id not in ADMIN_IDS:
+        return
+
+    event = {
+        "backup_caption": format_backup_caption(user, "checkpoint دستی"),
+        "log_caption": None,
+        "checkpoint": True,
+    }
+
+    if db_backup_queue.submit(event):
+        await update.message.reply_text("⏳ بکاپ کامل دیتابیس در صف آپلود قرار گرفت.")
+    else:
+        await update.message.reply_text("❌ صف بکاپ فعال نیست.")
+
+
+db_backup_queue = BackupQueue(
+    process_db_backup_event,
+    name="db_backup",
+    debounce=DB_BACKUP_DEBOUNCE,
+    max_delay=DB_BACKUP_MAX_DELAY,
+    merge=merge_db_backup_events,
+)
+
+
+async def compact_db_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    فشرده‌سازی پس‌زمینه ژورنال دیتابیس: snapshot روی همین حلقه گرفته می‌شود
+    و نوشتن database.json جدید داخل ترد جدا انجام می‌شود.
+    """
+    if not library_store.needs_compaction():
+        return
+
+    if not library_store.take_compaction():
+        return
+
+    await asyncio.to_thread(library_store.write_compaction)
+    print("🗜 DB journal compacted")
+
+
+# ============ USERDATA BACKUP WITH TELEGRAM ============
+
+async def _download_userdata_snapshot():
+    found = await _fetch_manifest_file(USERDATA_BACKUP_CHAT_ID, "userdata.json")
+
+    if found:
+        _write_verified_file(USERDATA_FILE, found[1])
+        return True
+
+    return await _download_latest_file_from_telegram(
+        USERDATA_BACKUP_CHAT_ID, "userdata.json", USERDATA_FILE
+    )
+
+
+def download_userdata_from_telegram():
+    # مثل download_db_from_telegram: False یعنی بکاپی نیست، خطا بالا می‌رود
+    return run_telethon(_download_userdata_snapshot())
+
+
+async def _upload_userdata_bytes(raw):
+    sent_message = await _upload_bytes_to_telegram(
+        USERDATA_BACKUP_CHAT_ID, "userdata.json", raw, "userdata.json"
+    )
+
+    if sent_message:
+        entry = backup_manifest.make_entry(sent_message.id, raw)
+        await _update_manifest(USERDATA_BACKUP_CHAT_ID, "userdata.json", lambda _old: entry)
+
+    return sent_message
+
+
+def upload_userdata_to_telegram():
+    """
+    داخل ترد flush userdata صدا زده می‌شود؛ در قطعی مقصد، نسخه در spool می‌ماند.
+    """
+    with open(USERDATA_FILE, "rb") as f:
+        raw = f.read()
+
+    return deliver_backup_sync({"kind": "userdata"}, raw)
+
+
+userdata_store = create_userdata_store(
+    USERDATA_BACKEND,
+    USERDATA_FILE,
+    db_path=USERDATA_DB_FILE,
+    uploader=upload_userdata_to_telegram,
+    flush_interval=USERDATA_FLUSH_INTERVAL,
+    flush_threshold=USERDATA_FLUSH_THRESHOLD,
+    upload_every=10,
+)
+
+
+def init_userdata():
+    """
+    فقط بار اول: اگر userdata محلی نبود از گروه تلگرام بگیر و store را باز کن.
+    """
+    if userdata_store.is_loaded():
+        return True
+
+    # اگر فایل محلی نبود، از گروه تلگرام بگیر
+    if not userdata_store.exists() and not os.path.exists(USERDATA_FILE):
+        print("⚠️ Local userdata not found. Restoring from Telegram group...")
 
+        try:
+            found = download_userdata_from_telegram()
+        except Exception as e:
+            _restore_failed("userdata", e)
+            return False
+
+        if not found:
+            print("⚠️ No userdata backup in Telegram. Creating new userdata.")
+
+            save_userdata({})
+            return True
+
+    try:
+        userdata_store.open()
+        return True
+
+    except Exception as e:
+        print("❌ Failed to load userdata:", e)
+        return False
+
+
+def load_userdata():
+    """
+    کل userdata با فرمت userdata.json (برای خروجی گرفتن / بکاپ).
+    برای خواندن یک کاربر یا یک تنظیم از get_user_record / get_userdata_setting استفاده شود.
+    """
+    if not init_userdata():
+        return {}
+
+    return userdata_store.load()
+
+
+def get_user_record(user_id) -> dict:
+    if not init_userdata():
+        return {}
+    return userdata_store.get_user(user_id)
 
-# ============ USERDATA BACKUP WITH TELEGRAM ============
 
-def download_userdata_from_telegram():
-    return download_latest_file_from_telegram(
-        chat_id=USERDATA_BACKUP_CHAT_ID,
-        filename="userdata.json",
-        save_path=USERDATA_FILE
-    )
+def update_user_record(user_id, upload=True, **fields):
+    if init_userdata():
+        userdata_store.update_user(user_id, upload=upload, **fields)
 
 
-def upload_userdata_to_telegram():
-    return upload_file_to_telegram(
-        chat_id=USERDATA_BACKUP_CHAT_ID,
-        file_path=USERDATA_FILE,
-        caption="userdata.json"
-    )
+def get_userdata_setting(key, default=None):
+    if not init_userdata():
+        return default
+    return userdata_store.get_setting(key, default)
 
 
-def load_userdata():
-    # اگر فایل محلی نبود، از گروه تلگرام بگیر
-    if not os.path.exists(USERDATA_FILE):
-        print("⚠️ Local userdata not found. Restoring from Telegram group...")
+def set_userdata_setting(key, value):
+    if init_userdata():
+        userdata_store.set_setting(key, value)
 
-        if not download_userdata_from_telegram():
-            print("⚠️ No userdata backup in Telegram. Creating new userdata.")
 
-            save_userdata({})
-            return {}
+def get_sub_admins() -> list:
+    return get_userdata_setting("sub_admins", [])
 
-    try:
-        with open(USERDATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
 
-    except Exception as e:
-        print("❌ Failed to load userdata:", e)
-        return {}
+def increment_admin_buttons_count(user_id):
+    buttons_count = dict(get_userdata_setting("sub_admins_buttons", {}))
+    buttons_count[str(user_id)] = buttons_count.get(str(user_id), 0) + 1
+    set_userdata_setting("sub_admins_buttons", buttons_count)
 
 
 def save_userdata(data, upload=True):
-    # ذخیره لوکال
-    try:
-        with open(USERDATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    # ذخیره فوری لوکال (از ترد جدا صدا زده شود)؛ آپلود در گروه تلگرام با flush بعدی
+    return userdata_store.replace(data, upload=upload)
 
-        print("💾 Userdata saved locally")
 
-    except Exception as e:
-        print("❌ Failed to save userdata locally:", e)
-        return False
+async def flush_userdata_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    flusher دوره‌ای userdata: وقتی زمان یا تعداد رکوردهای کثیف به حد رسید،
+    snapshot روی همین حلقه گرفته می‌شود و نوشتن/آپلود داخل ترد جدا انجام می‌شود.
+    """
+    if not userdata_store.should_flush():
+        return
 
-    # ارسال به گروه تلگرام فقط وقتی لازم داریم
-    if upload:
-        return upload_userdata_to_telegram()
+    snapshot = userdata_store.take_snapshot()
+    if snapshot is None:
+        return
 
-    return True
+    await asyncio.to_thread(userdata_store.write_snapshot, snapshot)
 
 def track_user_activity(update: Update, count_message=True):
     """
@@ -453,10 +1279,10 @@ def track_user_activity(update: Update, count_message=True):
     if is_user_banned(user.id):
         return
 
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
+    if not init_userdata():
+        return
 
-    old_data = users.get(user_id, {})
+    old_data = userdata_store.get_user(user_id)
     old_count = int(old_data.get("message_count", 0))
 
     full_name = user.full_name or "بدون نام"
@@ -481,68 +1307,52 @@ def track_user_activity(update: Update, count_message=True):
     # ✅ دیفالت سرچ مود: جنرال
     user_record["search_mode"] = old_data.get("search_mode", "root")
 
-    users[user_id] = user_record
-
-    new_count = user_record["message_count"]
-
     # برای سبک شدن:
-    # هر پیام فقط لوکال ذخیره می‌شود.
-    # پیام اول و هر 10 پیام یک بار، بکاپ userdata هم در تلگرام آپلود می‌شود.
-    should_upload = (old_count == 0) or (new_count % 10 == 0)
-
-    save_userdata(userdata, upload=should_upload)
+    # رکورد فقط در حافظه کثیف علامت می‌خورد و flush_userdata_job آن را می‌نویسد.
+    # پیام اول و هر 10 پیام یک بار، بکاپ userdata هم در flush بعدی آپلود می‌شود.
+    userdata_store.put_user(user_id, user_record)
 
 def is_user_banned(user_id: int) -> bool:
-    userdata = load_userdata()
-    user_data = userdata.get("users", {}).get(str(user_id), {})
+    user_data = get_user_record(user_id)
     return bool(user_data.get("banned", False))
 
 
-def get_sorted_users_for_management(filter_mode="all"):
+def get_sorted_users_for_management(filter_mode="all", offset=0, limit=None):
     """
     filter_mode:
       - all
       - banned
       - not_banned
-    """
-    userdata = load_userdata()
-    users = userdata.get("users", {})
 
-    result = []
+    مرتب‌شده بر اساس تعداد پیام (نزولی)؛ با offset/limit فقط همان صفحه خوانده می‌شود.
+    """
+    if not init_userdata():
+        return []
 
-    for user_id, data in users.items():
-        try:
-            count = int(data.get("message_count", 0))
-        except Exception:
-            count = 0
-
-        item = {
-            "id": int(data.get("id", user_id)),
-            "full_name": data.get("full_name") or "بدون نام",
-            "username": data.get("username"),
-            "message_count": count,
-            "banned": bool(data.get("banned", False))
-        }
+    return userdata_store.list_users(filter_mode, offset=offset, limit=limit)
 
-        if filter_mode == "banned" and not item["banned"]:
-            continue
-        if filter_mode == "not_banned" and item["banned"]:
-            continue
 
-        result.append(item)
+def count_users_for_management(filter_mode="all") -> int:
+    if not init_userdata():
+        return 0
 
-    result.sort(key=lambda x: x["message_count"], reverse=True)
-    return result
+    return userdata_store.count_users(filter_mode)
 
 
-def build_user_action_keyboard(users_list, action="ban", page=0, page_size=8):
+def build_user_action_keyboard(users_list, action="ban", page=0, page_size=8, total=None):
     """
     action = ban | unban | send_msg
+
+    اگر total داده شود، users_list همان کاربران صفحه فعلی است.
     """
-    total = len(users_list)
     start = page * page_size
     end = start + page_size
-    page_users = users_list[start:end]
+
+    if total is None:
+        total = len(users_list)
+        page_users = users_list[start:end]
+    else:
+        page_users = users_list
 
     keyboard = []
 
@@ -638,8 +1448,7 @@ def pop_pending_caption(context):
 #------ تغییر تعداد هر دکمه در یک ردیف ----------
 async def set_custom_layout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    userdata = load_userdata()
-    is_admin = (user_id in ADMIN_IDS) or (user_id in userdata.get("sub_admins", []))
+    is_admin = (user_id in ADMIN_IDS) or (user_id in get_sub_admins())
 
     if not is_admin:
         return
@@ -664,7 +1473,7 @@ async def set_custom_layout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 💡 قابلیت جدید: اگر فقط خط اول فرستاده شده بود (/style)، لایوت سفارشی حذف شده و به حالت عادی برمی‌گردد
     if len(lines) < 2:
         push_admin_history(context, db)
-        db[current_node_id].pop("layout", None)
+        layout_ops = library_edits.remove_layout(db, current_node_id)
         
         bot_username = context.bot.username
         node_name = node["name"]
@@ -676,7 +1485,7 @@ async def set_custom_layout(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         set_pending_caption(context, log_caption)
         set_pending_backup_caption(context, backup_caption)
-        save_db(db, context=context)
+        save_db(db, context=context, ops=layout_ops)
         
         await update.message.reply_text(
             "✅ چیدمان سفارشی حذف شد و به حالت استاندارد بازگشت.",
@@ -747,17 +1556,12 @@ async def set_custom_layout(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for i in range(0, len(missing_ids), max_cols):
             new_layout.append(missing_ids[i:i+max_cols])
 
-    # همچنین ترتیب اصلی children را بر اساس این لایوت جدید مرتب می‌کنیم تا ترتیب فیزیکی دیتابیس هم درست بماند
-    ordered_children = []
-    for row in new_layout:
-        ordered_children.extend(row)
-    
     # پشتیبانی از undo/redo
     push_admin_history(context, db)
 
-    # آپدیت دیتابیس
-    db[current_node_id]["layout"] = new_layout
-    db[current_node_id]["children"] = ordered_children
+    # آپدیت دیتابیس؛ ترتیب اصلی children هم بر اساس این لایوت جدید مرتب می‌شود
+    # تا ترتیب فیزیکی دیتابیس هم درست بماند
+    layout_ops = library_edits.set_layout(db, current_node_id, new_layout)
 
     # لاگ‌گیری
     bot_username = context.bot.username
@@ -772,7 +1576,7 @@ async def set_custom_layout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     set_pending_caption(context, log_caption)
     set_pending_backup_caption(context, backup_caption)
     
-    save_db(db, context=context)
+    save_db(db, context=context, ops=layout_ops)
 
     await update.message.reply_text(
         "✅ چیدمان سفارشی دکمه‌ها با موفقیت اعمال شد.",
@@ -780,39 +1584,9 @@ async def set_custom_layout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return CHOOSING
 
-def cleanup_node_layout(node: dict):
-    """
-    لایوت پوشه را با children سینک می‌کند:
-    - هر دکمه‌ای که دیگر در children نیست از layout حذف می‌شود
-    - ردیف‌های خالی حذف می‌شوند
-    - اگر layout خالی شد، کل فیلد layout حذف می‌شود
-    """
-    children = node.get("children", [])
-    layout = node.get("layout")
-
-    if not layout:
-        return
-
-    valid_children = set(children)
-    cleaned_layout = []
-
-    for row in layout:
-        if not isinstance(row, list):
-            continue
-        cleaned_row = [child_id for child_id in row if child_id in valid_children]
-        if cleaned_row:
-            cleaned_layout.append(cleaned_row)
-
-    if cleaned_layout:
-        node["layout"] = cleaned_layout
-    else:
-        node.pop("layout", None)
-
-
 async def set_row_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    userdata = load_userdata()
-    is_admin = (user_id in ADMIN_IDS) or (user_id in userdata.get("sub_admins", []))
+    is_admin = (user_id in ADMIN_IDS) or (user_id in get_sub_admins())
 
     if not is_admin:
         return
@@ -838,7 +1612,7 @@ async def set_row_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
     push_admin_history(context, db)
     
     old_count = db[current_node_id].get("row_count", 2)
-    db[current_node_id]["row_count"] = count
+    row_count_ops = library_edits.set_row_count(db, current_node_id, count)
     
     bot_username = context.bot.username
     node_name = db[current_node_id]["name"]
@@ -855,7 +1629,7 @@ async def set_row_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
     set_pending_caption(context, log_caption)
     set_pending_backup_caption(context, backup_caption)
     
-    save_db(db, context=context)
+    save_db(db, context=context, ops=row_count_ops)
 
     await update.message.reply_text(
         f"✅ تعداد ستون‌ها برای این پوشه به {count} تغییر یافت.",
@@ -868,9 +1642,7 @@ async def set_row_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #------ دکمه های رنگی ----------
 async def set_node_style(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    userdata = load_userdata()
-
-    is_admin = (user_id in ADMIN_IDS) or (user_id in userdata.get("sub_admins", []))
+    is_admin = (user_id in ADMIN_IDS) or (user_id in get_sub_admins())
 
     if not is_admin:
         return
@@ -922,10 +1694,7 @@ async def set_node_style(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_style = styles[command]
     new_color_name = command_color_names[command]
 
-    if new_style is None:
-        db[current_node_id].pop("style", None)
-    else:
-        db[current_node_id]["style"] = new_style
+    style_ops = library_edits.set_style(db, current_node_id, new_style)
 
     bot_username = context.bot.username
     node_name = db[current_node_id]["name"]
@@ -942,7 +1711,7 @@ async def set_node_style(update: Update, context: ContextTypes.DEFAULT_TYPE):
     set_pending_caption(context, log_caption)
     set_pending_backup_caption(context, backup_caption)
     
-    save_db(db, context=context)
+    save_db(db, context=context, ops=style_ops)
     
     parent_id = db[current_node_id].get("parent", "root")
     context.user_data["current_node"] = parent_id
@@ -961,20 +1730,18 @@ async def set_node_style(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ========= favorite folder ===============
 async def on_off_favorite(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
-    user = users.setdefault(str(user_id), {})
+    user = get_user_record(user_id)
     current_node = context.user_data.get("current_node", "root")
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
     current = user.get("favorites_disabled", False)
 
-    user["favorites_disabled"] = not current
+    favorites_disabled = not current
 
-    save_userdata(userdata, upload=True)
+    update_user_record(user_id, favorites_disabled=favorites_disabled)
 
-    if user["favorites_disabled"]:
+    if favorites_disabled:
         text = "🔒 پوشه دلخواه خاموش شد."
     else:
         text = "🔓 پوشه دلخواه دوباره فعال شد."
@@ -984,45 +1751,34 @@ async def on_off_favorite(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 def add_to_favorites(user_id, node_id, content_index):
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
-    user_record = users.setdefault(str(user_id), {})
-    favorites = user_record.setdefault("favorites", [])
+    if not init_userdata():
+        return False
 
-    item = {"node_id": node_id, "content_index": content_index}
-    
     # جلوگیری از تکراری بودن
-    if item not in favorites:
-        favorites.append(item)
-        save_userdata(userdata, upload=True)
-        return True
-    return False
+    return userdata_store.add_favorite(user_id, node_id, content_index)
 
 def remove_from_favorites(user_id, node_id, content_index):
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
-    user_record = users.get(str(user_id), {})
-    favorites = user_record.get("favorites", [])
-
-    item = {"node_id": node_id, "content_index": content_index}
-    if item in favorites:
-        favorites.remove(item)
-        save_userdata(userdata, upload=True)
-        return True
-    return False
+    if not init_userdata():
+        return False
+
+    return userdata_store.remove_favorite(user_id, node_id, content_index)
 
 def clear_all_favorites(user_id):
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
-    user_record = users.get(str(user_id), {})
-    if "favorites" in user_record:
-        user_record["favorites"] = []
-        save_userdata(userdata, upload=True) # ذخیره و آپلود نهایی
-
-def prune_invalid_favorites(user_id: int | str, userdata: dict, db: dict) -> list:
+    if not init_userdata():
+        return
+
+    if userdata_store.get_favorites(user_id):
+        userdata_store.set_favorites(user_id, []) # ذخیره و آپلود نهایی
+
+def get_user_favorites(user_id) -> list:
+    if not init_userdata():
+        return []
+
+    return userdata_store.get_favorites(user_id)
+
+def prune_invalid_favorites(user_id: int | str, db: dict) -> list:
     user_id = str(user_id)
-    user = userdata.setdefault("users", {}).setdefault(user_id, {})
-    favorites = user.get("favorites", [])
+    favorites = get_user_favorites(user_id)
 
     valid_favorites = []
     changed = False
@@ -1044,8 +1800,7 @@ def prune_invalid_favorites(user_id: int | str, userdata: dict, db: dict) -> lis
         valid_favorites.append(fav)
 
     if changed:
-        user["favorites"] = valid_favorites
-        save_userdata(userdata)
+        userdata_store.set_favorites(user_id, valid_favorites)
 
     return valid_favorites
 
@@ -1066,14 +1821,12 @@ async def handle_reaction(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = reaction.chat.id
     msg_id = reaction.message_id
 
-    userdata = load_userdata()
     current=context.user_data.get("current_node", "root")
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
     # پیش‌فرض برای همه True (روشن) است. اگر فیلد favorites_disabled  معادل True باشد یعنی خاموش است.
-    users = userdata.get("users", {})
-    favorites_disabled = users.get(str(user_id), {}).get("favorites_disabled", False)
+    favorites_disabled = get_user_record(user_id).get("favorites_disabled", False)
     
     if is_user_banned(user_id):
         await update.message.reply_text(
@@ -1298,8 +2051,7 @@ async def handle_reaction(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
 async def clear_favorites_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     user_id = update.effective_user.id
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
@@ -1319,12 +2071,14 @@ async def clear_favorites_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
 # --- KEYBOARD BUILDERS --- --- KEYBOARD BUILDERS --- --- KEYBOARD BUILDERS --- --- KEYBOARD BUILDERS --- --- KEYBOARD BUILDERS --- --- KEYBOARD BUILDERS --- --- KEYBOARD BUILDERS -
 
 def get_keyboard(node_id, is_admin, user_id=None):
-    db = load_db()
-    node = db.get(node_id)
+    # فقط متادیتای نود و فرزندانش (نام/استایل)، بدون خواندن محتواها
+    menu = node_menu(get_db_view(), node_id)
 
-    if not node:
+    if not menu:
         return ReplyKeyboardMarkup([["/start"]], resize_keyboard=True)
 
+    node, children = menu
+    child_nodes = dict(children)
     children_ids = node.get("children", [])
     layout = node.get("layout")  # 💡 خواندن لایوت سفارشی (در صورت وجود)
     max_cols = node.get("row_count", 2)  # 💡 خواندن تعداد ستون پیش‌فرض (۲)
@@ -1333,7 +2087,7 @@ def get_keyboard(node_id, is_admin, user_id=None):
 
     # تابع کمکی داخلی برای ساخت دکمه با یا بدون استایل رنگی
     def make_button(c_id):
-        child_node = db.get(c_id)
+        child_node = child_nodes.get(c_id)
         if not child_node:
             return None
         btn_style = child_node.get("style")
@@ -1386,13 +2140,11 @@ def get_keyboard(node_id, is_admin, user_id=None):
 
     # ========= favorite folder ===============
     if user_id:
-        userdata = load_userdata()
-        users = userdata.get("users", {})
-        favorites_disabled = users.get(str(user_id), {}).get("favorites_disabled", False)
+        favorites_disabled = get_user_record(user_id).get("favorites_disabled", False)
         if favorites_disabled:
             favorites = []
         else:
-            favorites = userdata.get("users", {}).get(str(user_id), {}).get("favorites", [])
+            favorites = get_user_favorites(user_id)
         if favorites:
             favorite_btn = KeyboardButton(
                 text="📁 پوشه دلخواه",
@@ -2122,7 +2874,7 @@ async def send_node_contents(update: Update, context: ContextTypes.DEFAULT_TYPE,
     """محتواهای موجود در نود فعلی را ارسال می‌کند."""
     set_report_page(context, node_id)
 
-    db = load_db()
+    db = get_db_view()
     contents = db.get(node_id, {}).get("contents", [])
 
     if not contents:
@@ -2294,29 +3046,6 @@ def format_admin_log(admin_user, description):
     )
     return f"{header}{description}"
 
-def split_html_message_by_lines(text: str, max_len: int = 3000) -> list:
-    if not text:
-        return []
-    lines = text.split("\n")
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for line in lines:
-        line_len = len(line) + 1  # طول خط به همراه کاراکتر newline
-        if current_length + line_len > max_len:
-            if current_chunk:
-                chunks.append("\n".join(current_chunk))
-            current_chunk = [line]
-            current_length = line_len
-        else:
-            current_chunk.append(line)
-            current_length += line_len
-            
-    if current_chunk:
-        chunks.append("\n".join(current_chunk))
-    return chunks
-
 # ================= هدر لاگ تغییرات ادمین===================
 
 def format_backup_caption(admin_user, action_type):
@@ -2597,8 +3326,7 @@ async def file_id_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_reply_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     user_id = update.effective_user.id
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
     if not is_admin:
@@ -2649,8 +3377,6 @@ async def handle_reply_delete(update: Update, context: ContextTypes.DEFAULT_TYPE
     media_group_id = target_item.get("media_group_id")
     groupable_types = {"photo", "video", "document", "audio"}
 
-    removed_items = []
-
     if media_group_id and target_item.get("type") in groupable_types:
         start = idx
         while start > 0:
@@ -2674,8 +3400,7 @@ async def handle_reply_delete(update: Update, context: ContextTypes.DEFAULT_TYPE
             else:
                 break
 
-        removed_items = contents[start:end + 1]
-        del contents[start:end + 1]
+        removed_items, remove_ops = library_edits.remove_contents(db, node_id, start, end + 1 - start)
 
         # ساخت لاگ حذف گروه رسانه‌ای
         log_desc_parts = [f"🗑 <b>حذف شدن فایل ها (آلبوم) از پوشه {node_link}:</b>\n"]
@@ -2684,8 +3409,8 @@ async def handle_reply_delete(update: Update, context: ContextTypes.DEFAULT_TYPE
         desc = "\n\n".join(log_desc_parts)
         removed_count = len(removed_items)
     else:
-        removed_item = contents.pop(idx)
-        removed_items.append(removed_item)
+        removed_items, remove_ops = library_edits.remove_contents(db, node_id, idx, 1)
+        removed_item = removed_items[0]
         
         # ساخت لاگ حذف تک محتوا
         desc = f"🗑 <b>حذف شدن فایل ها (تک مورد) از پوشه {node_link}:</b>\n\n" + get_item_log_details(removed_item, 1, bot_username)
@@ -2697,7 +3422,7 @@ async def handle_reply_delete(update: Update, context: ContextTypes.DEFAULT_TYPE
     set_pending_caption(context, log_caption)
     set_pending_backup_caption(context, backup_caption)
     
-    save_db(db, context=context)
+    save_db(db, context=context, ops=remove_ops)
     
 
     # پاک‌کردن مپینگ این نود به دلیل تغییر ایندکس‌ها
@@ -2716,8 +3441,7 @@ async def handle_reply_delete(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def handle_reply_change(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     user_id = update.effective_user.id
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
     if not is_admin:
@@ -2801,38 +3525,68 @@ async def handle_reply_change(update: Update, context: ContextTypes.DEFAULT_TYPE
     return WAITING_CONTENT
 
 # ======= سرچ هوشمند ======= # # ======= سرچ هوشمند ======= # # ======= سرچ هوشمند ======= #
-def get_subtree_db(db, root_node_id):
-    subtree = {}
+def render_search_results(db, results, bot_username):
+    """
+    بلاک‌های HTML نتایج (۵ نتیجه اول + ۱۰ نتیجه بعدی) برای کش شدن همراه نتایج.
+    """
+    # 5 نتیجه اول
+    first_results = results[:5]
+    # 10 نتیجه بعدی
+    more_results = results[5:15]
 
-    def build_search_context(node_id):
-        parts = []
-        current = node_id
+    # بلاک نتایج اول - بدون تیتر اضافه داخل بلاک
+    first_block = "<blockquote expandable>"
+    for item in first_results:
+        node_id = item["node_id"]
+        path_html = get_node_path_html(db, node_id, bot_username)
+        first_block += f"📂 {path_html}\n"
+        first_block += f"درصد تطابق: {int(item['score'])}٪\n\n"
+    first_block = first_block.rstrip() + "</blockquote>"
 
-        while current and current in db:
-            if current != "root":
-                parts.append(db[current].get("name", ""))
-            current = db[current].get("parent")
+    html = first_block + "\n\n"
 
-        parts.reverse()
-        return " ".join(parts)
+    # بلاک نتایج بیشتر
+    if more_results:
+        html += "📋 نتایج بیشتر:\n"
+        more_block = "<blockquote expandable>"
+        for item in more_results:
+            node_id = item["node_id"]
+            path_html = get_node_path_html(db, node_id, bot_username)
+            more_block += f"📂 {path_html}\n"
+            more_block += f"درصد تطابق: {int(item['score'])}٪\n\n"
+        more_block = more_block.rstrip() + "</blockquote>"
+        html += more_block + "\n\n"
 
-    def add_node_recursive(node_id):
-        if node_id not in db:
-            return
+    return html
 
-        node = copy.deepcopy(db[node_id])
-        search_context = build_search_context(node_id)
-        node["name"] = search_context
 
-        # ✅ اگر نود فعلی همان ریشه جستجو باشد و ریشه اصلی (root) نباشد، خود نود را در دیتابیس جستجو قرار نده.
-        if node_id != root_node_id or root_node_id == "root":
-            subtree[node_id] = node
+async def search_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /search_stats : وضعیت ایندکس و کش سرچ هوشمند (فقط ادمین).
+    """
+    user = update.effective_user
+    if not user or user.id not in ADMIN_IDS:
+        return
 
-        for child in db[node_id].get("children", []):
-            add_node_recursive(child)
+    stats = search_result_cache.stats()
+    pool_stats = search_pool.stats()
+
+    await update.message.reply_text(
+        "🔎 <b>Smart Search</b>\n"
+        f"نودهای ایندکس: {len(library_search_index.entries)}\n"
+        f"واژگان: {len(library_search_index.postings)}\n\n"
+        "🗂 <b>Result Cache</b>\n"
+        f"تعداد کلید: {stats['entries']}/{SEARCH_CACHE_SIZE}\n"
+        f"hit: {stats['hits']} | miss: {stats['misses']} "
+        f"({stats['hit_ratio'] * 100:.1f}٪)\n"
+        f"حذف LRU: {stats['evictions']} | خالی‌شدن با ذخیره: {stats['invalidations']}\n\n"
+        "⚙️ <b>Search Pool</b>\n"
+        f"ترد: {pool_stats['workers']} | سقف هم‌زمان: {pool_stats['in_flight_limit']}\n"
+        f"در صف/در حال اجرا: {pool_stats['pending']} (منتظر: {pool_stats['waiting']})\n"
+        f"انجام‌شده: {pool_stats['completed']} | ردشده: {pool_stats['rejected']}",
+        parse_mode="HTML",
+    )
 
-    add_node_recursive(root_node_id)
-    return subtree
 
 async def handle_smart_search(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, is_admin: bool):
     full_db = load_db()
@@ -2844,17 +3598,15 @@ async def handle_smart_search(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = str(user.id)
     current_node = context.user_data.get("current_node", "root")
 
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
+    user_record = get_user_record(user_id)
 
     # اگر کاربر در userdata نبود، ثبت اولیه شود
-    if user_id not in users:
+    if not user_record:
         track_user_activity(update, count_message=False)
-        userdata = load_userdata()
-        users = userdata.setdefault("users", {})
+        user_record = get_user_record(user_id)
 
     # دیفالت = root
-    search_mode = users.get(user_id, {}).get("search_mode", "root")
+    search_mode = user_record.get("search_mode", "root")
 
     # تعیین محدوده جستجو
     if search_mode == "current_node":
@@ -2866,10 +3618,53 @@ async def handle_smart_search(update: Update, context: ContextTypes.DEFAULT_TYPE
         mode_title = "General Search"
         mode_desc = "جستجو در کل کتابخانه انجام شد."
 
-    subtree_db = get_subtree_db(full_db, search_root)
+    bot_username = context.bot.username
+    index = get_search_index()
+
+    # جستجوی تکراری: نتایج و HTML مسیرها مستقیم از کش (بدون امتیازدهی و ساخت مسیر)
+    cache_key = search_key(text, search_root, index.generation, bot_username)
+    cached = search_result_cache.get(cache_key)
+
+    if cached is None:
+        # جستجو روی ایندکس آماده (بدون flatten دوباره) در search_pool: مجموعا 15 نتیجه
+        try:
+            results = await search_pool.run(
+                user_id,
+                index.search,
+                text,
+                scope=search_root,
+                limit=15,
+                min_score=45,
+                prefilter=SEARCH_MAX_CANDIDATES > 0,
+                batch=SEARCH_BATCH_SCORING,
+                workers=SEARCH_SCORE_WORKERS,
+                score_cutoff=SEARCH_SCORE_CUTOFF or None,
+                time_budget=SEARCH_TIME_BUDGET or None,
+                max_items=SEARCH_MAX_SCORED or None,
+            )
+        except SearchBusyError:
+            await update.message.reply_text(
+                "⏳ جستجوی قبلی شما هنوز در حال انجام است؛ لطفاً چند لحظه صبر کنید."
+            )
+            return CHOOSING
+
+        cached = {
+            "results": results,
+            "html": render_search_results(full_db, results, bot_username) if results else "",
+        }
+
+        # نتیجه‌ی ناقص کش نمی‌شود تا تکرار همان جستجو (با بار کمتر) نتیجه‌ی کامل بگیرد
+        if not search_result_cache.put_results(cache_key, results, cached):
+            print(f"⏱️ Smart search hit its budget (query={text[:40]!r}, scope={search_root})")
 
-    # جستجو: مجموعا 15 نتیجه
-    results = smart_search(subtree_db, text, limit=15, min_score=45)
+    results = cached["results"]
+
+    partial_block = (
+        "<blockquote>"
+        "⏱️ جستجو به سقف زمان رسید؛ بهترین نتایج پیدا شده تا همین لحظه نمایش داده شده‌اند.\n"
+        "💡 برای نتیجه‌ی دقیق‌تر، عبارت جستجو را کامل‌تر بنویسید یا کمی بعد دوباره امتحان کنید."
+        "</blockquote>\n\n"
+    ) if results.partial else ""
 
     help_block = (
         "<blockquote>"
@@ -2899,49 +3694,20 @@ async def handle_smart_search(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
 
         await update.message.reply_text(
-            f"{not_found_text}\n\n{help_block}",
+            f"{not_found_text}\n\n{partial_block}{help_block}",
             parse_mode="HTML",
             disable_web_page_preview=True
         )
         return CHOOSING
 
-    bot_username = context.bot.username
-
     msg = (
         f"🔎 <b>{mode_title}</b>\n"
         f"{mode_desc}\n\n"
         f"🔍 نتایج یافت شده:\n"
     )
+    msg += cached["html"]
 
-    # 5 نتیجه اول
-    first_results = results[:5]
-    # 10 نتیجه بعدی
-    more_results = results[5:15]
-
-    # بلاک نتایج اول - بدون تیتر اضافه داخل بلاک
-    first_block = "<blockquote expandable>"
-    for item in first_results:
-        node_id = item["node_id"]
-        path_html = get_node_path_html(full_db, node_id, bot_username)
-        first_block += f"📂 {path_html}\n"
-        first_block += f"درصد تطابق: {int(item['score'])}٪\n\n"
-    first_block = first_block.rstrip() + "</blockquote>"
-
-    msg += first_block + "\n\n"
-
-    # بلاک نتایج بیشتر
-    if more_results:
-        msg += "📋 نتایج بیشتر:\n"
-        more_block = "<blockquote expandable>"
-        for item in more_results:
-            node_id = item["node_id"]
-            path_html = get_node_path_html(full_db, node_id, bot_username)
-            more_block += f"📂 {path_html}\n"
-            more_block += f"درصد تطابق: {int(item['score'])}٪\n\n"
-        more_block = more_block.rstrip() + "</blockquote>"
-        msg += more_block + "\n\n"
-
-    msg += path_hint_block + "\n\n" + help_block
+    msg += partial_block + path_hint_block + "\n\n" + help_block
 
     await update.message.reply_text(
         msg,
@@ -2958,24 +3724,20 @@ async def toggle_search_mode(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return CHOOSING
 
     user_id = str(user.id)
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
+    user_record = get_user_record(user_id)
 
     # اگر کاربر هنوز در userdata نبود، اول ثبتش کن
-    if user_id not in users:
+    if not user_record:
         track_user_activity(update, count_message=False)
-        userdata = load_userdata()
-        users = userdata.setdefault("users", {})
+        user_record = get_user_record(user_id)
 
-    old_mode = users.get(user_id, {}).get("search_mode", "root")
+    old_mode = user_record.get("search_mode", "root")
 
     # toggle
     new_mode = "current_node" if old_mode == "root" else "root"
 
-    users[user_id]["search_mode"] = new_mode
-
     # ذخیره + آپلود
-    save_userdata(userdata, upload=True)
+    update_user_record(user_id, search_mode=new_mode)
 
     if new_mode == "root":
         await update.message.reply_text(
@@ -3007,25 +3769,22 @@ async def toggle_smart_search(update: Update, context: ContextTypes.DEFAULT_TYPE
         return CHOOSING
     
     user_id = str(user.id)
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
+    user_record = get_user_record(user_id)
     
     # اگر کاربر در دیتابیس نبود، ابتدا او را ثبت یا داده‌ی پیش‌فرض می‌گذاریم
-    if user_id not in users:
+    if not user_record:
         # برای ثبت مشخصات اولیه
         track_user_activity(update, count_message=False)
-        userdata = load_userdata()  # بازخوانی دیتای جدید
-        users = userdata.get("users", {})
+        user_record = get_user_record(user_id)  # بازخوانی دیتای جدید
 
     # خواندن وضعیت (اگر مقدار نبود، پیش‌فرض False است؛ یعنی سرچ هوشمند فعال/روشن است)
-    is_disabled = users.get(user_id, {}).get("smart_search_disabled", False)
+    is_disabled = user_record.get("smart_search_disabled", False)
     
     # تغییر وضعیت (معکوس کردن)
     new_disabled_status = not is_disabled
-    users[user_id]["smart_search_disabled"] = new_disabled_status
     
     # ذخیره در فایل
-    save_userdata(userdata, upload=True)
+    update_user_record(user_id, smart_search_disabled=new_disabled_status)
     
     # پیام به کاربر بر اساس وضعیت جدید
     if new_disabled_status:
@@ -3066,8 +3825,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=ReplyKeyboardRemove()
         )
         return ConversationHandler.END
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
     # پاک‌سازی کامل وضعیت قبلی
@@ -3225,23 +3983,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ========= خارج کردن پیام start  از هاردکد==============
 
 def get_start_page_contents():
-    userdata = load_userdata()
-    return userdata.get("start_page_contents", [])
+    return get_userdata_setting("start_page_contents", [])
 
 
 def save_start_page_contents(contents):
-    userdata = load_userdata()
-    userdata["start_page_contents"] = contents
-    save_userdata(userdata)
+    set_userdata_setting("start_page_contents", contents)
 
 
 async def send_start_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
-    contents = userdata.get("start_page_contents", [])
+    contents = get_start_page_contents()
     root_keyboard = get_keyboard("root", is_admin, user_id=user_id)
 
     # 1. اگر هیچ محتوایی تنظیم نشده بود، فقط پیام پیش‌فرض به همراه کیبورد را بفرست
@@ -3349,8 +4103,7 @@ async def inline_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
 
     user_id = query.from_user.id
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
 
     # ----  عمومی ---- ---- ----
 
@@ -3505,7 +4258,7 @@ async def inline_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # ---------------- نمایش رمز ادمینی ----------------
     if data == "admin_password":
-        admin_pass = userdata.get("admin_password", "تعریف نشده")
+        admin_pass = get_userdata_setting("admin_password", "تعریف نشده")
 
         await query.message.edit_text(
             f"🔐 رمز ادمینی فعلی:\n\n<code>{admin_pass}</code>",
@@ -3669,8 +4422,7 @@ async def receive_broadcast_content(update: Update, context: ContextTypes.DEFAUL
             return 
         
         target_mode = "all" if text == "✅ تایید و ارسال عمومی" else context.user_data.get("msg_target_id")
-        userdata = load_userdata()
-        targets = userdata.get("users", {}).keys() if target_mode == "all" else [target_mode]
+        targets = (userdata_store.user_ids() if init_userdata() else []) if target_mode == "all" else [target_mode]
 
         # دکمه پاسخ به ادمین
         reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("✍️ پاسخ به ادمین", callback_data="reply_to_admin")]])
@@ -3695,9 +4447,9 @@ async def receive_broadcast_content(update: Update, context: ContextTypes.DEFAUL
 async def show_msg_users_pick_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
     query = update.callback_query
 
-    users_list = get_sorted_users_for_management(filter_mode="all")
+    total_users = count_users_for_management(filter_mode="all")
 
-    if not users_list:
+    if not total_users:
         await query.message.edit_text(
             "📭 هیچ کاربری برای ارسال پیام وجود ندارد.",
             reply_markup=InlineKeyboardMarkup([
@@ -3707,7 +4459,7 @@ async def show_msg_users_pick_page(update: Update, context: ContextTypes.DEFAULT
         return CHOOSING
 
     page_size = 8
-    total_pages = (len(users_list) + page_size - 1) // page_size
+    total_pages = (total_users + page_size - 1) // page_size
 
     if page < 0:
         page = 0
@@ -3715,9 +4467,11 @@ async def show_msg_users_pick_page(update: Update, context: ContextTypes.DEFAULT
     if page >= total_pages:
         page = total_pages - 1
 
-    start = page * page_size
-    end = start + page_size
-    page_users = users_list[start:end]
+    page_users = get_sorted_users_for_management(
+        filter_mode="all",
+        offset=page * page_size,
+        limit=page_size
+    )
 
     msg = "✉️ انتخاب کاربر برای ارسال پیام:\n\n"
     msg += "روی دکمه نام کاربر بزنید یا آیدی عددی او را ارسال کنید.\n\n"
@@ -3745,10 +4499,11 @@ async def show_msg_users_pick_page(update: Update, context: ContextTypes.DEFAULT
         parse_mode="HTML",
         disable_web_page_preview=True,
         reply_markup=build_user_action_keyboard(
-            users_list,
+            page_users,
             action="send_msg",
             page=page,
-            page_size=page_size
+            page_size=page_size,
+            total=total_users
         )
     )
 
@@ -3774,10 +4529,7 @@ async def handle_user_id_input(update: Update, context: ContextTypes.DEFAULT_TYP
 
         target_id = data.split("_")[-1]
 
-        userdata = load_userdata()
-        users = userdata.get("users", {})
-
-        if str(target_id) not in users:
+        if not get_user_record(target_id):
             await query.message.reply_text("❌ این کاربر در لیست کاربران ثبت نشده است.")
             return WAITING_PICK_USER_FOR_MSG
 
@@ -3823,10 +4575,7 @@ async def handle_user_id_input(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("❌ فقط آیدی عددی معتبر بفرستید یا روی دکمه‌های اینلاین بزنید.")
         return WAITING_PICK_USER_FOR_MSG
 
-    userdata = load_userdata()
-    users = userdata.get("users", {})
-
-    if str(target_user_id) not in users:
+    if not get_user_record(target_user_id):
         await update.message.reply_text("❌ این کاربر در لیست کاربران ثبت نشده است.")
         return WAITING_PICK_USER_FOR_MSG
 
@@ -3849,9 +4598,8 @@ async def handle_user_id_input(update: Update, context: ContextTypes.DEFAULT_TYP
 async def list_admins_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
 
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
-    buttons_count = userdata.get("sub_admins_buttons", {})
+    sub_admins = get_sub_admins()
+    buttons_count = get_userdata_setting("sub_admins_buttons", {})
 
     main_admins = [int(x) for x in ADMIN_IDS]
     sub_admins = [int(x) for x in sub_admins]
@@ -3915,10 +4663,9 @@ async def list_users_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
 
-    userdata = load_userdata()
-    users = userdata.get("users", {})
+    total_users = count_users_for_management(filter_mode="all")
 
-    if not users:
+    if not total_users:
         await query.message.edit_text(
             "📭 هنوز هیچ کاربری ثبت نشده است.",
             reply_markup=InlineKeyboardMarkup([
@@ -3942,38 +4689,20 @@ async def list_users_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if page < 0:
         page = 0
 
-    users_list = []
-
-    for user_id, user_data in users.items():
-        try:
-            count = int(user_data.get("message_count", 0))
-        except Exception:
-            count = 0
-
-        users_list.append({
-            "id": str(user_data.get("id", user_id)),
-            "full_name": user_data.get("full_name") or "بدون نام",
-            "username": user_data.get("username"),
-            "message_count": count,
-            "banned": bool(user_data.get("banned", False))
-        })
-
-    # مرتب‌سازی از بیشترین دستور به کمترین
-    users_list.sort(key=lambda x: x["message_count"], reverse=True)
-
     # ---------------- تنظیمات صفحه‌بندی ----------------
     per_page = 15
-    total_users = len(users_list)
     total_pages = (total_users + per_page - 1) // per_page
 
     # اگر صفحه از تعداد صفحات بیشتر شد، برگرد آخرین صفحه
     if page >= total_pages:
         page = total_pages - 1
 
-    start_index = page * per_page
-    end_index = start_index + per_page
-
-    page_users = users_list[start_index:end_index]
+    # مرتب‌سازی از بیشترین دستور به کمترین (فقط همین صفحه خوانده می‌شود)
+    page_users = get_sorted_users_for_management(
+        filter_mode="all",
+        offset=page * per_page,
+        limit=per_page
+    )
 
     # ---------------- ساخت متن پیام ----------------
     msg = f"👥 لیست کاربران ربات\n\n"
@@ -4047,9 +4776,9 @@ async def list_users_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_ban_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page=0):
     query = update.callback_query
 
-    users_list = get_sorted_users_for_management(filter_mode="not_banned")
+    total_users = count_users_for_management(filter_mode="not_banned")
 
-    if not users_list:
+    if not total_users:
         await query.message.edit_text(
             "📭 هیچ کاربر آزادی برای بن کردن وجود ندارد.",
             reply_markup=InlineKeyboardMarkup([
@@ -4059,15 +4788,17 @@ async def show_ban_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE
         return CHOOSING
 
     page_size = 8
-    total_pages = (len(users_list) + page_size - 1) // page_size
+    total_pages = (total_users + page_size - 1) // page_size
     if page < 0:
         page = 0
     if page >= total_pages:
         page = total_pages - 1
 
-    start = page * page_size
-    end = start + page_size
-    page_users = users_list[start:end]
+    page_users = get_sorted_users_for_management(
+        filter_mode="not_banned",
+        offset=page * page_size,
+        limit=page_size
+    )
 
     msg = "🚫 انتخاب کاربر برای بن:\n\n"
     msg += "روی دکمه نام کاربر بزنید یا آیدی عددی او را ارسال کنید.\n\n"
@@ -4094,7 +4825,7 @@ async def show_ban_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE
         msg,
         parse_mode="HTML",
         disable_web_page_preview=True,
-        reply_markup=build_user_action_keyboard(users_list, action="ban", page=page, page_size=page_size)
+        reply_markup=build_user_action_keyboard(page_users, action="ban", page=page, page_size=page_size, total=total_users)
     )
 
     await query.message.reply_text(
@@ -4109,24 +4840,24 @@ async def ban_user_by_id(target_user_id: int, context: ContextTypes.DEFAULT_TYPE
     if target_user_id in ADMIN_IDS:
         return False, "❌ نمی‌توان ادمین اصلی را بن کرد."
 
-    userdata = load_userdata()
-    sub_admins = [int(x) for x in userdata.get("sub_admins", [])]
+    sub_admins = [int(x) for x in get_sub_admins()]
 
     if target_user_id in sub_admins:
         return False, "❌ نمی‌توان ادمین فرعی را بن کرد."
 
-    users = userdata.setdefault("users", {})
-    target_key = str(target_user_id)
+    target_record = get_user_record(target_user_id)
 
-    if target_key not in users:
+    if not target_record:
         return False, "❌ این کاربر در لیست کاربران ثبت نشده است."
 
-    if users[target_key].get("banned", False):
+    if target_record.get("banned", False):
         return False, "⚠️ این کاربر از قبل بن شده است."
 
-    users[target_key]["banned"] = True
-    users[target_key]["last_seen"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    save_userdata(userdata, upload=True)
+    update_user_record(
+        target_user_id,
+        banned=True,
+        last_seen=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
 
     try:
         await context.bot.send_message(
@@ -4220,22 +4951,22 @@ async def receive_unban_user_id(update: Update, context: ContextTypes.DEFAULT_TY
     return CHOOSING
 
 async def unban_user_by_id(update: Update, target_user_id: int, context: ContextTypes.DEFAULT_TYPE):
-    userdata = load_userdata()
-    users = userdata.setdefault("users", {})
-    target_key = str(target_user_id)
+    target_record = get_user_record(target_user_id)
 
-    if target_key not in users:
+    if not target_record:
         return False, "❌ این کاربر در لیست کاربران ثبت نشده است."
 
-    if not users[target_key].get("banned", False):
+    if not target_record.get("banned", False):
         return False, "⚠️ این کاربر بن نیست."
 
-    users[target_key]["banned"] = False
-    users[target_key]["last_seen"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    save_userdata(userdata, upload=True)
+    update_user_record(
+        target_user_id,
+        banned=False,
+        last_seen=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
     user_id = update.effective_user.id
     current = context.user_data.get("current_node", "root")
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
     try:
@@ -4252,9 +4983,9 @@ async def unban_user_by_id(update: Update, target_user_id: int, context: Context
 async def show_unban_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page=0):
     query = update.callback_query
 
-    users_list = get_sorted_users_for_management(filter_mode="banned")
+    total_users = count_users_for_management(filter_mode="banned")
 
-    if not users_list:
+    if not total_users:
         await query.message.edit_text(
             "📭 هیچ کاربر بن‌شده‌ای وجود ندارد.",
             reply_markup=InlineKeyboardMarkup([
@@ -4264,15 +4995,17 @@ async def show_unban_users_page(update: Update, context: ContextTypes.DEFAULT_TY
         return CHOOSING
 
     page_size = 8
-    total_pages = (len(users_list) + page_size - 1) // page_size
+    total_pages = (total_users + page_size - 1) // page_size
     if page < 0:
         page = 0
     if page >= total_pages:
         page = total_pages - 1
 
-    start = page * page_size
-    end = start + page_size
-    page_users = users_list[start:end]
+    page_users = get_sorted_users_for_management(
+        filter_mode="banned",
+        offset=page * page_size,
+        limit=page_size
+    )
 
     msg = "✅ انتخاب کاربر برای خارج کردن از بن:\n\n"
     msg += "روی دکمه نام کاربر بزنید یا آیدی عددی او را ارسال کنید.\n\n"
@@ -4299,7 +5032,7 @@ async def show_unban_users_page(update: Update, context: ContextTypes.DEFAULT_TY
         msg,
         parse_mode="HTML",
         disable_web_page_preview=True,
-        reply_markup=build_user_action_keyboard(users_list, action="unban", page=page, page_size=page_size)
+        reply_markup=build_user_action_keyboard(page_users, action="unban", page=page, page_size=page_size, total=total_users)
     )
 
     await query.message.reply_text(
@@ -4403,16 +5136,14 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=ReplyKeyboardRemove()
         )
         return CHOOSING
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = (user_id in ADMIN_IDS) or (user_id in sub_admins)
 
     # --- Check Admin Password --- --- Check Admin Password --- --- Check Admin Password --- --- Check Admin Password --- --- Check Admin Password --- --- Check Admin Password --- 
-    admin_pass = userdata.get("admin_password")
+    admin_pass = get_userdata_setting("admin_password")
     if admin_pass and text == admin_pass:
-        if user_id not in ADMIN_IDS and user_id not in userdata.get("sub_admins", []):
-            userdata.setdefault("sub_admins", []).append(user_id)
-            save_userdata(userdata)
+        if user_id not in ADMIN_IDS and user_id not in sub_admins:
+            set_userdata_setting("sub_admins", sub_admins + [user_id])
             current = context.user_data.get("current_node", "root")
     
             await update.message.reply_text("✅ رمز تایید شد.\nشما اکنون ادمین هستید 😎",
@@ -4439,7 +5170,8 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # بازیابی نود فعلی
     current_node_id = context.user_data.get('current_node', 'root')
-    db = load_db()
+    # کاربر عادی فقط نودهای لازم را می‌خواند؛ ادمین برای ویرایش کل درخت را لازم دارد
+    db = load_db() if is_admin else get_db_view()
     
     # ⛔ لغو عملیات‌های موقت (حذف / هش / ویرایش و ...)
     if text == "❌ لغو":
@@ -4548,10 +5280,8 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # ========= favorite folder ======================== favorite folder ======================== favorite folder ===============
     if text == "📁 پوشه دلخواه":
-        userdata = load_userdata()
-        users = userdata.get("users", {})
-        favorites = prune_invalid_favorites(user_id, userdata, db)
-        favorites_disabled = users.get(str(user_id), {}).get("favorites_disabled", False)
+        favorites = prune_invalid_favorites(user_id, db)
+        favorites_disabled = get_user_record(user_id).get("favorites_disabled", False)
         if favorites_disabled:
             await update.message.reply_text("❌ شما پوشه دلخواه را غیرفعال کرده‌اید.\n\n⚙️ جهت فعال کردن آن، از دستور /on_off_favorite، استفاده کنید.")
             return
@@ -4570,8 +5300,6 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         # ========= ارسال پوشه دلخواه با پشتیبانی کامل آلبوم =========
-        db = load_db()
-        
         # ساخت لیست موارد واقعی دیتابیس
         resolved = []
         for fav in favorites:
@@ -4728,14 +5456,8 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # ثبت تاریخچه
                 push_admin_history(context, db)
             
-                # حذف از لیست فرزندان والد
-                db[current_node_id]['children'].remove(target_id)
-
-                # پاکسازی چیدمان والد
-                cleanup_node_layout(db[current_node_id])
-                
-                # حذف بازگشتی کل درخت
-                delete_node_recursive(db, target_id)
+                # حذف از لیست فرزندان والد، پاکسازی چیدمان والد و حذف بازگشتی کل درخت
+                delete_ops = library_edits.delete_child(db, current_node_id, target_id)
 
                 bot_username = context.bot.username
                 parent_name = db[current_node_id]["name"]
@@ -4749,7 +5471,7 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 set_pending_caption(context, log_caption)
                 set_pending_backup_caption(context, backup_caption)
                 
-                save_db(db, context=context)
+                save_db(db, context=context, ops=delete_ops)
                 
                 await update.message.reply_text(
                     f"دکمه '{target_name}' و تمام زیرمجموعه‌هایش حذف شد.",
@@ -4760,10 +5482,10 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return CHOOSING
 
         if text == "📥 دریافت بکاپ":
-            # ساخت فایل زیپ از دیتابیس
+            # ساخت فایل زیپ از دیتابیس (همیشه database.json خوانا، مستقل از فرمت snapshot)
             mem_zip = iolib.BytesIO()
             with zipfile.ZipFile(mem_zip, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-                zf.write(DB_FILE)
+                zf.writestr("database.json", snapshot_format.encode(db, "json"))
             mem_zip.seek(0)
             
             await update.message.reply_document(
@@ -4806,16 +5528,13 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     return WAITING_RENAME_BUTTON
 
         if text == "🧹 حذف محتوای صفحه":
-            # ۱. گرفتن نسخه کپی از محتویات قبل از حذف (Snapshot)
-            removed_items = list(db[current_node_id].get("contents", []))
-            
-            if not removed_items:
+            if not db[current_node_id].get("contents"):
                 await update.message.reply_text("⚠️ این پوشه فاقد هرگونه محتوا است.")
                 return CHOOSING
 
             # ۲. پوش کردن در تاریخچه و حذف محتوا از دیتابیس
             push_admin_history(context, db)
-            db[current_node_id]["contents"] = []
+            removed_items, clear_ops = library_edits.clear_contents(db, current_node_id)
 
             bot_username = context.bot.username
             node_name = db[current_node_id]["name"]
@@ -4843,7 +5562,7 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
             set_pending_caption(context, log_caption)
             set_pending_backup_caption(context, backup_caption)
             
-            save_db(db, context=context)
+            save_db(db, context=context, ops=clear_ops)
             
 
             await update.message.reply_text(
@@ -4937,7 +5656,7 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
                 # ✅ پایان انتخاب و ذخیره چیدمان جدید
                 push_admin_history(context, db)
-                db[current_node_id]["children"] = result
+                reorder_ops = library_edits.reorder_children(db, current_node_id, result)
 
                 bot_username = context.bot.username
                 node_name = db[current_node_id]["name"]
@@ -4950,7 +5669,7 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 set_pending_caption(context, log_caption)
                 set_pending_backup_caption(context, backup_caption)
                 
-                save_db(db, context=context)
+                save_db(db, context=context, ops=reorder_ops)
                 
                 for key in ["reorder_remaining", "reorder_result", "reorder_mode"]:
                     context.user_data.pop(key, None)
@@ -5053,11 +5772,15 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 3. هندل کردن ناوبری (کلیک روی دکمه‌های پوشه)
     # چک کنیم آیا تکست کاربر نام یکی از دکمه‌های زیرمجموعه است؟
-    children = db[current_node_id].get("children", [])
-    for child_id in children:
-        child_node = db.get(child_id)
-    
-        if child_node and child_node["name"] == text:
+    menu = node_menu(db, current_node_id)
+    children = menu[1] if menu else []
+    for child_id, child_meta in children:
+    
+        if child_meta["name"] == text:
+            # فقط نود انتخاب‌شده کامل خوانده می‌شود
+            child_node = db.get(child_id)
+            if not child_node:
+                continue
     
             # ✅ این صفحه برای report ذخیره شود
             set_report_page(context, child_id)
@@ -5086,10 +5809,8 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 🔍 چک کردن وضعیت سرچ هوشمند کاربر قبل از جستجو
     user_id = str(update.effective_user.id)
-    userdata = load_userdata()
-    users = userdata.get("users", {})
     # پیش‌فرض برای همه True (روشن) است. اگر فیلد smart_search_disabled معادل True باشد یعنی خاموش است.
-    is_disabled = users.get(user_id, {}).get("smart_search_disabled", False)
+    is_disabled = get_user_record(user_id).get("smart_search_disabled", False)
     
     if is_disabled:
         ## اگر سرچ خاموش باشد، پاسخی ارسال نمی‌شود یا می‌توانید یک پیام ساده دهید:
@@ -5118,7 +5839,7 @@ async def rename_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         old_name = db[target_id]["name"]
         new_name = update.message.text
     
-        db[target_id]["name"] = new_name
+        rename_ops = library_edits.rename(db, target_id, new_name)
     
         bot_username = context.bot.username
         old_link = get_link(target_id, old_name, bot_username)
@@ -5131,7 +5852,7 @@ async def rename_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         set_pending_caption(context, log_caption)
         set_pending_backup_caption(context, backup_caption)
     
-        save_db(db, context=context)
+        save_db(db, context=context, ops=rename_ops)
     
     current = context.user_data.get("current_node", "root")
     await update.message.reply_text("✅ نام دکمه ویرایش شد.", reply_markup=get_keyboard(current, True, user_id=update.effective_user.id))
@@ -5164,9 +5885,7 @@ async def set_admin_password(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ رمز خیلی کوتاه است.")
         return WAITING_ADMIN_PASSWORD_EDIT
 
-    userdata = load_userdata()   # 👈 پایین توضیح دادم
-    userdata["admin_password"] = text
-    save_userdata(userdata)
+    set_userdata_setting("admin_password", text)
 
     context.user_data.pop("admin_waiting_from", None)
     
@@ -5222,7 +5941,7 @@ async def restore_userdata(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ============================
         if filename.endswith(".json"):
             userdata = json.loads(file_bytes.decode("utf-8"))
-            save_userdata(userdata)
+            await asyncio.to_thread(save_userdata, userdata)
 
             context.user_data.pop("admin_waiting_from", None)
             
@@ -5252,7 +5971,7 @@ async def restore_userdata(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                 userdata = json.loads(zipf.read("userdata.json").decode("utf-8"))
 
-            save_userdata(userdata)
+            await asyncio.to_thread(save_userdata, userdata)
 
             context.user_data.pop("admin_waiting_from", None)
 
@@ -5308,8 +6027,7 @@ async def add_sub_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ فقط آیدی عددی معتبر است. دوباره وارد کنید:")
         return WAITING_ADD_ADMIN
 
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     sub_admins = [int(x) for x in sub_admins]
 
     if new_admin in ADMIN_IDS:
@@ -5318,14 +6036,11 @@ async def add_sub_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if new_admin not in sub_admins:
         sub_admins.append(new_admin)
-        userdata["sub_admins"] = sub_admins
-
-        if "sub_admins_buttons" not in userdata:
-            userdata["sub_admins_buttons"] = {}
+        set_userdata_setting("sub_admins", sub_admins)
 
-        userdata["sub_admins_buttons"][str(new_admin)] = 0
-
-        save_userdata(userdata)
+        buttons_count = dict(get_userdata_setting("sub_admins_buttons", {}))
+        buttons_count[str(new_admin)] = 0
+        set_userdata_setting("sub_admins_buttons", buttons_count)
 
         context.user_data.pop("admin_waiting_from", None)
         
@@ -5381,8 +6096,7 @@ async def remove_sub_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ فقط آیدی عددی معتبر است. دوباره ارسال کنید:")
         return WAITING_REMOVE_ADMIN
 
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     sub_admins = [int(x) for x in sub_admins]
 
     if admin_id in ADMIN_IDS:
@@ -5391,12 +6105,13 @@ async def remove_sub_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if admin_id in sub_admins:
         sub_admins.remove(admin_id)
-        userdata["sub_admins"] = sub_admins
-
-        if "sub_admins_buttons" in userdata:
-            userdata["sub_admins_buttons"].pop(str(admin_id), None)
+        set_userdata_setting("sub_admins", sub_admins)
 
-        save_userdata(userdata)
+        buttons_count = get_userdata_setting("sub_admins_buttons")
+        if buttons_count is not None:
+            buttons_count = dict(buttons_count)
+            buttons_count.pop(str(admin_id), None)
+            set_userdata_setting("sub_admins_buttons", buttons_count)
 
         context.user_data.pop("admin_waiting_from", None)
         
@@ -5431,9 +6146,8 @@ async def remove_sub_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
-    buttons_count = userdata.get("sub_admins_buttons", {})
+    sub_admins = get_sub_admins()
+    buttons_count = get_userdata_setting("sub_admins_buttons", {})
 
     # ✅ همه ID ها رو int کن
     main_admins = [int(x) for x in ADMIN_IDS]
@@ -5550,28 +6264,8 @@ async def add_button_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if is_valid_node_id(text, db):
         source_id = text
 
-        def clone_node(old_id, new_parent):
-            new_id = str(uuid.uuid4())
-            old = db[old_id]
-            
-            # 💡 کپی کردن تمام فیلدها از جمله style
-            db[new_id] = {
-                "name": old["name"],
-                "parent": new_parent,
-                "children": [],
-                "contents": old.get("contents", []).copy(),
-                "style": old.get("style")
-            }
-            
-            for child in old.get("children", []):
-                child_new_id = clone_node(child, new_id)
-                db[new_id]["children"].append(child_new_id)
-
-            return new_id
-
         push_admin_history(context, db)
-        new_root_id = clone_node(source_id, current_node_id)
-        db[current_node_id]["children"].append(new_root_id)
+        new_root_id, clone_ops = library_edits.clone_subtree(db, source_id, current_node_id)
         
         # --- سیستم لاگ‌گیری برای حالت کپی با هش ---
         parent_name = db[current_node_id]["name"]
@@ -5588,17 +6282,12 @@ async def add_button_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         set_pending_caption(context, log_caption)
         set_pending_backup_caption(context, backup_caption)
         
-        save_db(db, context=context)
+        save_db(db, context=context, ops=clone_ops)
         
 
         # افزایش آمار دکمه‌های ادمین
-        userdata = load_userdata()
-        if "sub_admins_buttons" not in userdata:
-            userdata["sub_admins_buttons"] = {}
         user_id = update.effective_user.id
-        current_count = userdata["sub_admins_buttons"].get(str(user_id), 0)
-        userdata["sub_admins_buttons"][str(user_id)] = current_count + 1
-        save_userdata(userdata)
+        increment_admin_buttons_count(user_id)
 
         await update.message.reply_text(
             "✅ دکمه با تمام زیرمجموعه‌ها کپی شد.",
@@ -5607,16 +6296,8 @@ async def add_button_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CHOOSING
 
     # ✏️ در غیر اینصورت → دکمه جدید معمولی
-    new_id = str(uuid.uuid4())
-    db[new_id] = {
-        "name": text,
-        "parent": current_node_id,
-        "children": [],
-        "contents": []
-    }
-
     push_admin_history(context, db)
-    db[current_node_id]["children"].append(new_id)
+    new_id, add_ops = library_edits.add_child(db, current_node_id, text)
 
     # --- سیستم لاگ‌گیری برای دکمه جدید معمولی ---
     parent_name = db[current_node_id]["name"]
@@ -5632,17 +6313,11 @@ async def add_button_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     set_pending_caption(context, log_caption)
     set_pending_backup_caption(context, backup_caption)
     
-    save_db(db, context=context)
+    save_db(db, context=context, ops=add_ops)
     
     # افزایش آمار دکمه‌های ادمین
-    userdata = load_userdata()
-    if "sub_admins_buttons" not in userdata:
-        userdata["sub_admins_buttons"] = {}
-    
     user_id = update.effective_user.id
-    current_count = userdata["sub_admins_buttons"].get(str(user_id), 0)
-    userdata["sub_admins_buttons"][str(user_id)] = current_count + 1
-    save_userdata(userdata)
+    increment_admin_buttons_count(user_id)
     
     await update.message.reply_text(
         f"✅ دکمه '{text}' ساخته شد.",
@@ -5787,9 +6462,6 @@ async def receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
         db = load_db()
         push_admin_history(context, db)
 
-        if "contents" not in db[current_node_id]:
-            db[current_node_id]["contents"] = []
-
         final_contents = []
         for item in temp_content:
             saved_item = {k: v for k, v in item.items() if k != "message_id"}
@@ -5813,15 +6485,10 @@ async def receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 and "contents" in db[target_node]
                 and 0 <= idx < len(db[target_node]["contents"])
             ):
-                # گرفتن کپی از موارد قدیمی پیش از حذف برای ثبت در لاگ
-                old_items = db[target_node]["contents"][idx: idx + replace_count]
-                
-                # حذف موارد قبلی دیتابیس
-                del db[target_node]["contents"][idx: idx + replace_count]
-
-                # قراردادن موارد جدید
-                for item in reversed(final_contents):
-                    db[target_node]["contents"].insert(idx, item)
+                # حذف موارد قبلی و قراردادن موارد جدید (موارد قدیمی برای ثبت در لاگ)
+                old_items, content_ops = library_edits.replace_contents(
+                    db, target_node, idx, replace_count, final_contents
+                )
 
                 msg_text = f"🔄 {replace_count} مورد قبلی حذف و {len(final_contents)} مورد جدید جایگزین شد."
                 
@@ -5835,7 +6502,7 @@ async def receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 for i, n_item in enumerate(final_contents, start=1):
                     log_desc_parts.append(get_item_log_details(n_item, i, bot_username))
             else:
-                db[current_node_id]["contents"].extend(final_contents)
+                content_ops = library_edits.append_contents(db, current_node_id, final_contents)
                 msg_text = "⚠️ خطا در تطابق مسیر! فایل‌ها به عنوان محتوای جدید به انتهای پوشه اضافه شدند."
                 
                 log_desc_parts.append(f"📥 <b>افزودن محتوا (به دلیل خطای مسیر جایگزینی) در پوشه {node_link}:</b>")
@@ -5844,7 +6511,7 @@ async def receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             context.user_data.pop("change_target", None)
         else:
-            db[current_node_id]["contents"].extend(final_contents)
+            content_ops = library_edits.append_contents(db, current_node_id, final_contents)
             msg_text = f"{len(final_contents)} مورد ذخیره شد."
             
             # ساخت لاگ اضافه شدن محتوای جدید
@@ -5868,7 +6535,7 @@ async def receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
         set_pending_caption(context, log_caption)
         set_pending_backup_caption(context, backup_caption)
         
-        save_db(db, context=context)
+        save_db(db, context=context, ops=content_ops)
         
         context.user_data.pop("temp_content", None)
 
@@ -6058,11 +6725,9 @@ async def restore_backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # CASE 1: فایل JSON مستقیم
         # ============================
         if filename.endswith(".json"):
-            with open(DB_FILE, "wb") as f:
-                f.write(byte_array)
+            restored_db = snapshot_format.decode(bytes(byte_array), allow_marshal=False)
 
             # آپلود بکاپ در تلگرام با کپشن گزارش تغییرات ادمین
-            restored_db = load_db()
             save_db(restored_db, context=context)
 
             # پاکسازی تاریخچه و ریستارت نود به root
@@ -6091,11 +6756,9 @@ async def restore_backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await update.message.reply_text("❌ فایل ZIP فاقد database.json است.")
                     return WAITING_RESTORE_FILE
 
-                with open(DB_FILE, "wb") as f:
-                    f.write(zf.read(db_name))
+                restored_db = snapshot_format.decode(zf.read(db_name), allow_marshal=False)
 
             # آپلود بکاپ در تلگرام با کپشن گزارش تغییرات ادمین
-            restored_db = load_db()
             save_db(restored_db, context=context)
 
             # پاکسازی تاریخچه و ریستارت نود به root
@@ -6121,8 +6784,7 @@ async def restore_backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     current = context.user_data.get('current_node', 'root')
 
-    userdata = load_userdata()
-    sub_admins = userdata.get("sub_admins", [])
+    sub_admins = get_sub_admins()
     is_admin = update.effective_user.id in ADMIN_IDS or update.effective_user.id in sub_admins
     
     await update.message.reply_text(
@@ -6159,6 +6821,8 @@ def build_application():
     application.add_handler(CommandHandler("6", set_row_count), group=0)
     # در کنار هندلرهای سراسری دیگر در build_application
     application.add_handler(CommandHandler("style", set_custom_layout), group=0)
+    application.add_handler(CommandHandler("checkpoint", db_checkpoint_command), group=0)
+    application.add_handler(CommandHandler("search_stats", search_stats_command), group=0)
 
     
     application.add_handler(
@@ -6289,19 +6953,140 @@ def build_application():
 
     application.add_handler(conv_handler, group=1)
 
+    # flusher دوره‌ای userdata (write-behind)
+    application.job_queue.run_repeating(
+        flush_userdata_job,
+        interval=USERDATA_FLUSH_TICK,
+        first=USERDATA_FLUSH_TICK,
+        name="userdata_flush"
+    )
+
+    # فشرده‌سازی دوره‌ای ژورنال دیتابیس
+    application.job_queue.run_repeating(
+        compact_db_job,
+        interval=DB_COMPACT_TICK,
+        first=DB_COMPACT_TICK,
+        name="db_compact"
+    )
+
+    # ارسال دوباره‌ی بکاپ‌های spool شده بعد از قطعی مقصد
+    application.job_queue.run_repeating(
+        replay_backup_spool_job,
+        interval=BACKUP_SPOOL_TICK,
+        first=BACKUP_SPOOL_TICK,
+        name="backup_spool"
+    )
+
     return application
 
 # ================= HEALTH & WEBHOOK =================
 async def health(request):
+    # اگر بالا آمدن ربات شکست خورده، سالم گزارش نشود (پروسه در حال خاموش شدن است)
+    if request.app["startup"]["failed"] is not None:
+        return web.Response(status=503, text="STARTUP FAILED")
     return web.Response(text="OK")
 
 async def webhook_handler(request):
     app = request.app["tg"]
+    startup = request.app["startup"]
+    if startup["failed"] is not None:
+        return web.Response(status=503, text="STARTUP FAILED")
+
     data = await request.json()
     update = Update.de_json(data, app.bot)
+
+    # تا پایان ریستور اولیه آپدیت‌ها در صف محدود نگه داشته می‌شوند
+    if not startup["ready"]:
+        try:
+            startup["buffer"].put_nowait(update)
+        except asyncio.QueueFull:
+            # تلگرام همین آپدیت را بعداً دوباره می‌فرستد
+            return web.Response(status=503, text="RESTORING")
+        return web.Response(text="OK")
+
     await app.process_update(update)
     return web.Response(text="OK")
 
+
+async def restore_local_state():
+    """
+    cold start: ریستور database.json و userdata از تلگرام به صورت همزمان
+    (هر کدام داخل ترد خودش تا حلقه اصلی آزاد بماند).
+    """
+    started = datetime.now()
+
+    results = await asyncio.gather(
+        asyncio.to_thread(load_db),
+        asyncio.to_thread(init_userdata),
+        return_exceptions=True,
+    )
+
+    for name, result in zip(("database", "userdata"), results):
+        if isinstance(result, Exception):
+            print(f"❌ Startup restore of {name} failed: {result}")
+
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"✅ Startup restore finished in {elapsed:.1f}s")
+
+
+async def start_serving(tg_app, startup):
+    """
+    بالا آوردن ربات در پس‌زمینه در حالی که وب‌سرور جواب /health را می‌دهد:
+    initialize + set_webhook و ریستور فایل‌ها همزمان، بعد اجرای آپدیت‌های صف‌شده.
+    """
+    async def init_bot():
+        await tg_app.initialize()
+        await tg_app.bot.set_webhook(
+            f"{WEBHOOK_URL}/{TOKEN}",
+            allowed_updates=[
+                "message",
+                "edited_message",
+                "callback_query",
+                "message_reaction",
+                "message_reaction_count",
+            ],
+            drop_pending_updates=True,
+        )
+
+    try:
+        await asyncio.gather(init_bot(), restore_local_state())
+
+        # فقط job_queue لازم است (flush دوره‌ای userdata)
+        await tg_app.job_queue.start()
+
+    except asyncio.CancelledError:
+        raise
+
+    except Exception as e:
+        # مثل قبل بلند شکست بخورد: آپدیت‌های صف‌شده دور ریخته می‌شوند (Application آماده
+        # نیست)، /health خطا می‌دهد و پروسه خاموش می‌شود تا دوباره اجرا شود
+        print(f"❌ Startup failed: {e}")
+        startup["failed"] = e
+
+        dropped = 0
+        while not startup["buffer"].empty():
+            startup["buffer"].get_nowait()
+            dropped += 1
+        if dropped:
+            print(f"🗑️ Dropped {dropped} updates buffered during failed startup")
+
+        startup["stop"].set()
+        return
+
+    buffer = startup["buffer"]
+    if not buffer.empty():
+        print(f"📨 Processing {buffer.qsize()} updates received during startup")
+
+    # آپدیت‌هایی که حین پردازش صف می‌رسند هم پشت همین صف می‌مانند (حفظ ترتیب)
+    while not buffer.empty():
+        update = buffer.get_nowait()
+        try:
+            await tg_app.process_update(update)
+        except Exception as e:
+            print(f"❌ Failed to process buffered update: {e}")
+
+    startup["ready"] = True
+
 # ===👆🏻=== COMMEN CODE FOR BABIES/FATHER ===☝🏻=== COMMEN CODE FOR BABIES/FATHER =======  ===👆🏻=== COMMEN CODE FOR BABIES/FATHER ===☝🏻=== COMMEN CODE FOR BABIES/FATHER =======
 # ===👆🏻=== COMMEN CODE FOR BABIES/FATHER ===☝🏻=== COMMEN CODE FOR BABIES/FATHER =======  ===👆🏻=== COMMEN CODE FOR BABIES/FATHER ===☝🏻=== COMMEN CODE FOR BABIES/FATHER =======
 # ===👆🏻=== COMMEN CODE FOR BABIES/FATHER ===☝🏻=== COMMEN CODE FOR BABIES/FATHER =======  ===👆🏻=== COMMEN CODE FOR BABIES/FATHER ===☝🏻=== COMMEN CODE FOR BABIES/FATHER =======
@@ -6316,22 +7101,22 @@ async def webhook_handler(request):
 # ================= MAIN ================
 async def main():
     tg_app = build_application()
-    await tg_app.initialize()
     #await tg_app.start()
-    await tg_app.bot.set_webhook(
-        f"{WEBHOOK_URL}/{TOKEN}",
-        allowed_updates=[
-            "message",
-            "edited_message",
-            "callback_query",
-            "message_reaction",
-            "message_reaction_count",
-        ],
-        drop_pending_updates=True,
-    )
-    # aiohttp web app برای Health check و Webhook
+
+    # برنامه تا دریافت SIGTERM/SIGINT (یا شکست بالا آمدن ربات) اجرا باقی بماند
+    stop_event = asyncio.Event()
+
+    # aiohttp web app برای Health check و Webhook ؛ قبل از ریستور بالا می‌آید
+    startup = {
+        "ready": False,
+        "failed": None,
+        "stop": stop_event,
+        "buffer": asyncio.Queue(maxsize=STARTUP_UPDATE_BUFFER),
+    }
+
     webapp = web.Application()
     webapp["tg"] = tg_app
+    webapp["startup"] = startup
     webapp.router.add_get("/", health)
     webapp.router.add_get("/health", health)
     webapp.router.add_post(f"/{TOKEN}", webhook_handler)
@@ -6343,8 +7128,63 @@ async def main():
     # ❌ دیگر tg_app.start() نیاز نیست
     # await tg_app.start()
 
-    # برنامه همیشه اجرا باقی بماند
-    await asyncio.Event().wait()
+    # Telethon روی همین حلقه (اختیاری)؛ اتصال در پس‌زمینه
+    if TELETHON_MAIN_LOOP:
+        start_telethon_on_main_loop()
+
+    # worker صف بکاپ دیتابیس (آپلود خارج از مسیر هندلرها)
+    db_backup_queue.start(on_result=functools.partial(report_backup_result, tg_app.bot))
+
+    # initialize ربات + ریستور DB/userdata در پس‌زمینه
+    startup_task = asyncio.create_task(start_serving(tg_app, startup))
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        await stop_event.wait()
+    finally:
+        if not startup_task.done():
+            startup_task.cancel()
+            try:
+                await startup_task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+        await tg_app.job_queue.stop()
+
+        # flush نهایی userdata قبل از خاموش شدن
+        snapshot = userdata_store.take_snapshot(force_upload=True)
+        if snapshot is not None:
+            await asyncio.to_thread(userdata_store.write_snapshot, snapshot)
+
+        await runner.cleanup()
+
+        # بکاپ‌های در صف قبل از خاموش شدن آپلود شوند
+        await db_backup_queue.stop()
+
+        search_pool.shutdown(wait=False)
+
+        # لاگ‌هایی که هنوز در حال ارسال‌اند
+        try:
+            await run_telethon_async(log_shipper.drain())
+        except Exception as e:
+            print(f"❌ Failed to drain admin logs: {e}")
+
+        if TELETHON_MAIN_LOOP:
+            await stop_telethon_on_main_loop()
+
+        # ادغام ژورنال دیتابیس در snapshot
+        library_store.compact()
+
+        await tg_app.shutdown()
+
+    if startup["failed"] is not None:
+        raise SystemExit(1)
 
 if __name__=="__main__":
     asyncio.run(main())
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+from smart_search import normalize_text
+
+
+# =========================================================
+# کش نتایج سرچ هوشمند (LRU + TTL)
+# =========================================================
+# کلید: (کوئری نرمال‌شده، ریشه‌ی جستجو، نسخه‌ی کتابخانه، ...)
+# مقدار: هر چیزی که هندلر لازم دارد (لیست نتایج رتبه‌بندی‌شده و HTML آماده).
+# با تغییر نسخه‌ی کتابخانه کلیدهای قبلی دیگر پیدا نمی‌شوند؛ save_db هم کل کش را
+# خالی می‌کند تا حافظه آزاد شود.
+
+
+def search_key(query, scope, generation, *extra):
+    """
+    کلید کش یک جستجو؛ کوئری‌هایی که بعد از نرمال‌سازی یکی‌اند یک کلید دارند.
+    """
+    return (normalize_text(query), scope, generation) + extra
+
+
+class SearchResultCache:
+    """
+    max_entries: حداکثر تعداد کلید (قدیمی‌ترین استفاده‌شده اول حذف می‌شود)
+    ttl: عمر هر مقدار به ثانیه (0 = بدون انقضا)
+    """
+
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is not None:
+                stored_at, value = item
+                if not self.ttl or time.monotonic() - stored_at < self.ttl:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._items[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def put_results(self, key, results, value):
+        """
+        نتیجه‌ی ناقص (results.partial، بودجه‌ی جستجو تمام شده) کش نمی‌شود
+        تا تکرار همان جستجو (با بار کمتر) نتیجه‌ی کامل بگیرد. -> آیا ذخیره شد
+        """
+        if getattr(results, "partial", False):
+            return False
+
+        self.put(key, value)
+        return True
+
+    def clear(self):
+        with self._lock:
+            if self._items:
+                self.invalidations += 1
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
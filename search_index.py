@@ -0,0 +1,573 @@
+import heapq
+import threading
+import time
+
+from smart_search import (
+    SearchResults,
+    budget_chunks,
+    expand_query_terms,
+    get_contents_data,
+    normalize_many,
+    normalize_text,
+    score_items,
+    score_items_batch,
+    score_items_within_budget,
+)
+
+
+# =========================================================
+# ایندکس پایدار سرچ هوشمند
+# =========================================================
+# به جای flatten کل دیتابیس در هر جستجو، فیلدهای نرمال‌شده‌ی هر نود یک‌بار
+# ساخته می‌شوند و با همان رکوردهای library_ops که save_db می‌گیرد به‌روز می‌مانند.
+#
+# search_context هر نود: نام اجداد (بدون root) و خود نود، با فاصله.
+# items(scope) برای هر نود زیر scope (خود scope نه) یک آیتم با همان کلیدهای
+# flatten_db_for_search می‌دهد، با این معنا:
+# - title: search_context نود ؛ node_name_norm: نسخه‌ی نرمال‌شده‌ی آن
+# - path / path_norm: زنجیره‌ی search_context نودهای زیر scope تا خود نود (با « ⬅️ » / فاصله)
+# - file_names_norm / captions_norm / short_texts_norm: محتوای خود نود، نرمال‌شده و بدون موارد خالی
+# - ترتیب آیتم‌ها پیمایش pre-order از scope به ترتیب children (برای ترتیب یکسان نتایج هم‌امتیاز)
+#
+# محدوده‌ی جستجو (حالت current_node): هر نود یک بازه‌ی [ورود، خروج) در ترتیب pre-order
+# کل درخت دارد و زیرشاخه‌هایش دقیقاً همان بازه‌اند؛ پس scope فقط یک فیلتر بازه روی
+# همین ایندکس سراسری است (بدون کپی نودها و ساختن دوباره‌ی مسیرها).
+# بعد از تغییر ساختار (افزودن/حذف/جابه‌جایی/ترتیب فرزندها) بازه‌ها در اولین جستجو
+# دوباره شماره‌گذاری می‌شوند؛ تغییر نام و محتوا روی بازه‌ها اثری ندارد.
+#
+# نودهای یتیم (parent خالی یا ناموجود، مثل flatten_db_for_search) هم ایندکس می‌شوند:
+# مسیرشان از خودشان شروع می‌شود و بعد از زیرشاخه‌ی root شماره می‌گیرند؛
+# بازه‌ی root همه را می‌پوشاند تا جستجوی کل کتابخانه آن‌ها را هم ببیند.
+#
+# پیش‌فیلتر کاندیدها (قبل از امتیازدهی rapidfuzz):
+# - ایندکس معکوس توکن -> {نود: وزن فیلد} روی نام کامل مسیر و محتوای هر نود
+# - ایندکس سه‌حرفی (trigram) -> توکن‌ها روی واژگان، برای غلط تایپی و تطابق جزئی
+# - هر واژه‌ی کوئری (و مترادف‌هایش از expand_query_terms) توکن‌های مشابه را پیدا می‌کند؛
+#   نودها بر اساس مجموع (شباهت × وزن فیلد) رتبه می‌گیرند و فقط max_candidates نود اول
+#   (هم‌رتبه‌ها به ترتیب pre-order، مثل مرتب‌سازی نهایی) امتیازدهی می‌شوند
+#
+# بودجه‌ی جستجو (time_budget / max_items): کاندیدها به ترتیب همین رتبه‌ی پیش‌فیلتر
+# دسته‌دسته امتیاز می‌گیرند (score_items_within_budget)؛ در امتیازدهی کامل، نودهای بدون
+# امتیاز پیش‌فیلتر بعد از همه‌ی کاندیدها می‌آیند.
+
+# حداقل سهم سه‌حرفی‌های واژه‌ی کوئری که باید در توکن باشد
+MIN_TERM_SIMILARITY = 0.4
+
+# وزن واژه‌هایی که فقط از مترادف‌ها آمده‌اند
+SYNONYM_WEIGHT = 0.6
+
+DEFAULT_MAX_CANDIDATES = 1000
+
+# وزن توکن بر اساس جایی که در نود آمده (هم‌راستا با وزن‌های score_items)
+FIELD_WEIGHTS = (
+    ("file_names_norm", 1.0),
+    ("captions_norm", 0.6),
+    ("short_texts_norm", 0.4),
+)
+NAME_WEIGHT = 1.0
+
+# والد مجازی نودهای یتیم
+_ORPHAN_PARENT = {"context": "", "chain": (), "chain_norm": ()}
+
+
+def _content_fields(node):
+    contents = get_contents_data(node)
+    fields = {}
+
+    for key in ("file_names", "captions", "short_texts"):
+        fields[f"{key}_norm"] = [value for value in normalize_many(contents[key]) if value]
+
+    return fields
+
+
+def trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _entry_terms(entry):
+    """
+    توکن -> وزن بهترین فیلدی که توکن در آن آمده
+    """
+    terms = {}
+
+    if entry["chain_norm"]:
+        for token in entry["chain_norm"][-1].split():
+            terms[token] = NAME_WEIGHT
+
+    for key, weight in FIELD_WEIGHTS:
+        for value in entry[key]:
+            for token in value.split():
+                if terms.get(token, 0) < weight:
+                    terms[token] = weight
+
+    return terms
+
+
+def query_terms(query):
+    """
+    واژه‌های کوئری -> وزن (واژه‌های خود کوئری ۱، واژه‌های مترادف SYNONYM_WEIGHT)
+    """
+    terms = {}
+
+    for term in expand_query_terms(query):
+        for word in term.split():
+            terms.setdefault(word, SYNONYM_WEIGHT)
+
+    for word in normalize_text(query).split():
+        terms[word] = 1.0
+
+    return terms
+
+
+class SearchIndex:
+    def __init__(self, max_candidates=DEFAULT_MAX_CANDIDATES):
+        self.generation = None
+        self.entries = {}
+        self.children = {}
+        self.orphans = {}
+        self.max_candidates = max_candidates
+
+        # توکن -> نودها ؛ سه‌حرفی -> توکن‌ها
+        self.postings = {}
+        self.grams = {}
+
+        # ترتیب pre-order کل درخت و بازه‌ی [ورود، خروج) هر نود در آن
+        self.order = []
+        self.intervals = {}
+        self._intervals_dirty = True
+
+        # جستجو روی ترد pool و به‌روزرسانی روی حلقه‌ی اصلی: فقط یکی در هر لحظه
+        self._lock = threading.RLock()
+
+    def is_built(self):
+        return self.generation is not None
+
+    # ---------- ساخت ----------
+    def build(self, db, generation=None):
+        with self._lock:
+            self.entries = {}
+            self.children = {}
+            self.orphans = {}
+            self.postings = {}
+            self.grams = {}
+            self._intervals_dirty = True
+
+            if "root" in db:
+                self._index_subtree(db, "root")
+
+            for node_id in db:
+                if node_id not in self.entries and self._is_orphan(db, node_id):
+                    self._index_subtree(db, node_id)
+
+            self.generation = generation
+            return self
+
+    def _make_entry(self, db, node_id, parent_entry):
+        node = db[node_id]
+        name = node.get("name", "")
+
+        if node_id == "root":
+            context, chain, chain_norm = "", (), ()
+        else:
+            # search_context: نام اجداد (بدون root) و خود نود با فاصله
+            context = f"{parent_entry['context']} {name}" if parent_entry["chain"] else name
+            context_norm = normalize_text(context)
+            chain = parent_entry["chain"] + (context,)
+            chain_norm = parent_entry["chain_norm"] + (context_norm,)
+
+        return {
+            "node_id": node_id,
+            "parent": node.get("parent"),
+            "context": context,
+            "chain": chain,
+            "chain_norm": chain_norm,
+        }
+
+    @staticmethod
+    def _is_orphan(db, node_id):
+        parent = db[node_id].get("parent")
+        return node_id != "root" and (not parent or parent not in db)
+
+    def _index_subtree(self, db, node_id, content=True):
+        """
+        content=False: فقط نام/مسیرها دوباره ساخته می‌شوند (بعد از rename).
+        """
+        node = db.get(node_id)
+        if node is None:
+            return
+
+        parent_entry = None
+        if node_id != "root":
+            parent_entry = self.entries.get(node.get("parent"))
+
+            if parent_entry is None:
+                if not self._is_orphan(db, node_id):
+                    return
+                parent_entry = _ORPHAN_PARENT
+                if node_id not in self.orphans:
+                    self.orphans[node_id] = True
+                    self._intervals_dirty = True
+
+        stack = [(node_id, parent_entry)]
+
+        while stack:
+            current, parent_entry = stack.pop()
+            current_node = db.get(current)
+            if current_node is None:
+                continue
+
+            entry = self._make_entry(db, current, parent_entry)
+            old = self.entries.get(current)
+
+            if old is None:
+                self._intervals_dirty = True
+
+            if content or old is None:
+                entry.update(_content_fields(current_node))
+            else:
+                for key in ("file_names_norm", "captions_norm", "short_texts_norm"):
+                    entry[key] = old[key]
+
+            self._set_entry(current, entry)
+
+            children = [child for child in current_node.get("children", []) if child in db]
+            self.children[current] = children
+
+            for child in reversed(children):
+                stack.append((child, entry))
+
+    # ---------- ایندکس معکوس ----------
+    def _add_terms(self, node_id, terms):
+        for term, weight in terms.items():
+            nodes = self.postings.get(term)
+            if nodes is None:
+                nodes = self.postings[term] = {}
+                for gram in trigrams(term):
+                    self.grams.setdefault(gram, set()).add(term)
+            nodes[node_id] = weight
+
+    def _remove_terms(self, node_id, terms):
+        for term in terms:
+            nodes = self.postings.get(term)
+            if nodes is None:
+                continue
+
+            nodes.pop(node_id, None)
+            if nodes:
+                continue
+
+            del self.postings[term]
+            for gram in trigrams(term):
+                tokens = self.grams.get(gram)
+                if tokens is not None:
+                    tokens.discard(term)
+                    if not tokens:
+                        del self.grams[gram]
+
+    def _set_entry(self, node_id, entry):
+        old = self.entries.get(node_id)
+        old_terms = old["terms"] if old is not None else {}
+        terms = entry["terms"] = _entry_terms(entry)
+
+        self._remove_terms(node_id, [term for term in old_terms if term not in terms])
+        self._add_terms(node_id, {
+            term: weight for term, weight in terms.items() if old_terms.get(term) != weight
+        })
+
+        self.entries[node_id] = entry
+
+    def _update_contents(self, node_id, node):
+        entry = dict(self.entries[node_id])
+        entry.update(_content_fields(node))
+        self._set_entry(node_id, entry)
+
+    def _drop_subtree(self, node_id):
+        self._intervals_dirty = True
+        stack = [node_id]
+
+        while stack:
+            current = stack.pop()
+            entry = self.entries.pop(current, None)
+            self.orphans.pop(current, None)
+            if entry is None:
+                continue
+            self._remove_terms(current, entry["terms"])
+            stack.extend(self.children.pop(current, []))
+
+    def _refresh_children(self, db, node_id):
+        node = db.get(node_id)
+        if node is None or node_id not in self.entries:
+            return
+
+        children = [child for child in node.get("children", []) if child in db]
+        removed = set(self.children.get(node_id, [])) - set(children)
+        self.children[node_id] = children
+        self._intervals_dirty = True
+
+        for child in removed:
+            # جابه‌جا شده زیر والد دیگر: همان‌جا ایندکس شده است
+            moved = child in db and db[child].get("parent") != node_id
+            if not moved:
+                self._drop_subtree(child)
+
+        for child in children:
+            if child not in self.entries:
+                self._index_subtree(db, child)
+
+    # ---------- به‌روزرسانی تدریجی ----------
+    def apply_ops(self, db, ops, generation=None):
+        """
+        db: دیکشنری بعد از اعمال همه‌ی ops (همان چیزی که save_db ذخیره کرد).
+        """
+        with self._lock:
+            for op in ops:
+                self._apply_op(db, op)
+
+            self.generation = generation
+
+    def _apply_op(self, db, op):
+        kind = op["op"]
+        node_id = op["node_id"]
+
+        if kind == "add_node":
+            parent = op["node"].get("parent")
+            if parent in self.entries:
+                self._refresh_children(db, parent)
+            if node_id not in self.entries:
+                self._index_subtree(db, node_id)
+
+        elif kind == "delete_subtree":
+            self._drop_subtree(node_id)
+            if op.get("parent") in self.entries:
+                self._refresh_children(db, op["parent"])
+
+        elif kind == "rename":
+            if node_id in self.entries:
+                self._index_subtree(db, node_id, content=False)
+
+        elif kind == "set_children":
+            self._refresh_children(db, node_id)
+
+        elif kind in ("append_contents", "remove_contents", "insert_contents"):
+            if node_id in self.entries and node_id in db:
+                self._update_contents(node_id, db[node_id])
+
+        elif kind == "set_fields":
+            keys = set(op["fields"]) | set(op["unset"])
+            if node_id not in self.entries:
+                return
+
+            if "parent" in keys:
+                self._drop_subtree(node_id)
+                self._index_subtree(db, node_id)
+            elif "name" in keys:
+                self._index_subtree(db, node_id, content=False)
+
+            if "children" in keys:
+                self._refresh_children(db, node_id)
+            if "contents" in keys and node_id in self.entries:
+                self._update_contents(node_id, db[node_id])
+
+    # ---------- جستجو ----------
+    def match_terms(self, term):
+        """
+        توکن‌های واژگان شبیه به term -> {توکن: شباهت}
+        شباهت = سهم سه‌حرفی‌های term که در توکن هست (تطابق کامل = ۱)
+        """
+        term_grams = trigrams(term)
+        counts = {}
+
+        for gram in term_grams:
+            for token in self.grams.get(gram, ()):
+                counts[token] = counts.get(token, 0) + 1
+
+        # واژه‌های خیلی کوتاه (تا ۳ سه‌حرفی) با هر سه‌حرفی مشترک کاندید می‌شوند
+        threshold = MIN_TERM_SIMILARITY if len(term_grams) > 3 else 0
+
+        matches = {}
+        for token, shared in counts.items():
+            similarity = 1.0 if token == term else shared / len(term_grams)
+            if similarity >= threshold:
+                matches[token] = similarity
+
+        return matches
+
+    def ranked_candidates(self, query, scope="root", max_candidates=None):
+        """
+        نودهای محتمل برای query زیر scope به ترتیب امتیاز پیش‌فیلتر (بیشترین اول؛
+        هم‌امتیازها به ترتیب pre-order، مثل ترتیب نهایی نتایج).
+        max_candidates: حداکثر تعداد (None = پیش‌فرض ایندکس، 0 = بدون سقف)
+        """
+        if max_candidates is None:
+            max_candidates = self.max_candidates
+
+        scores = {}
+
+        for term, weight in query_terms(query).items():
+            best = {}
+
+            for token, similarity in self.match_terms(term).items():
+                for node_id, field_weight in self.postings[token].items():
+                    value = similarity * field_weight
+                    if value > best.get(node_id, 0):
+                        best[node_id] = value
+
+            for node_id, value in best.items():
+                scores[node_id] = scores.get(node_id, 0) + value * weight
+
+        interval = self.scope_interval(scope)
+        if interval is None:
+            return []
+
+        # محدود به scope
+        start, end = interval
+        ranked = []
+
+        for node_id, score in scores.items():
+            node_interval = self.intervals.get(node_id)
+            if node_interval is not None and start < node_interval[0] < end:
+                ranked.append((score, -node_interval[0], node_id))
+
+        if max_candidates and len(ranked) > max_candidates:
+            ranked = heapq.nlargest(max_candidates, ranked)
+        else:
+            ranked.sort(reverse=True)
+
+        return [node_id for _, _, node_id in ranked]
+
+    def candidates(self, query, scope="root", max_candidates=None):
+        """
+        مجموعه‌ی محدود نودهای محتمل برای query (حداکثر max_candidates نود زیر scope).
+        """
+        return set(self.ranked_candidates(query, scope, max_candidates))
+
+    # ---------- بازه‌های pre-order ----------
+    def _number_intervals(self):
+        self.order = []
+        self.intervals = {}
+
+        starts = (["root"] if "root" in self.entries else []) + list(self.orphans)
+
+        for start in starts:
+            stack = [(start, False)]
+
+            while stack:
+                node_id, leaving = stack.pop()
+
+                if leaving:
+                    self.intervals[node_id] = (self.intervals[node_id][0], len(self.order))
+                    continue
+
+                if node_id not in self.entries or node_id in self.intervals:
+                    continue
+
+                self.intervals[node_id] = (len(self.order), None)
+                self.order.append(node_id)
+
+                stack.append((node_id, True))
+                for child in reversed(self.children.get(node_id, [])):
+                    stack.append((child, False))
+
+        # جستجوی کل کتابخانه یتیم‌ها را هم می‌پوشاند
+        if "root" in self.intervals:
+            self.intervals["root"] = (0, len(self.order))
+
+        self._intervals_dirty = False
+
+    def scope_interval(self, scope):
+        """
+        -> (ورود، خروج) نود scope در ترتیب pre-order؛ زیرشاخه‌ها = order[ورود+1:خروج]
+        """
+        if self._intervals_dirty:
+            self._number_intervals()
+        return self.intervals.get(scope)
+
+    def items(self, scope="root", only=None):
+        """
+        نودهای زیر scope (خود scope نه) به ترتیب pre-order.
+        only: فقط همین نودها (کاندیدهای پیش‌فیلتر)، با همان ترتیب pre-order
+        """
+        interval = self.scope_interval(scope)
+        if interval is None:
+            return
+
+        start, end = interval
+        depth = len(self.entries[scope]["chain"])
+
+        if only is None:
+            positions = range(start + 1, end)
+        else:
+            positions = sorted(
+                position
+                for position in (self.intervals[node_id][0] for node_id in only if node_id in self.intervals)
+                if start < position < end
+            )
+
+        for position in positions:
+            node_id = self.order[position]
+            entry = self.entries[node_id]
+            chain = entry["chain"][depth:]
+
+            yield {
+                "node_id": node_id,
+                "title": entry["context"],
+                "path": " ⬅️ ".join(chain),
+                "node_name_norm": entry["chain_norm"][-1],
+                "path_norm": " ".join(part for part in entry["chain_norm"][depth:] if part),
+                "file_names_norm": entry["file_names_norm"],
+                "captions_norm": entry["captions_norm"],
+                "short_texts_norm": entry["short_texts_norm"],
+            }
+
+    def search(self, query, scope="root", limit=5, min_score=45, prefilter=True,
+               batch=False, workers=-1, score_cutoff=None, time_budget=None, max_items=None):
+        """
+        prefilter=False: امتیازدهی کامل همه‌ی نودها (مرجع سنجش recall پیش‌فیلتر)
+        batch=True: امتیازدهی دسته‌ای با cdist/NumPy (score_items_batch)
+        time_budget/max_items: سقف زمان (ثانیه) یا تعداد نود امتیازدهی‌شده
+        -> SearchResults (partial=True یعنی بودجه قبل از همه‌ی کاندیدها تمام شد)
+        """
+        if time_budget is not None or max_items is not None:
+            return self._search_within_budget(
+                query, scope, limit, min_score, prefilter, time_budget, max_items,
+                batch=batch, workers=workers, score_cutoff=score_cutoff,
+            )
+
+        # فقط جمع کردن آیتم‌ها زیر قفل؛ امتیازدهی (بخش سنگین) بیرون از آن
+        with self._lock:
+            only = self.candidates(query, scope) if prefilter else None
+            items = list(self.items(scope, only))
+
+        if batch:
+            return SearchResults(score_items_batch(
+                items, query, limit=limit, min_score=min_score,
+                workers=workers, score_cutoff=score_cutoff,
+            ))
+
+        return SearchResults(score_items(items, query, limit=limit, min_score=min_score))
+
+    def _search_within_budget(self, query, scope, limit, min_score, prefilter,
+                              time_budget, max_items, **scorer_kwargs):
+        started = time.monotonic()
+
+        with self._lock:
+            priority = self.ranked_candidates(query, scope, None if prefilter else 0)
+
+            interval = self.scope_interval(scope)
+            if not prefilter and interval is not None:
+                # نودهای بدون امتیاز پیش‌فیلتر آخر از همه، به ترتیب pre-order
+                ranked = set(priority)
+                priority += [node_id for node_id in self.order[interval[0] + 1:interval[1]] if node_id not in ranked]
+
+            positions = {node_id: self.intervals[node_id][0] for node_id in priority}
+            chunks = [list(self.items(scope, priority[start:end])) for start, end in budget_chunks(len(priority))]
+
+        # زمان جمع کردن آیتم‌ها هم از بودجه کم می‌شود
+        if time_budget is not None:
+            time_budget = max(0.0, time_budget - (time.monotonic() - started))
+
+        return score_items_within_budget(
+            chunks, positions, query, limit=limit, min_score=min_score,
+            time_budget=time_budget, max_items=max_items, **scorer_kwargs,
+        )
@@ -0,0 +1,99 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+# =========================================================
+# اجرای سرچ هوشمند خارج از حلقه‌ی اصلی
+# =========================================================
+# امتیازدهی روی تردهای جدا اجرا می‌شود تا ناوبری بقیه‌ی کاربران منتظر نماند.
+# ایندکس بین تردها مشترک و فقط‌خواندنی است (SearchIndex خودش قفل دارد).
+# - max_in_flight: حداکثر جستجوی هم‌زمان؛ بقیه در صف می‌مانند
+# - per_user_limit: حداکثر جستجوی در صف/در حال اجرای هر کاربر؛ بیشتر از آن رد می‌شود
+# - workers=0: اجرای مستقیم روی همان حلقه (رفتار قبلی)
+
+
+class SearchBusyError(Exception):
+    """
+    کاربر به سقف جستجوهای هم‌زمان خودش رسیده است.
+    """
+
+
+class SearchPool:
+    def __init__(self, workers=2, max_in_flight=4, per_user_limit=1):
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.per_user_limit = per_user_limit
+
+        self._executor = None
+        self._semaphore = None
+        self._pending = {}
+
+        self.completed = 0
+        self.rejected = 0
+        self.waiting = 0
+
+    def _get_executor(self):
+        if self._executor is None and self.workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="search")
+        return self._executor
+
+    def _get_semaphore(self):
+        # روی همان حلقه‌ای ساخته می‌شود که از آن استفاده می‌کند
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.max_in_flight))
+        return self._semaphore
+
+    def pending(self, user_id=None):
+        if user_id is None:
+            return sum(self._pending.values())
+        return self._pending.get(user_id, 0)
+
+    async def run(self, user_id, func, *args, **kwargs):
+        """
+        func(*args, **kwargs) روی pool؛ اگر کاربر به سقف رسیده SearchBusyError.
+        """
+        if self.per_user_limit and self._pending.get(user_id, 0) >= self.per_user_limit:
+            self.rejected += 1
+            raise SearchBusyError(user_id)
+
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        semaphore = self._get_semaphore()
+
+        try:
+            self.waiting += 1
+            try:
+                await semaphore.acquire()
+            finally:
+                self.waiting -= 1
+
+            try:
+                executor = self._get_executor()
+                if executor is None:
+                    return func(*args, **kwargs)
+
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(executor, lambda: func(*args, **kwargs))
+
+            finally:
+                semaphore.release()
+                self.completed += 1
+
+        finally:
+            self._pending[user_id] -= 1
+            if not self._pending[user_id]:
+                del self._pending[user_id]
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "in_flight_limit": self.max_in_flight,
+            "pending": self.pending(),
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
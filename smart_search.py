@@ -1,5 +1,11 @@
-from rapidfuzz import fuzz
+import heapq
 import re
+import time
+from functools import lru_cache
+
+import ahocorasick
+import numpy as np
+from rapidfuzz import fuzz, process
 
 # =========================================================
 # ۱) مترادف‌های تخصصی پزشکی و آموزشی
@@ -63,46 +69,76 @@ MEDICAL_SYNONYMS = {
 # =========================================================
 # ۲) نرمال‌سازی متن (پاکسازی کاراکترهای عربی و علائم)
 # =========================================================
-def normalize_text(text: str) -> str:
-    if not text:
-        return ""
-
-    text = str(text)
-    replacements = {
-        "ي": "ی",
-        "ك": "ک",
-        "ۀ": "ه",
-        "ة": "ه",
-        "ؤ": "و",
-        "إ": "ا",
-        "أ": "ا",
-        "آ": "ا",
-        "\u200c": " ",
-        "_": " ",
-        "-": " ",
-    }
-
-    for old, new in replacements.items():
+# جایگزینی‌ها یک‌بار به صورت tuple ساخته می‌شوند (str.replace روی کاراکتری که در متن
+# نیست تقریباً هزینه ندارد و از translate با نگاشت غیر ASCII سریع‌تر است)، الگوها از پیش
+# کامپایل می‌شوند و رشته‌های کوتاه تکراری (نام پوشه‌ها، نام فایل‌ها، کوئری‌ها) در یک
+# کش محدود می‌مانند.
+NORMALIZE_REPLACEMENTS = (
+    ("ي", "ی"),
+    ("ك", "ک"),
+    ("ۀ", "ه"),
+    ("ة", "ه"),
+    ("ؤ", "و"),
+    ("إ", "ا"),
+    ("أ", "ا"),
+    ("آ", "ا"),
+    ("\u200c", " "),
+    ("_", " "),
+    ("-", " "),
+)
+
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+FILE_EXTENSION_RE = re.compile(
+    r"\.(pdf|doc|docx|ppt|pptx|xls|xlsx|zip|rar|mp3|mp4|mkv|avi|jpg|jpeg|png)$",
+    flags=re.IGNORECASE
+)
+PUNCTUATION_RE = re.compile(r"[^\w\sآ-ی]")
+
+# رشته‌های بلندتر (کپشن‌ها و متن‌ها) کش نمی‌شوند تا جای نام‌ها را نگیرند
+NORMALIZE_CACHE_SIZE = 50000
+NORMALIZE_CACHE_MAX_LENGTH = 200
+
+
+def _normalize(text):
+    for old, new in NORMALIZE_REPLACEMENTS:
         text = text.replace(old, new)
 
     text = text.lower()
-    
+
     # حذف تگ‌های HTML در صورت وجود
-    text = re.sub(r"<[^>]+>", " ", text)
-    
+    if "<" in text:
+        text = HTML_TAG_RE.sub(" ", text)
+
     # حذف پسوند فایل‌ها
-    text = re.sub(
-        r"\.(pdf|doc|docx|ppt|pptx|xls|xlsx|zip|rar|mp3|mp4|mkv|avi|jpg|jpeg|png)$",
-        " ",
-        text,
-        flags=re.IGNORECASE
-    )
+    if "." in text:
+        text = FILE_EXTENSION_RE.sub(" ", text)
 
     # حذف علائم نگارشی و کاراکترهای اضافه
-    text = re.sub(r"[^\w\sآ-ی]", " ", text)
-    text = re.sub(r"\s+", " ", text).strip()
+    text = PUNCTUATION_RE.sub(" ", text)
+
+    # split() همان فاصله‌هایی را می‌شناسد که \s در re
+    return " ".join(text.split())
+
+
+_normalize_cached = lru_cache(maxsize=NORMALIZE_CACHE_SIZE)(_normalize)
+
+
+def normalize_text(text: str) -> str:
+    if not text:
+        return ""
+
+    text = str(text)
+    if len(text) <= NORMALIZE_CACHE_MAX_LENGTH:
+        return _normalize_cached(text)
+    return _normalize(text)
+
+
+def normalize_many(texts):
+    """
+    نرمال‌سازی دسته‌ای (مثلاً نام همه‌ی فایل‌های یک نود) -> لیست هم‌اندازه
+    """
+    return [normalize_text(text) for text in texts]
 
-    return text
 
 # =========================================================
 # ۳) ساخت دیکشنری مترادف‌های دوطرفه و بسط کوئری
@@ -118,22 +154,57 @@ def build_bidirectional_synonyms(syn_dict):
 
 BIDIRECTIONAL_SYNONYMS = build_bidirectional_synonyms(MEDICAL_SYNONYMS)
 
+
+# اتوماتای Aho-Corasick: همه‌ی الگوها (حتی هم‌پوشان) در یک پیمایش متن پیدا می‌شوند.
+# مقدار هر الگو اندیس آن در لیست terms است.
+def build_term_automaton(terms):
+    """
+    terms: لیست عبارت‌های غیرخالی -> اتوماتا (یا None اگر لیست خالی باشد)
+    """
+    if not terms:
+        return None
+
+    automaton = ahocorasick.Automaton()
+    for i, term in enumerate(terms):
+        automaton.add_word(term, i)
+    automaton.make_automaton()
+    return automaton
+
+
+SYNONYM_PHRASES = sorted(BIDIRECTIONAL_SYNONYMS)
+SYNONYM_PHRASE_AUTOMATON = build_term_automaton(SYNONYM_PHRASES)
+
+
+def find_synonym_phrases(query_norm):
+    """
+    همه‌ی عبارت‌های دیکشنری مترادف (تک‌واژه یا چندواژه) که به صورت واژه‌ی کامل
+    در کوئری نرمال‌شده آمده‌اند
+    """
+    phrases = set()
+    last = len(query_norm) - 1
+
+    for end, i in SYNONYM_PHRASE_AUTOMATON.iter(query_norm):
+        phrase = SYNONYM_PHRASES[i]
+        start = end - len(phrase) + 1
+
+        # فقط روی مرز واژه‌ها (مثلاً ent داخل patient حساب نشود)
+        if (start == 0 or query_norm[start - 1] == " ") and (end == last or query_norm[end + 1] == " "):
+            phrases.add(phrase)
+
+    return phrases
+
+
 def expand_query_terms(query: str):
     query_norm = normalize_text(query)
-    words = query_norm.split()
-    expanded = set(words)
-
-    # بررسی انطباق کل عبارت
-    if query_norm in BIDIRECTIONAL_SYNONYMS:
-        expanded.update(BIDIRECTIONAL_SYNONYMS[query_norm])
-
-    # بررسی انطباق تک‌واژه‌ها
-    for word in words:
-        if word in BIDIRECTIONAL_SYNONYMS:
-            expanded.update(BIDIRECTIONAL_SYNONYMS[word])
-            
+    expanded = set(query_norm.split())
+
+    # کل عبارت، تک‌واژه‌ها و عبارت‌های چندواژه‌ای داخل کوئری (مثل «نمونه سوال») در یک پیمایش
+    for phrase in find_synonym_phrases(query_norm):
+        expanded.update(BIDIRECTIONAL_SYNONYMS[phrase])
+
     return expanded
 
+
 # =========================================================
 # ۴) استخراج اطلاعات فایل‌های درون پوشه به صورت لیست‌های مجزا
 # =========================================================
@@ -202,9 +273,9 @@ def flatten_db_for_search(db):
         path_norm = normalize_text(path_text)
         
         # نرمال‌سازی تک‌تک عناصر لیست‌ها به صورت جداگانه
-        file_names_norm = [normalize_text(f) for f in contents["file_names"] if normalize_text(f)]
-        captions_norm = [normalize_text(c) for c in contents["captions"] if normalize_text(c)]
-        short_texts_norm = [normalize_text(t) for t in contents["short_texts"] if normalize_text(t)]
+        file_names_norm = [f for f in normalize_many(contents["file_names"]) if f]
+        captions_norm = [c for c in normalize_many(contents["captions"]) if c]
+        short_texts_norm = [t for t in normalize_many(contents["short_texts"]) if t]
 
         if node_id != "root":
             results.append({
@@ -226,19 +297,207 @@ def flatten_db_for_search(db):
 
     return results
 
+# =========================================================
+# بونوس‌های تطابق مستقیم و مترادف (مشترک بین امتیازدهی تکی و دسته‌ای)
+# =========================================================
+def get_exact_file_bonus(query_norm, best_file_name_matched):
+    """
+    بونوس تطابق مستقیم کوئری/کلمات کوئری در اسم بهترین فایل (حداکثر ۲۰)
+    """
+    exact_file_bonus = 0
+    if best_file_name_matched and query_norm:
+        if query_norm in best_file_name_matched:
+            exact_file_bonus += 15  # افزایش بونوس مستقیم
+
+        # بررسی تعداد کلمات هم‌پوشان با بهترین فایل منطبق شده
+        query_words = [w for w in query_norm.split() if len(w) >= 2]
+        matched_words_in_file = sum(1 for w in query_words if w in best_file_name_matched)
+
+        if query_words:
+            word_match_ratio = matched_words_in_file / len(query_words)
+            exact_file_bonus += int(word_match_ratio * 12)
+
+    return min(exact_file_bonus, 20)
+
+
+# بونوس هر مترادف بسته به اولین جایی که پیدا شده:
+# نام فایل، نام پوشه، مسیر، کپشن، متن
+SYNONYM_FIELD_BONUSES = (8, 6, 4, 3, 2)
+
+
+def _synonym_bonus(synonym_automaton, field_texts):
+    """
+    field_texts: پنج لیست متن به ترتیب SYNONYM_FIELD_BONUSES -> جمع بونوس (بدون سقف).
+    هر مترادف فقط یک بار و با بیشترین بونوس خودش حساب می‌شود.
+    """
+    if synonym_automaton is None:
+        return 0
+
+    best = {}
+    for texts, bonus in zip(field_texts, SYNONYM_FIELD_BONUSES):
+        if not texts:
+            continue
+
+        # فیلدها به ترتیب بونوس نزولی پیمایش می‌شوند؛ اولین بونوس هر مترادف بیشترین است.
+        # متن نرمال‌شده خط جدید ندارد؛ پس هیچ الگویی از مرز دو متن رد نمی‌شود.
+        for _, i in synonym_automaton.iter(texts[0] if len(texts) == 1 else "\n".join(texts)):
+            if i not in best:
+                best[i] = bonus
+
+    return sum(best.values())
+
+
+def get_synonym_bonus(synonym_automaton, n_norm, p_norm,
+                      best_file_name_matched, best_caption_matched, best_text_matched):
+    """
+    بونوس وجود مترادف‌ها در بهترین موارد انطباق یافته (حداکثر ۱۸)
+    synonym_automaton: اتوماتای مترادف‌های کوئری به جز خود کوئری (build_term_automaton)
+    """
+    synonym_bonus = _synonym_bonus(synonym_automaton, (
+        [best_file_name_matched or ""], [n_norm], [p_norm], [best_caption_matched or ""], [best_text_matched or ""],
+    ))
+    return min(synonym_bonus, 18)
+
+
 # =========================================================
 # ۶) تابع اصلی سرچ هوشمند با منطق بهترین انطباق (Best Match) و اولویت شدید نام فایل
 # =========================================================
-def smart_search(db, query, limit=5, min_score=45):
+def smart_search(db, query, limit=5, min_score=45, time_budget=None, max_items=None):
+    """
+    time_budget/max_items: سقف زمان (ثانیه) یا تعداد نود امتیازدهی‌شده؛
+    با بودجه خروجی SearchResults است (partial=True یعنی بودجه تمام شد)
+    """
+    items = flatten_db_for_search(db)
+    if time_budget is None and max_items is None:
+        return score_items(items, query, limit=limit, min_score=min_score)
+
+    positions = {item["node_id"]: position for position, item in enumerate(items)}
+    chunks = [items[start:end] for start, end in budget_chunks(len(items))]
+    return score_items_within_budget(
+        chunks, positions, query, limit=limit, min_score=min_score,
+        time_budget=time_budget, max_items=max_items,
+    )
+
+
+def combine_scores(score_name, score_path, score_file, score_caption, score_text,
+                   exact_file_bonus, synonym_bonus, score_file_raw):
+    """
+    ترکیب امتیاز فیلدها و بونوس‌ها به امتیاز نهایی (۰ تا ۱۰۰).
+    نسبت به همه‌ی ورودی‌ها صعودی است؛ پس با سقف هر ورودی، سقف امتیاز نهایی به دست می‌آید.
+    """
+    # ===== ۷) ترکیب وزن‌دار نهایی با اولویت شدید نام فایل =====
+    weighted_score = (
+        score_name * 0.95 +
+        score_path * 0.70 +
+        score_file * 1.35 +  # افزایش وزن ضریب نام فایل به ۱.۳۵
+        score_caption * 0.50 +
+        score_text * 0.30
+    ) / (0.95 + 0.70 + 1.35 + 0.50 + 0.30)
+
+    # ===== ۸) مشخص کردن بیس اصلی امتیاز بدون فدا کردن مقادیر ماکسیمم =====
+    base_score = max(
+        score_name,
+        score_path * 0.92,
+        score_file,
+        score_caption,
+        score_text
+    )
+
+    # ===== ۱۰) محاسبه نهایی امتیاز کل =====
+    final_score = max(base_score * 0.65 + weighted_score * 0.35, weighted_score)
+    final_score += exact_file_bonus
+    final_score += synonym_bonus
+
+    # جلوگیری منطقی از نمره ۱۰۰ برای نتایجی که ارتباط نام ضعیفی دارند
+    if score_file_raw < 85 and final_score > 95:
+        final_score = 95
+
+    return min(100, int(final_score))
+
+
+# سقف امتیاز هر فیلد (وقتی آیتم آن فیلد را دارد) و سقف بونوس‌ها
+MAX_FILE_SCORE = 100
+MAX_CAPTION_SCORE = 100 * 0.72
+MAX_TEXT_SCORE = 100 * 0.55
+MAX_EXACT_FILE_BONUS = 20
+MAX_SYNONYM_BONUS = 18
+
+
+def _score_floor(upper_bound, threshold):
+    """
+    upper_bound(v): سقف امتیاز نهایی اگر امتیاز خام یک فیلد v باشد (صعودی).
+    -> None: حتی با ۱۰۰ هم از threshold رد نمی‌شود (آیتم کنار می‌رود)
+    -> f: هر امتیاز کمتر از f بی‌اثر است (score_cutoff امن برای rapidfuzz)
+    """
+    if upper_bound(100) <= threshold:
+        return None
+    if upper_bound(0) > threshold:
+        return 0
+
+    # دقت ۳ امتیاز کافی است: low همیشه یک کف امن است (upper_bound(low) <= threshold)
+    low, high = 0.0, 100.0
+    while high - low > 3:
+        middle = (low + high) / 2
+        if upper_bound(middle) > threshold:
+            high = middle
+        else:
+            low = middle
+
+    # حاشیه‌ی اطمینان برای گرد شدن ضرب در ضرایب scorerها
+    return max(0.0, low - 0.5)
+
+
+def _bonus_bounds(query_norm, query_words, synonym_automaton, n_norm, p_norm,
+                  f_norm_list, c_norm_list, t_norm_list):
+    """
+    سقف دو بونوس یک آیتم فقط با جستجوی زیررشته (بدون امتیازدهی فازی):
+    بونوس واقعی روی «بهترین» فایل/کپشن/متن حساب می‌شود، سقف روی همه‌ی آن‌ها.
+    query_words: کلمات حداقل دوحرفی کوئری (مثل get_exact_file_bonus)
+    """
+    exact_file_bonus = 0
+    for f_name in f_norm_list:
+        bonus = 15 if query_norm in f_name else 0
+        if query_words:
+            bonus += int(sum(1 for w in query_words if w in f_name) / len(query_words) * 12)
+        if bonus > exact_file_bonus:
+            exact_file_bonus = bonus
+
+    synonym_bonus = _synonym_bonus(synonym_automaton, (
+        f_norm_list, [n_norm], [p_norm], c_norm_list, t_norm_list,
+    ))
+
+    return min(exact_file_bonus, MAX_EXACT_FILE_BONUS), min(synonym_bonus, MAX_SYNONYM_BONUS)
+
+
+def score_items(items, query, limit=5, min_score=45):
+    """
+    امتیازدهی روی آیتم‌های آماده (خروجی flatten_db_for_search یا SearchIndex).
+
+    top-k: فقط limit نتیجه‌ی برتر در یک heap نگه داشته می‌شود. قبل از هر مرحله‌ی
+    گران (فایل‌ها، کپشن‌ها، متون و در آخر مسیر) سقف امتیاز آیتم با فیلدهای حساب‌نشده
+    در بیشترین مقدارشان و سقف بونوس‌ها (۲۰ و ۱۸، یا کمتر با بررسی زیررشته) حساب می‌شود؛ اگر به min_score یا امتیاز نفر k-ام نرسد، آیتم کنار می‌رود.
+    از همین سقف، کمترین امتیاز مؤثر هر فیلد به rapidfuzz (score_cutoff) داده می‌شود
+    تا رشته‌های بی‌اثر زودتر رها شوند.
+    خروجی دقیقاً همان مرتب‌سازی پایدار کل نتایج و برش [:limit] است.
+    """
     query_norm = normalize_text(query)
-    if not query_norm:
+    if not query_norm or (limit is not None and limit <= 0):
         return []
 
     expanded_terms = expand_query_terms(query)
-    items = flatten_db_for_search(db)
+    synonym_automaton = build_term_automaton([term for term in expanded_terms if term and term != query_norm])
+    query_words = [w for w in query_norm.split() if len(w) >= 2]
+
+    top = []  # heap از (امتیاز، -ترتیب، نتیجه)؛ ضعیف‌ترین نتیجه در top[0]
     results = []
 
-    for item in items:
+    for position, item in enumerate(items):
+        # آیتم فقط وقتی وارد نتایج می‌شود که از نفر k-ام بیشتر باشد
+        # (در امتیاز برابر، آیتم قبلی جلوتر است)
+        threshold = min_score - 1
+        if limit is not None and len(top) >= limit:
+            threshold = max(threshold, top[0][0])
+
         n_norm = item["node_name_norm"]
         p_norm = item["path_norm"]
         f_norm_list = item["file_names_norm"]
@@ -251,22 +510,43 @@ def smart_search(db, query, limit=5, min_score=45):
             fuzz.partial_ratio(query_norm, n_norm) * 0.92,
             fuzz.WRatio(query_norm, n_norm) * 0.95,
         ) if n_norm else 0
-        
-        # ===== ۲) امتیاز مسیر پوشه =====
-        score_path = max(
-            fuzz.token_set_ratio(query_norm, p_norm),
-            fuzz.partial_ratio(query_norm, p_norm) * 0.85,
-            fuzz.WRatio(query_norm, p_norm) * 0.88,
-        ) if p_norm else 0
+
+        # مسیر (طولانی‌ترین رشته) آخر امتیاز می‌گیرد؛ تا آن موقع در بیشترین مقدار
+        max_path = 100 if p_norm else 0
+
+        # سقف امتیاز فقط با نام (بقیه‌ی فیلدها در بیشترین مقدار)
+        max_caption = MAX_CAPTION_SCORE if c_norm_list else 0
+        max_text = MAX_TEXT_SCORE if t_norm_list else 0
+        max_exact_file_bonus, max_synonym_bonus = _bonus_bounds(
+            query_norm, query_words, synonym_automaton, n_norm, p_norm,
+            f_norm_list, c_norm_list, t_norm_list,
+        )
+
+        if f_norm_list:
+            file_floor = _score_floor(
+                lambda raw: combine_scores(
+                    score_name, max_path, min(100, raw * 1.25), max_caption, max_text,
+                    max_exact_file_bonus, max_synonym_bonus, raw,
+                ),
+                threshold,
+            )
+        else:
+            upper_bound = combine_scores(
+                score_name, max_path, 0, max_caption, max_text, 0, max_synonym_bonus, 0,
+            )
+            file_floor = 0 if upper_bound > threshold else None
+
+        if file_floor is None:
+            continue
 
         # ===== ۳) امتیاز اسم فایل (محاسبه بهترین انطباق تک‌به‌تک فایل‌ها) =====
         score_file_raw = 0
         best_file_name_matched = ""
         for f_name in f_norm_list:
             current_score = max(
-                fuzz.token_set_ratio(query_norm, f_name),
-                fuzz.partial_ratio(query_norm, f_name),
-                fuzz.WRatio(query_norm, f_name),
+                fuzz.token_set_ratio(query_norm, f_name, score_cutoff=file_floor),
+                fuzz.partial_ratio(query_norm, f_name, score_cutoff=file_floor),
+                fuzz.WRatio(query_norm, f_name, score_cutoff=file_floor),
             )
             if current_score > score_file_raw:
                 score_file_raw = current_score
@@ -275,106 +555,360 @@ def smart_search(db, query, limit=5, min_score=45):
         # اعمال ضریب افزایش (Boost) قوی برای انطباق نام فایل
         score_file = min(100, score_file_raw * 1.25)
 
+        # ===== ۶) بررسی تطابق مستقیم قوی در اسم بهترین فایل تطابق یافته =====
+        exact_file_bonus = get_exact_file_bonus(query_norm, best_file_name_matched)
+
+        # سقف امتیاز با فایل‌های حساب‌شده
+        caption_floor = _score_floor(
+            lambda raw: combine_scores(
+                score_name, max_path, score_file, raw * 0.72 if c_norm_list else 0, max_text,
+                exact_file_bonus, max_synonym_bonus, score_file_raw,
+            ),
+            threshold,
+        )
+        if caption_floor is None:
+            continue
+
         # ===== ۴) امتیاز کپشن (محاسبه بهترین انطباق بین کپشن‌ها) =====
         score_caption_raw = 0
         best_caption_matched = ""
         for caption in c_norm_list:
             current_score = max(
-                fuzz.token_set_ratio(query_norm, caption),
-                fuzz.partial_ratio(query_norm, caption) * 0.9,
-                fuzz.WRatio(query_norm, caption) * 0.9,
+                fuzz.token_set_ratio(query_norm, caption, score_cutoff=caption_floor),
+                fuzz.partial_ratio(query_norm, caption, score_cutoff=caption_floor / 0.9) * 0.9,
+                fuzz.WRatio(query_norm, caption, score_cutoff=caption_floor / 0.9) * 0.9,
             )
             if current_score > score_caption_raw:
                 score_caption_raw = current_score
                 best_caption_matched = caption
         score_caption = score_caption_raw * 0.72
 
+        text_floor = _score_floor(
+            lambda raw: combine_scores(
+                score_name, max_path, score_file, score_caption, raw * 0.55 if t_norm_list else 0,
+                exact_file_bonus, max_synonym_bonus, score_file_raw,
+            ),
+            threshold,
+        )
+        if text_floor is None:
+            continue
+
         # ===== ۵) امتیاز متون کوتاه (محاسبه بهترین انطباق) =====
         score_text_raw = 0
         best_text_matched = ""
         for txt in t_norm_list:
             current_score = max(
-                fuzz.token_set_ratio(query_norm, txt),
-                fuzz.partial_ratio(query_norm, txt) * 0.88,
-                fuzz.WRatio(query_norm, txt) * 0.85,
+                fuzz.token_set_ratio(query_norm, txt, score_cutoff=text_floor),
+                fuzz.partial_ratio(query_norm, txt, score_cutoff=text_floor / 0.88) * 0.88,
+                fuzz.WRatio(query_norm, txt, score_cutoff=text_floor / 0.85) * 0.85,
             )
             if current_score > score_text_raw:
                 score_text_raw = current_score
                 best_text_matched = txt
         score_text = score_text_raw * 0.55
 
-        # ===== ۶) بررسی تطابق مستقیم قوی در اسم بهترین فایل تطابق یافته =====
-        exact_file_bonus = 0
-        if best_file_name_matched and query_norm:
-            if query_norm in best_file_name_matched:
-                exact_file_bonus += 15  # افزایش بونوس مستقیم
-
-            # بررسی تعداد کلمات هم‌پوشان با بهترین فایل منطبق شده
-            query_words = [w for w in query_norm.split() if len(w) >= 2]
-            matched_words_in_file = sum(1 for w in query_words if w in best_file_name_matched)
-
-            if query_words:
-                word_match_ratio = matched_words_in_file / len(query_words)
-                exact_file_bonus += int(word_match_ratio * 12)
-
-        exact_file_bonus = min(exact_file_bonus, 20)
-
-        # ===== ۷) ترکیب وزن‌دار نهایی با اولویت شدید نام فایل =====
-        weighted_score = (
-            score_name * 0.95 +
-            score_path * 0.70 +
-            score_file * 1.35 +  # افزایش وزن ضریب نام فایل به ۱.۳۵
-            score_caption * 0.50 +
-            score_text * 0.30
-        ) / (0.95 + 0.70 + 1.35 + 0.50 + 0.30)
-
-        # ===== ۸) مشخص کردن بیس اصلی امتیاز بدون فدا کردن مقادیر ماکسیمم =====
-        base_score = max(
-            score_name,
-            score_path * 0.92,
-            score_file,
-            score_caption,
-            score_text
+        path_floor = _score_floor(
+            lambda raw: combine_scores(
+                score_name, raw if p_norm else 0, score_file, score_caption, score_text,
+                exact_file_bonus, max_synonym_bonus, score_file_raw,
+            ),
+            threshold,
         )
+        if path_floor is None:
+            continue
+
+        # ===== ۲) امتیاز مسیر پوشه =====
+        score_path = max(
+            fuzz.token_set_ratio(query_norm, p_norm, score_cutoff=path_floor),
+            fuzz.partial_ratio(query_norm, p_norm, score_cutoff=path_floor / 0.85) * 0.85,
+            fuzz.WRatio(query_norm, p_norm, score_cutoff=path_floor / 0.88) * 0.88,
+        ) if p_norm else 0
 
         # ===== ۹) اعمال بونوس مترادف‌ها روی بهترین موارد انطباق یافته =====
-        synonym_bonus = 0
-        for term in expanded_terms:
-            if not term or term == query_norm:
-                continue
-
-            if best_file_name_matched and term in best_file_name_matched:
-                synonym_bonus += 8  # بالاترین بونوس برای وجود مترادف در نام فایل
-            elif term in n_norm:
-                synonym_bonus += 6
-            elif term in p_norm:
-                synonym_bonus += 4
-            elif best_caption_matched and term in best_caption_matched:
-                synonym_bonus += 3
-            elif best_text_matched and term in best_text_matched:
-                synonym_bonus += 2
-
-        synonym_bonus = min(synonym_bonus, 18)
-
-        # ===== ۱۰) محاسبه نهایی امتیاز کل =====
-        final_score = max(base_score * 0.65 + weighted_score * 0.35, weighted_score)
-        final_score += exact_file_bonus
-        final_score += synonym_bonus
-
-        # جلوگیری منطقی از نمره ۱۰۰ برای نتایجی که ارتباط نام ضعیفی دارند
-        if score_file_raw < 85 and final_score > 95:
-            final_score = 95
-
-        final_score = min(100, int(final_score))
-
-        if final_score >= min_score:
-            results.append({
-                "node_id": item["node_id"],
-                "title": item["title"],
-                "path": item["path"],
-                "score": final_score
-            })
+        synonym_bonus = get_synonym_bonus(
+            synonym_automaton, n_norm, p_norm,
+            best_file_name_matched, best_caption_matched, best_text_matched,
+        )
+
+        final_score = combine_scores(
+            score_name, score_path, score_file, score_caption, score_text,
+            exact_file_bonus, synonym_bonus, score_file_raw,
+        )
+
+        if final_score <= threshold:
+            continue
+
+        result = {
+            "node_id": item["node_id"],
+            "title": item["title"],
+            "path": item["path"],
+            "score": final_score
+        }
+
+        if limit is None:
+            results.append(result)
+        elif len(top) < limit:
+            heapq.heappush(top, (final_score, -position, result))
+        else:
+            heapq.heapreplace(top, (final_score, -position, result))
+
+    if limit is not None:
+        # بیشترین امتیاز اول؛ در امتیاز برابر ترتیب اصلی آیتم‌ها
+        top.sort(key=lambda entry: (-entry[0], -entry[1]))
+        return [result for _, _, result in top]
 
     # مرتب‌سازی نتایج بر اساس بالاترین امتیاز
+    results.sort(key=lambda x: x["score"], reverse=True)
+    return results
+
+
+# =========================================================
+# ۷) امتیازدهی دسته‌ای (rapidfuzz.process.cdist + NumPy)
+# =========================================================
+# همان فرمول score_items، ولی هر فیلد با یک فراخوانی cdist برای همه‌ی رشته‌ها
+# امتیاز می‌گیرد و وزن‌دهی/ترکیب روی آرایه‌ها انجام می‌شود.
+# بونوس‌ها (بررسی زیررشته) فقط برای آیتم‌هایی حساب می‌شوند که با حداکثر بونوس
+# ممکن (۲۰ + ۱۸) به min_score برسند.
+
+# ضرایب (token_set_ratio, partial_ratio, WRatio) هر فیلد، مثل score_items
+FIELD_SCORER_WEIGHTS = {
+    "node_name_norm": (1, 0.92, 0.95),
+    "path_norm": (1, 0.85, 0.88),
+    "file_names_norm": (1, 1, 1),
+    "captions_norm": (1, 0.9, 0.9),
+    "short_texts_norm": (1, 0.88, 0.85),
+}
+
+MAX_BONUS = MAX_EXACT_FILE_BONUS + MAX_SYNONYM_BONUS
+
+
+def _field_scores(query_norm, strings, weights, workers, score_cutoff):
+    """
+    -> آرایه‌ی max(scorer_i * weight_i) برای هر رشته
+    """
+    if not strings:
+        return np.zeros(0)
+
+    best = None
+    for scorer, weight in zip((fuzz.token_set_ratio, fuzz.partial_ratio, fuzz.WRatio), weights):
+        scores = process.cdist(
+            [query_norm],
+            strings,
+            scorer=scorer,
+            dtype=np.float64,
+            workers=workers,
+            score_cutoff=score_cutoff,
+        )[0]
+        if weight != 1:
+            scores = scores * weight
+        best = scores if best is None else np.maximum(best, scores)
+
+    return best
+
+
+def _group_best(scores, owners, item_count):
+    """
+    بهترین امتیاز هر آیتم بین رشته‌هایش و اندیس اولین رشته با همان امتیاز
+    (مثل حلقه‌ی score_items: فقط امتیاز بزرگتر از صفر انتخاب می‌شود؛ بدون انتخاب -1)
+    """
+    best = np.zeros(item_count)
+    best_index = np.full(item_count, -1)
+
+    if len(scores) == 0:
+        return best, best_index
+
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    best[owners[starts]] = np.maximum.reduceat(scores, starts)
+
+    chosen = np.flatnonzero((scores == best[owners]) & (scores > 0))
+    chosen_owners, first = np.unique(owners[chosen], return_index=True)
+    best_index[chosen_owners] = chosen[first]
+
+    return best, best_index
+
+
+def score_items_batch(items, query, limit=5, min_score=45, workers=-1, score_cutoff=None):
+    """
+    نسخه‌ی دسته‌ای score_items با همان خروجی.
+    workers: تعداد ترد cdist (-1 = همه‌ی هسته‌ها)
+    score_cutoff: امتیازهای کمتر از این صفر حساب می‌شوند (سریع‌تر، ولی تقریبی)
+    """
+    query_norm = normalize_text(query)
+    if not query_norm:
+        return []
+
+    items = list(items)
+    if not items:
+        return []
+
+    expanded_terms = expand_query_terms(query)
+    synonym_automaton = build_term_automaton([term for term in expanded_terms if term and term != query_norm])
+    item_count = len(items)
+
+    # ===== ۱-۲) نام و مسیر: یک رشته برای هر آیتم =====
+    names = [item["node_name_norm"] for item in items]
+    paths = [item["path_norm"] for item in items]
+
+    score_name = _field_scores(query_norm, names, FIELD_SCORER_WEIGHTS["node_name_norm"], workers, score_cutoff)
+    score_path = _field_scores(query_norm, paths, FIELD_SCORER_WEIGHTS["path_norm"], workers, score_cutoff)
+
+    # ===== ۳-۵) فایل‌ها، کپشن‌ها و متون: همه‌ی رشته‌ها پشت هم + صاحب هر رشته =====
+    best_raw = {}
+    best_strings = {}
+
+    for key in ("file_names_norm", "captions_norm", "short_texts_norm"):
+        strings = []
+        owners = []
+        for position, item in enumerate(items):
+            values = item[key]
+            strings.extend(values)
+            owners.extend([position] * len(values))
+
+        scores = _field_scores(query_norm, strings, FIELD_SCORER_WEIGHTS[key], workers, score_cutoff)
+        best_raw[key], best_index = _group_best(scores, np.asarray(owners, dtype=np.int64), item_count)
+        best_strings[key] = (strings, best_index)
+
+    score_file_raw = best_raw["file_names_norm"]
+    score_file = np.minimum(100, score_file_raw * 1.25)
+    score_caption = best_raw["captions_norm"] * 0.72
+    score_text = best_raw["short_texts_norm"] * 0.55
+
+    # ===== ۷) ترکیب وزن‌دار نهایی =====
+    weighted_score = (
+        score_name * 0.95 +
+        score_path * 0.70 +
+        score_file * 1.35 +
+        score_caption * 0.50 +
+        score_text * 0.30
+    ) / (0.95 + 0.70 + 1.35 + 0.50 + 0.30)
+
+    # ===== ۸) بیس اصلی امتیاز =====
+    base_score = np.maximum.reduce([
+        score_name,
+        score_path * 0.92,
+        score_file,
+        score_caption,
+        score_text,
+    ])
+
+    combined = np.maximum(base_score * 0.65 + weighted_score * 0.35, weighted_score)
+
+    # ===== ۹) بونوس‌ها فقط برای آیتم‌هایی که هنوز می‌توانند به min_score برسند =====
+    reachable = np.flatnonzero(np.minimum(100, combined + MAX_BONUS) >= min_score)
+
+    def best_string(key, position):
+        strings, best_index = best_strings[key]
+        index = best_index[position]
+        return strings[index] if index >= 0 else ""
+
+    exact_file_bonus = np.zeros(len(reachable))
+    synonym_bonus = np.zeros(len(reachable))
+
+    for i, position in enumerate(reachable):
+        item = items[position]
+        best_file = best_string("file_names_norm", position)
+
+        exact_file_bonus[i] = get_exact_file_bonus(query_norm, best_file)
+        synonym_bonus[i] = get_synonym_bonus(
+            synonym_automaton, item["node_name_norm"], item["path_norm"],
+            best_file, best_string("captions_norm", position), best_string("short_texts_norm", position),
+        )
+
+    # ===== ۱۰) امتیاز نهایی (جمع به همان ترتیب score_items) =====
+    final_score = combined[reachable] + exact_file_bonus + synonym_bonus
+    final_score = np.where((score_file_raw[reachable] < 85) & (final_score > 95), 95, final_score)
+    final_score = np.minimum(100, final_score).astype(np.int64)
+
+    results = [
+        {
+            "node_id": items[position]["node_id"],
+            "title": items[position]["title"],
+            "path": items[position]["path"],
+            "score": int(score),
+        }
+        for position, score in zip(reachable, final_score)
+        if score >= min_score
+    ]
+
     results.sort(key=lambda x: x["score"], reverse=True)
     return results[:limit]
+
+
+# =========================================================
+# ۸) امتیازدهی با بودجه‌ی زمان/کار (نتیجه‌ی «هر لحظه آماده»)
+# =========================================================
+# آیتم‌ها دسته‌دسته و به ترتیب اولویت (مثلاً امتیاز پیش‌فیلتر) امتیاز می‌گیرند و بعد از
+# هر دسته با نتایج قبلی ادغام می‌شوند. بودجه بین دسته‌ها بررسی می‌شود (دسته‌ی اول همیشه
+# امتیاز می‌گیرد و دسته‌ای که طبق سرعت دسته‌های قبلی از زمان بیرون می‌زند شروع نمی‌شود)؛
+# اگر تمام شود بهترین نتایج تا همان لحظه با partial=True برمی‌گردند.
+# اگر بودجه تمام نشود خروجی دقیقاً همان امتیازدهی یک‌جای همه‌ی آیتم‌هاست.
+# دسته‌ها از BUDGET_FIRST_CHUNK دو برابر می‌شوند تا BUDGET_CHUNK_SIZE: دسته‌ی اول کوچک
+# است تا بودجه‌ی کم هم رعایت شود و سرعت امتیازدهی زود تخمین زده شود.
+BUDGET_FIRST_CHUNK = 32
+BUDGET_CHUNK_SIZE = 256
+
+
+def budget_chunks(count):
+    """
+    -> بازه‌های [شروع، پایان) دسته‌ها برای count آیتم
+    """
+    bounds = []
+    start = 0
+    size = BUDGET_FIRST_CHUNK
+
+    while start < count:
+        bounds.append((start, min(count, start + size)))
+        start += size
+        size = min(size * 2, BUDGET_CHUNK_SIZE)
+
+    return bounds
+
+
+class SearchResults(list):
+    """
+    لیست نتایج + partial: آیا بودجه قبل از امتیازدهی همه‌ی کاندیدها تمام شد
+    """
+
+    def __init__(self, results=(), partial=False):
+        super().__init__(results)
+        self.partial = partial
+
+
+def score_items_within_budget(chunks, positions, query, limit=5, min_score=45,
+                              time_budget=None, max_items=None, batch=False, **batch_kwargs):
+    """
+    chunks: دسته‌های آیتم به ترتیب اولویت (داخل هر دسته به ترتیب نهایی)
+    positions: node_id -> ترتیب نهایی (برای امتیازهای برابر، مثل ترتیب pre-order)
+    time_budget: ثانیه ؛ max_items: حداکثر تعداد آیتم امتیازدهی‌شده (None = بدون سقف)
+    batch=True: هر دسته با score_items_batch (batch_kwargs: workers, score_cutoff)
+    -> SearchResults
+    """
+    started = time.monotonic()
+    deadline = started + time_budget if time_budget is not None else None
+    results = []
+    scored = 0
+
+    for i, chunk in enumerate(chunks):
+        if i and max_items and scored >= max_items:
+            return SearchResults(results, partial=True)
+
+        # دسته‌ای که با سرعت تا اینجا قبل از deadline تمام نمی‌شود اصلاً شروع نمی‌شود
+        if i and deadline is not None:
+            now = time.monotonic()
+            if now + (now - started) / max(scored, 1) * len(chunk) > deadline:
+                return SearchResults(results, partial=True)
+
+        # نتیجه‌ی کمتر از نفر k-ام فعلی دیگر وارد خروجی نمی‌شود (برابرش ممکن است، با ترتیب جلوتر)
+        floor = min_score
+        if limit is not None and len(results) >= limit > 0:
+            floor = max(floor, results[limit - 1]["score"])
+
+        if batch:
+            found = score_items_batch(chunk, query, limit=limit, min_score=floor, **batch_kwargs)
+        else:
+            found = score_items(chunk, query, limit=limit, min_score=floor)
+
+        scored += len(chunk)
+        results = sorted(results + found, key=lambda r: (-r["score"], positions[r["node_id"]]))[:limit]
+
+    return SearchResults(results)
@@ -0,0 +1,64 @@
+import gzip
+import json
+import marshal
+
+
+# =========================================================
+# فرمت‌های snapshot دیتابیس (database.json)
+# =========================================================
+# - json:    همان فرمت قبلی (indent=2) ؛ خوانا برای انسان
+# - compact: JSON بدون فاصله و تورفتگی
+# - gzip:    compact JSON فشرده‌شده با gzip
+# - marshal: فرمت باینری stdlib (سریع‌ترین load/save، فقط برای همین نسخه پایتون)
+#
+# decode فرمت را از روی چند بایت اول تشخیص می‌دهد، پس عوض کردن تنظیمات
+# فایل‌های قبلی را خراب نمی‌کند.
+
+FORMATS = ("json", "compact", "gzip", "marshal")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_MARSHAL_MAGIC = b"LBMARSHAL1\n"
+
+
+def encode(data, fmt="json"):
+    if fmt == "json":
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+    if fmt == "compact":
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    if fmt == "gzip":
+        raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        # mtime=0 تا خروجی برای داده یکسان همیشه یکسان باشد (hash ژورنال)
+        return gzip.compress(raw, compresslevel=5, mtime=0)
+
+    if fmt == "marshal":
+        return _MARSHAL_MAGIC + marshal.dumps(data)
+
+    raise ValueError(f"unknown snapshot format: {fmt}")
+
+
+def detect(raw):
+    if raw.startswith(_GZIP_MAGIC):
+        return "gzip"
+    if raw.startswith(_MARSHAL_MAGIC):
+        return "marshal"
+    return "json"
+
+
+def decode(raw, allow_marshal=True):
+    """
+    allow_marshal=False برای فایل‌هایی که از بیرون (ادمین) می‌رسند؛
+    marshal برای داده‌ی نامطمئن امن نیست.
+    """
+    fmt = detect(raw)
+
+    if fmt == "gzip":
+        return json.loads(gzip.decompress(raw).decode("utf-8"))
+
+    if fmt == "marshal":
+        if not allow_marshal:
+            raise ValueError("marshal snapshots are not accepted here")
+        return marshal.loads(raw[len(_MARSHAL_MAGIC):])
+
+    return json.loads(raw.decode("utf-8-sig"))
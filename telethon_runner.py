@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+
+# =========================================================
+# اجرای کوروتین‌های Telethon (بکاپ/ریستور) از کد همزمان یا async
+# =========================================================
+# حلقه‌ی Telethon یا یک ترد جداست، یا (TELETHON_MAIN_LOOP) همان حلقه‌ی اصلی.
+# وقتی کوروتین اصلاً اجرا نشد (حلقه‌ی اشتباه / کلاینت آماده نیست / breaker باز)
+# TelethonUnavailable بالا می‌رود، نه None؛ تا «دانلود نشد» با «بکاپی نیست» یکی نشود.
+
+
+class TelethonUnavailable(RuntimeError):
+    pass
+
+
+class TelethonRunner:
+    """
+    loop: حلقه‌ی Telethon (در حالت حلقه‌ی اصلی بعداً در main() مقدار می‌گیرد)
+    ready: بعد از وصل شدن کلاینت set می‌شود
+    start_task: تسک اتصال کلاینت در حالت حلقه‌ی اصلی
+    """
+
+    def __init__(self, breaker, loop=None, ready_timeout=30):
+        self.breaker = breaker
+        self.loop = loop
+        self.ready = threading.Event()
+        self.start_task = None
+        self.ready_timeout = ready_timeout
+
+    def on_loop(self):
+        try:
+            return self.loop is not None and asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _unavailable(self, coro, reason, failure=False):
+        coro.close()
+        if failure:
+            self.breaker.record_failure()
+        print(f"❌ {reason}")
+        raise TelethonUnavailable(reason)
+
+    def run(self, coro, timeout=120):
+        """
+        از کد همزمان و تردها: بلاک تا نتیجه‌ی کوروتین روی حلقه‌ی Telethon.
+        """
+        # روی خود حلقه، بلاک کردن ترد یعنی deadlock؛ باید run_async (یا to_thread) صدا زده شود
+        if self.on_loop():
+            self._unavailable(coro, "Sync Telethon call on the Telethon loop, use run_async")
+
+        # وقتی breaker باز است، منتظر آماده شدن Telethon نمان
+        if not self.ready.is_set() and self.breaker.is_open():
+            self._unavailable(coro, "Backup circuit open, skipping Telethon call")
+
+        self.ready.wait(timeout=self.ready_timeout)
+
+        if not self.ready.is_set():
+            self._unavailable(coro, "Telethon client not ready", failure=True)
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(timeout=timeout)
+
+    async def run_async(self, coro, timeout=120):
+        """
+        همان run برای کدهای async؛
+        به جای بلاک کردن ترد، نتیجه‌ی حلقه Telethon await می‌شود.
+        """
+        if not self.ready.is_set() and self.breaker.is_open():
+            self._unavailable(coro, "Backup circuit open, skipping Telethon call")
+
+        on_loop = self.on_loop()
+
+        if not self.ready.is_set():
+            if on_loop and self.start_task is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(self.start_task), timeout=self.ready_timeout)
+                except Exception as e:
+                    print(f"❌ Telethon start failed: {e}")
+            else:
+                await asyncio.to_thread(self.ready.wait, self.ready_timeout)
+
+        if not self.ready.is_set():
+            self._unavailable(coro, "Telethon client not ready", failure=True)
+
+        # همان حلقه: await مستقیم
+        if on_loop:
+            return await asyncio.wait_for(coro, timeout=timeout)
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
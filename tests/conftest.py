@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+# ماژول‌های ربات در ریشه‌ی مخزن هستند (بدون پکیج)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+SEARCH_SUBJECTS = ("آناتومی", "فیزیولوژی", "بیوشیمی", "پاتولوژی", "فارماکولوژی", "ژنتیک")
+SEARCH_SECTIONS = ("جلسه", "جزوه", "نمونه سوال", "ویس")
+
+
+def make_search_library():
+    """
+    کتابخانه‌ی نمونه برای تست‌های سرچ: درس ⬅️ بخش ⬅️ قسمت، با نام‌های تکراری
+    (امتیازهای برابر) و محتوای فایل/کپشن/متن.
+    """
+    db = {"root": {"name": "خانه", "parent": None, "children": [], "contents": []}}
+
+    for i, subject in enumerate(SEARCH_SUBJECTS):
+        subject_id = f"s{i}"
+        db["root"]["children"].append(subject_id)
+        db[subject_id] = {"name": subject, "parent": "root", "children": [], "contents": []}
+
+        for j, section in enumerate(SEARCH_SECTIONS):
+            section_id = f"{subject_id}-{j}"
+            db[subject_id]["children"].append(section_id)
+            db[section_id] = {
+                "name": f"{section} {j + 1}",
+                "parent": subject_id,
+                "children": [],
+                "contents": [
+                    {"type": "document", "file_id": f"f-{section_id}", "file_name": f"{subject} {section} {j + 1}.pdf",
+                     "caption": f"{section} درس {subject}"},
+                    {"type": "text", "text": f"خلاصه {section} {subject} برای مرور"},
+                ],
+            }
+
+            for k in range(2):
+                part_id = f"{section_id}-{k}"
+                db[section_id]["children"].append(part_id)
+                db[part_id] = {
+                    "name": f"قسمت {k + 1}",
+                    "parent": section_id,
+                    "children": [],
+                    "contents": [{"type": "audio", "file_id": f"a-{part_id}", "title": f"{subject} part {k + 1}.mp3"}],
+                }
+
+    return db
+
+
+@pytest.fixture
+def search_library():
+    return make_search_library()
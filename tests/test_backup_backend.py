@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from backup_backend import LocalBackupBackend, create_backup_backend
+
+
+CHAT = -1001
+
+
+async def _collect(backend, **kwargs):
+    return [message async for message in backend.iter_messages(CHAT, **kwargs)]
+
+
+def test_ids_increase_per_chat_and_survive_restart(tmp_path):
+    backend = LocalBackupBackend(str(tmp_path))
+
+    first = asyncio.run(backend.send_message(CHAT, "یک"))
+    second = asyncio.run(backend.send_file(CHAT, "db.json", b"{}", caption="دو"))
+    other = asyncio.run(backend.send_message(42, "چت دیگر"))
+
+    assert (first.id, second.id, other.id) == (1, 2, 1)
+
+    # نمونه‌ی جدید شناسه را از روی فایل‌های موجود ادامه می‌دهد
+    restarted = LocalBackupBackend(str(tmp_path))
+    assert asyncio.run(restarted.send_message(CHAT, "سه")).id == 3
+
+
+def test_send_file_and_download(tmp_path):
+    backend = LocalBackupBackend(str(tmp_path))
+    raw = "{\"root\": {}}".encode("utf-8")
+
+    message = asyncio.run(backend.send_file(CHAT, "database.json", raw, caption="بکاپ", reply_to=7))
+
+    assert (message.text, message.file_name, message.reply_to) == ("بکاپ", "database.json", 7)
+    assert asyncio.run(backend.download(message)) == raw
+
+    save_path = str(tmp_path / "restored.json")
+    assert asyncio.run(backend.download(message, save_path=save_path)) == save_path
+    assert (tmp_path / "restored.json").read_bytes() == raw
+
+
+def test_text_message_has_no_file(tmp_path):
+    backend = LocalBackupBackend(str(tmp_path))
+
+    message = asyncio.run(backend.send_message(CHAT, "لاگ", reply_to=3))
+
+    assert message.file_name is None and message.reply_to == 3
+
+
+def test_edit_pin_and_get_messages(tmp_path):
+    backend = LocalBackupBackend(str(tmp_path))
+    message = asyncio.run(backend.send_file(CHAT, "manifest.json", b"1", caption="v1"))
+
+    assert asyncio.run(backend.get_pinned(CHAT)) is None
+
+    asyncio.run(backend.edit_message(CHAT, message.id, "v2"))
+    asyncio.run(backend.pin_message(CHAT, message.id))
+
+    pinned = asyncio.run(backend.get_pinned(CHAT))
+    assert (pinned.id, pinned.text, pinned.file_name) == (message.id, "v2", "manifest.json")
+
+    found, missing = asyncio.run(backend.get_messages(CHAT, [message.id, 99]))
+    assert found.text == "v2" and missing is None
+
+    with pytest.raises(ValueError):
+        asyncio.run(backend.edit_message(CHAT, 99, "x"))
+
+
+def test_iter_messages_newest_first_with_limit_and_search(tmp_path):
+    backend = LocalBackupBackend(str(tmp_path))
+    for text in ("بکاپ ۱", "لاگ", "بکاپ ۲", "بکاپ ۳"):
+        asyncio.run(backend.send_message(CHAT, text))
+
+    assert [m.text for m in asyncio.run(_collect(backend))] == ["بکاپ ۳", "بکاپ ۲", "لاگ", "بکاپ ۱"]
+    assert [m.id for m in asyncio.run(_collect(backend, limit=2))] == [4, 3]
+    assert [m.text for m in asyncio.run(_collect(backend, limit=2, search="بکاپ"))] == ["بکاپ ۳", "بکاپ ۲"]
+
+
+def test_create_backup_backend(tmp_path):
+    assert isinstance(create_backup_backend("local", local_dir=str(tmp_path)), LocalBackupBackend)
+
+    with pytest.raises(ValueError):
+        create_backup_backend("ftp")
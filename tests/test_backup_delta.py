@@ -0,0 +1,160 @@
+import copy
+import json
+
+import backup_delta
+
+
+def _library():
+    return {
+        "root": {"name": "خانه", "parent": None, "children": ["a", "b"], "contents": []},
+        "a": {
+            "name": "آناتومی",
+            "parent": "root",
+            "children": [],
+            "contents": [{"type": "text", "text": str(i)} for i in range(5)],
+        },
+        "b": {"name": "فیزیولوژی", "parent": "root", "children": [], "contents": [], "style": "primary"},
+    }
+
+
+def _edits():
+    """
+    هر مرحله دیکشنری زنده را تغییر می‌دهد (مثل هندلرهای ادمین).
+    """
+    def add_node(db):
+        db["c"] = {"name": "بیوشیمی", "parent": "root", "children": [], "contents": []}
+        db["root"]["children"].append("c")
+
+    def insert_middle(db):
+        db["a"]["contents"][2:2] = [{"type": "document", "file_id": "f1"}]
+
+    def remove_range(db):
+        del db["a"]["contents"][0:2]
+
+    def rename_and_restyle(db):
+        db["b"]["name"] = "فیزیو"
+        db["b"].pop("style")
+
+    def reorder_and_remove(db):
+        db["root"]["children"] = ["c", "a"]
+        del db["b"]
+
+    return [add_node, insert_middle, remove_range, rename_and_restyle, reorder_and_remove]
+
+
+def _raw(data):
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def test_diff_apply_round_trip():
+    old = _library()
+    new = copy.deepcopy(old)
+
+    for edit in _edits():
+        edit(new)
+        patch = backup_delta.diff(old, new)
+        backup_delta.apply_patch(old, json.loads(json.dumps(patch)))
+        assert old == new
+
+
+def test_diff_keeps_only_changed_contents_range():
+    old = _library()
+    new = copy.deepcopy(old)
+    new["a"]["contents"][3] = {"type": "text", "text": "x"}
+
+    patch = backup_delta.diff(old, new)
+
+    assert patch["contents"] == {"a": {"start": 3, "delete": 1, "items": [{"type": "text", "text": "x"}]}}
+    assert patch["add"] == patch["update"] == {} and patch["remove"] == []
+
+
+def test_unchanged_library_gives_empty_patch():
+    data = _library()
+
+    assert backup_delta.is_empty(backup_delta.diff(data, copy.deepcopy(data)))
+    assert not backup_delta.is_empty(backup_delta.diff(data, {}))
+
+
+def _uploaded_chain():
+    """
+    checkpoint + deltaهای متوالی، همان‌طور که worker بکاپ آپلود می‌کند.
+    """
+    live = _library()
+    checkpoint_raw = _raw(live)
+
+    tracker = backup_delta.DeltaTracker(checkpoint_every=50)
+    tracker.checkpoint_uploaded(json.loads(checkpoint_raw), backup_delta.file_id(checkpoint_raw))
+
+    deltas = []
+    for edit in _edits():
+        edit(live)
+        patch, raw = tracker.make_delta(live)
+        tracker.delta_uploaded(patch, raw)
+        deltas.append(raw)
+
+    return live, checkpoint_raw, deltas, tracker
+
+
+def test_rebuild_replays_chain_from_checkpoint():
+    live, checkpoint_raw, deltas, tracker = _uploaded_chain()
+
+    data, last_id, applied = backup_delta.rebuild(json.loads(checkpoint_raw), checkpoint_raw, deltas)
+
+    assert data == live == tracker.base
+    assert applied == len(deltas)
+    assert last_id == tracker.base_id == backup_delta.file_id(deltas[-1])
+
+
+def test_rebuild_stops_at_missing_delta():
+    live, checkpoint_raw, deltas, _ = _uploaded_chain()
+
+    expected = json.loads(checkpoint_raw)
+    backup_delta.apply_patch(expected, backup_delta.decode_delta(deltas[0])["patch"])
+
+    # delta دوم گم شده: سومی روی فایلی بنا شده که در دست نیست
+    data, last_id, applied = backup_delta.rebuild(json.loads(checkpoint_raw), checkpoint_raw, [deltas[0]] + deltas[2:])
+
+    assert applied == 1
+    assert data == expected
+    assert last_id == backup_delta.file_id(deltas[0])
+
+
+def test_rebuild_rejects_delta_from_other_checkpoint():
+    _, checkpoint_raw, deltas, _ = _uploaded_chain()
+    other_raw = _raw({"root": {"name": "دیگر", "parent": None, "children": [], "contents": []}})
+
+    data, last_id, applied = backup_delta.rebuild(json.loads(other_raw), other_raw, deltas)
+
+    assert applied == 0
+    assert data == json.loads(other_raw)
+    assert last_id == backup_delta.file_id(other_raw)
+
+
+def test_tracker_asks_for_checkpoint():
+    tracker = backup_delta.DeltaTracker(checkpoint_every=2)
+    assert tracker.needs_checkpoint()
+
+    data = _library()
+    raw = _raw(data)
+    tracker.checkpoint_uploaded(json.loads(raw), backup_delta.file_id(raw))
+    assert not tracker.needs_checkpoint()
+
+    for name in ("x", "y"):
+        data["a"]["name"] = name
+        tracker.delta_uploaded(*tracker.make_delta(data))
+    assert tracker.needs_checkpoint()
+
+    tracker.checkpoint_uploaded(copy.deepcopy(data), "id")
+    tracker.force_checkpoint = True
+    assert tracker.needs_checkpoint()
+
+
+def test_chain_ok_checks_links_and_tail():
+    _, checkpoint_raw, deltas, tracker = _uploaded_chain()
+
+    assert backup_delta.chain_ok(checkpoint_raw, deltas, tracker.base_id)
+    assert backup_delta.chain_ok(checkpoint_raw, [], None)
+    # manifest به delta جدیدتری اشاره می‌کند که دانلود نشده
+    assert not backup_delta.chain_ok(checkpoint_raw, deltas[:-1], tracker.base_id)
+    assert not backup_delta.chain_ok(checkpoint_raw, deltas[:1] + deltas[2:], tracker.base_id)
+    assert not backup_delta.chain_ok(b"{}", deltas, tracker.base_id)
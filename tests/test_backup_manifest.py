@@ -0,0 +1,47 @@
+import backup_manifest
+
+
+def test_entry_verifies_size_and_sha256():
+    raw = "پشتیبان".encode("utf-8")
+    entry = backup_manifest.make_entry(42, raw)
+
+    assert entry["msg_id"] == 42 and entry["size"] == len(raw)
+    assert backup_manifest.verify(entry, raw)
+    assert not backup_manifest.verify(entry, raw + b" ")
+    # همان طول، بایت متفاوت
+    assert not backup_manifest.verify(entry, raw[:-1] + b"x")
+    assert not backup_manifest.verify({}, raw)
+
+
+def test_render_parse_round_trip():
+    manifest = {
+        "database.json": dict(backup_manifest.make_entry(1, b"db"), deltas=[2, 3], tail="abc"),
+        "userdata.json": backup_manifest.make_entry(4, b"users"),
+    }
+
+    text = backup_manifest.render(manifest)
+
+    assert text.startswith(backup_manifest.MANIFEST_TAG)
+    assert backup_manifest.parse(text) == manifest
+
+
+def test_render_drops_delta_list_that_does_not_fit():
+    manifest = {
+        "database.json": dict(backup_manifest.make_entry(1, b"db"), deltas=list(range(10 ** 6, 10 ** 6 + 1000)), tail="t"),
+        "userdata.json": backup_manifest.make_entry(4, b"users"),
+    }
+
+    text = backup_manifest.render(manifest)
+    parsed = backup_manifest.parse(text)
+
+    assert len(text) <= backup_manifest.MAX_TEXT_LEN
+    assert parsed["database.json"]["deltas"] is None
+    assert parsed["database.json"]["msg_id"] == 1
+    assert parsed["userdata.json"] == manifest["userdata.json"]
+
+
+def test_parse_rejects_other_messages():
+    assert backup_manifest.parse(None) is None
+    assert backup_manifest.parse("سلام") is None
+    assert backup_manifest.parse(f"{backup_manifest.MANIFEST_TAG}\nnot json") is None
+    assert backup_manifest.parse(f"{backup_manifest.MANIFEST_TAG}\n[1, 2]") is None
@@ -0,0 +1,158 @@
+import asyncio
+import selectors
+import types
+
+import backup_queue
+from backup_queue import BackupQueue
+
+
+class _VirtualSelector:
+    """
+    به جای خوابیدن، ساعت مجازی حلقه را به اندازه‌ی timeout جلو می‌برد.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        events = self._selector.select(0)
+        if not events and timeout:
+            self._loop.now += timeout
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        self.now = 0.0
+        super().__init__(_VirtualSelector(self))
+
+    def time(self):
+        return self.now
+
+
+def _run(monkeypatch, scenario):
+    loop = VirtualClockLoop()
+    monkeypatch.setattr(backup_queue, "time", types.SimpleNamespace(time=loop.time))
+    try:
+        return loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+
+def _queue(calls, debounce=5, max_delay=20):
+    async def handler(event):
+        calls.append((asyncio.get_running_loop().time(), event))
+        return True
+
+    def merge(events):
+        return {"saves": [e["save"] for e in events]}
+
+    return BackupQueue(handler, debounce=debounce, max_delay=max_delay, merge=merge)
+
+
+def test_saves_within_debounce_are_merged_into_one_upload(monkeypatch):
+    calls = []
+
+    async def scenario():
+        queue = _queue(calls)
+        queue.start()
+        for i in range(3):
+            queue.submit({"save": i})
+            await asyncio.sleep(2)
+
+        await asyncio.sleep(30)
+        await queue.stop()
+        return queue
+
+    queue = _run(monkeypatch, scenario)
+
+    assert [event for _, event in calls] == [{"saves": [0, 1, 2]}]
+    # ۵ ثانیه بعد از آخرین ذخیره (ثانیه ۴)
+    assert calls[0][0] == 9
+    assert queue.coalesced == 2 and queue.uploaded == 1
+
+
+def test_saves_further_apart_than_debounce_upload_separately(monkeypatch):
+    calls = []
+
+    async def scenario():
+        queue = _queue(calls)
+        queue.start()
+        for i in range(2):
+            queue.submit({"save": i})
+            await asyncio.sleep(10)
+
+        await queue.stop()
+        return queue
+
+    queue = _run(monkeypatch, scenario)
+
+    assert [event for _, event in calls] == [{"saves": [0]}, {"saves": [1]}]
+    assert queue.coalesced == 0 and queue.uploaded == 2
+
+
+def test_steady_stream_is_flushed_at_max_delay(monkeypatch):
+    calls = []
+
+    async def scenario():
+        queue = _queue(calls)
+        queue.start()
+        for i in range(12):
+            queue.submit({"save": i})
+            await asyncio.sleep(3)
+
+        await queue.stop()
+
+    _run(monkeypatch, scenario)
+
+    first_time, first = calls[0]
+    # صف هیچ‌وقت ۵ ثانیه آرام نمی‌شود؛ بعد از ۲۰ ثانیه در هر حال آپلود می‌شود
+    assert first_time == 20
+    assert first == {"saves": list(range(7))}
+    assert sum(len(event["saves"]) for _, event in calls) == 12
+
+
+def test_stop_flushes_without_waiting_for_debounce(monkeypatch):
+    calls = []
+
+    async def scenario():
+        queue = _queue(calls, debounce=60, max_delay=600)
+        queue.start()
+        queue.submit({"save": 1})
+        queue.submit({"save": 2})
+        await asyncio.sleep(0)
+
+        started = asyncio.get_running_loop().time()
+        await queue.stop()
+        return asyncio.get_running_loop().time() - started
+
+    waited = _run(monkeypatch, scenario)
+
+    assert [event for _, event in calls] == [{"saves": [1, 2]}]
+    assert waited < 60
+
+
+def test_failed_upload_is_reported(monkeypatch):
+    results = []
+
+    async def scenario():
+        async def handler(event):
+            return False
+
+        async def on_result(event, ok):
+            results.append((event, ok))
+
+        queue = BackupQueue(handler)
+        queue.start(on_result=on_result)
+        queue.submit({"save": 1})
+        await queue.stop()
+        return queue
+
+    queue = _run(monkeypatch, scenario)
+
+    assert results == [({"save": 1, "queued_at": 0.0}, False)]
+    assert queue.failed == 1 and queue.last_error == "handler returned failure"
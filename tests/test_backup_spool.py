@@ -0,0 +1,157 @@
+import asyncio
+import types
+
+import pytest
+
+import backup_spool
+from backup_spool import BackupSpool, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(backup_spool, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == "closed" and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.is_open() and not breaker.allow()
+
+
+def test_breaker_half_open_allows_single_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+
+    clock.now += 59
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert not breaker.is_open()
+    assert breaker.allow() and breaker.state == "half_open"
+    # تا نتیجه‌ی تلاش آزمایشی معلوم نشده، درخواست دیگری مجاز نیست
+    assert not breaker.allow() and breaker.is_open()
+
+
+def test_breaker_probe_result(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.opened_at == clock.now
+
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0 and breaker.allow()
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == "closed"
+
+
+def test_spool_keeps_order_across_restart(tmp_path):
+    spool = BackupSpool(str(tmp_path))
+    for i in range(3):
+        spool.push({"kind": "db", "n": i}, bytes([i]))
+
+    restarted = BackupSpool(str(tmp_path))
+    assert restarted.pending() == 3
+
+    seq, meta, raw = restarted.first()
+    assert (meta["n"], raw) == (0, b"\x00")
+
+    restarted.remove(seq)
+    assert restarted.first()[1]["n"] == 1
+
+
+def test_coalesce_keeps_only_latest_of_kind(tmp_path):
+    spool = BackupSpool(str(tmp_path))
+    spool.push({"kind": "db", "n": 0}, b"a")
+    spool.push({"kind": "userdata", "n": 1}, b"b")
+    spool.push({"kind": "db", "n": 2}, b"c")
+    spool.push({"kind": "userdata", "n": 3}, b"d", coalesce=True)
+
+    order = []
+    while spool.pending():
+        seq, meta, _ = spool.first()
+        order.append(meta["n"])
+        spool.remove(seq)
+
+    assert order == [0, 2, 3]
+
+
+def _fill(tmp_path, count):
+    spool = BackupSpool(str(tmp_path))
+    for i in range(count):
+        spool.push({"kind": "db", "n": i}, str(i).encode())
+    return spool
+
+
+def test_replay_sends_in_order(tmp_path, clock):
+    spool = _fill(tmp_path, 4)
+    breaker = CircuitBreaker()
+    sent = []
+
+    async def send(meta, raw):
+        sent.append((meta["n"], raw))
+        return True
+
+    assert asyncio.run(backup_spool.replay(spool, breaker, send)) == 4
+    assert sent == [(0, b"0"), (1, b"1"), (2, b"2"), (3, b"3")]
+    assert spool.pending() == 0
+
+
+def test_replay_stops_at_first_failure_and_resumes_in_order(tmp_path, clock):
+    spool = _fill(tmp_path, 4)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    sent = []
+    results = iter([True, False])
+
+    async def flaky(meta, raw):
+        ok = next(results)
+        if ok:
+            sent.append(meta["n"])
+        return ok
+
+    assert asyncio.run(backup_spool.replay(spool, breaker, flaky)) == 1
+    assert breaker.state == "open" and spool.pending() == 3
+
+    async def send(meta, raw):
+        sent.append(meta["n"])
+        return True
+
+    # breaker باز است: تا reset_timeout چیزی ارسال نمی‌شود
+    assert asyncio.run(backup_spool.replay(spool, breaker, send)) == 0
+
+    clock.now += 60
+    assert asyncio.run(backup_spool.replay(spool, breaker, send)) == 3
+    assert sent == [0, 1, 2, 3]
+    assert breaker.state == "closed"
+
+
+def test_replay_treats_exception_as_failure(tmp_path, clock):
+    spool = _fill(tmp_path, 2)
+    breaker = CircuitBreaker(failure_threshold=1)
+
+    async def broken(meta, raw):
+        raise ConnectionError("offline")
+
+    assert asyncio.run(backup_spool.replay(spool, breaker, broken)) == 0
+    assert breaker.state == "open" and spool.pending() == 2
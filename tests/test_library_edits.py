@@ -0,0 +1,119 @@
+import copy
+import itertools
+import json
+
+import pytest
+
+import library_edits
+from library_ops import apply_op
+from library_store import LibraryStore, SqliteLibraryStore
+
+
+def _library():
+    return {
+        "root": {"name": "خانه", "parent": None, "children": ["a", "b"], "contents": []},
+        "a": {
+            "name": "آناتومی",
+            "parent": "root",
+            "children": ["a1", "a2"],
+            "contents": [{"type": "text", "text": "مقدمه"}],
+            "layout": [["a2"], ["a1"]],
+            "style": "primary",
+        },
+        "a1": {
+            "name": "جلسه ۱",
+            "parent": "a",
+            "children": [],
+            "contents": [
+                {"type": "document", "file_id": "f1", "media_group_id": "g"},
+                {"type": "document", "file_id": "f2", "media_group_id": "g"},
+                {"type": "audio", "file_id": "f3"},
+            ],
+        },
+        "a2": {"name": "جلسه ۲", "parent": "a", "children": ["a21"], "contents": []},
+        "a21": {"name": "ویس", "parent": "a2", "children": [], "contents": [{"type": "voice", "file_id": "v1"}]},
+        "b": {"name": "فیزیولوژی", "parent": "root", "children": [], "contents": []},
+    }
+
+
+def _ids():
+    counter = itertools.count()
+    return lambda: f"new-{next(counter)}"
+
+
+# هر مسیر هندلر: (نام، تابعی که دیکشنری زنده را تغییر می‌دهد و رکوردها را برمی‌گرداند)
+EDITS = [
+    ("add_child", lambda db: library_edits.add_child(db, "b", "پوشه جدید", node_id="new")[1]),
+    ("rename", lambda db: library_edits.rename(db, "a1", "جلسه اول")),
+    ("delete_child", lambda db: library_edits.delete_child(db, "a", "a2")),
+    ("delete_last_in_layout", lambda db: library_edits.delete_child(db, "root", "b")),
+    ("reorder_children", lambda db: library_edits.reorder_children(db, "a", ["a2", "a1"])),
+    ("clone_subtree", lambda db: library_edits.clone_subtree(db, "a", "b", new_id=_ids())[1]),
+    ("set_layout", lambda db: library_edits.set_layout(db, "a", [["a1", "a2"]])),
+    ("remove_layout", lambda db: library_edits.remove_layout(db, "a")),
+    ("set_row_count", lambda db: library_edits.set_row_count(db, "a", 3)),
+    ("set_style", lambda db: library_edits.set_style(db, "b", "success")),
+    ("unset_style", lambda db: library_edits.set_style(db, "a", None)),
+    ("append_contents", lambda db: library_edits.append_contents(db, "a1", [{"type": "text", "text": "x"}])),
+    ("append_contents_new_key", lambda db: library_edits.append_contents(db, "root", [{"type": "photo", "file_id": "p"}])),
+    ("remove_content", lambda db: library_edits.remove_contents(db, "a1", 2, 1)[1]),
+    ("remove_media_group", lambda db: library_edits.remove_contents(db, "a1", 0, 2)[1]),
+    ("clear_contents", lambda db: library_edits.clear_contents(db, "a1")[1]),
+    ("replace_contents", lambda db: library_edits.replace_contents(
+        db, "a1", 0, 2, [{"type": "video", "file_id": "v"}, {"type": "text", "text": "y"}, {"type": "text", "text": "z"}]
+    )[1]),
+    ("replace_contents_past_end", lambda db: library_edits.replace_contents(
+        db, "a1", 2, 5, [{"type": "text", "text": "y"}]
+    )[1]),
+]
+
+
+@pytest.mark.parametrize("name,edit", EDITS, ids=[name for name, _ in EDITS])
+def test_replaying_ops_reproduces_edit(name, edit):
+    db = _library()
+    snapshot = copy.deepcopy(db)
+
+    ops = edit(db)
+
+    # ژورنال رکوردها را JSON می‌کند
+    replayed = copy.deepcopy(snapshot)
+    for op in json.loads(json.dumps(ops, ensure_ascii=False)):
+        apply_op(replayed, op)
+
+    assert replayed == db
+
+
+def test_edits_are_applied_in_place():
+    db = _library()
+    a1_contents = db["a1"]["contents"]
+
+    removed, _ = library_edits.remove_contents(db, "a1", 0, 2)
+
+    assert [item["file_id"] for item in removed] == ["f1", "f2"]
+    assert db["a1"]["contents"] is a1_contents
+    assert "a21" not in library_edits.delete_child(db, "a", "a2") and "a21" not in db
+    assert db["a"]["layout"] == [["a1"]]
+
+
+def _open_json_store(tmp_path):
+    store = LibraryStore(str(tmp_path / "database.json"), journal_path=str(tmp_path / "database.json.journal"))
+    return store
+
+
+def _open_sqlite_store(tmp_path):
+    return SqliteLibraryStore(str(tmp_path / "database.json"), str(tmp_path / "library.db"))
+
+
+@pytest.mark.parametrize("name,edit", EDITS, ids=[name for name, _ in EDITS])
+@pytest.mark.parametrize("open_store", [_open_json_store, _open_sqlite_store], ids=["journal", "sqlite"])
+def test_store_restart_after_edit(tmp_path, open_store, name, edit):
+    store = open_store(tmp_path)
+    store.save(_library())
+    db = store.reload()
+
+    store.save(db, ops=edit(db))
+
+    expected = copy.deepcopy(db)
+    restarted = open_store(tmp_path).reload()
+
+    assert restarted == expected
@@ -0,0 +1,92 @@
+from library_store import SqliteLibraryStore, node_menu
+
+
+def _store(tmp_path):
+    store = SqliteLibraryStore(str(tmp_path / "database.json"), str(tmp_path / "library.db"))
+    store.save({
+        "root": {"name": "خانه", "parent": None, "children": ["a"], "contents": []},
+        "a": {"name": "آناتومی", "parent": "root", "children": [], "contents": [{"type": "text", "text": "x"}]},
+    })
+    return store
+
+
+class _LockCheckingConnection:
+    """
+    هر کوئری باید زیر قفل store اجرا شود (اتصال check_same_thread=False بین تردها مشترک است).
+    """
+
+    def __init__(self, conn, lock):
+        self._conn = conn
+        self._lock = lock
+        self.unlocked = []
+
+    def execute(self, sql, *args):
+        if not self._lock._is_owned():
+            self.unlocked.append(sql)
+        return self._conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def test_sqlite_reads_hold_store_lock(tmp_path):
+    store = _store(tmp_path)
+    conn = store._conn = _LockCheckingConnection(store._db(), store._lock)
+
+    store.get_node("a")
+    store.reload()
+    store.view()["a"]
+
+    assert conn.unlocked == []
+
+
+def test_sqlite_get_node(tmp_path):
+    store = _store(tmp_path)
+
+    assert store.get_node("root")["children"] == ["a"]
+    assert store.get_node("a")["contents"] == [{"type": "text", "text": "x"}]
+    assert store.get_node("missing") is None
+
+
+class _RecordingConnection:
+    def __init__(self, conn):
+        self._conn = conn
+        self.queries = []
+
+    def execute(self, sql, *args):
+        self.queries.append(sql)
+        return self._conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def test_menu_does_not_read_contents(tmp_path):
+    store = _store(tmp_path)
+    data = store.reload()
+    data["b"] = {"name": "فیزیولوژی", "parent": "root", "children": [], "contents": [], "style": "primary"}
+    data["root"]["children"].append("b")
+    store.save(data)
+    conn = store._conn = _RecordingConnection(store._db())
+
+    node, children = node_menu(store.view(), "root")
+
+    assert node["children"] == ["a", "b"]
+    assert [(c_id, meta["name"], meta.get("style")) for c_id, meta in children] == [
+        ("a", "آناتومی", None),
+        ("b", "فیزیولوژی", "primary"),
+    ]
+    assert len(conn.queries) == 2
+    assert not any("contents" in sql for sql in conn.queries)
+    assert node_menu(store.view(), "missing") is None
+
+
+def test_menu_on_json_view(tmp_path):
+    store = _store(tmp_path)
+    data = store.reload()
+
+    node, children = node_menu(data, "root")
+
+    assert node["children"] == ["a"]
+    assert [(c_id, meta["name"]) for c_id, meta in children] == [("a", "آناتومی")]
+    assert node_menu(data, "missing") is None
@@ -0,0 +1,133 @@
+import asyncio
+import io
+import types
+import zipfile
+
+import pytest
+
+import log_shipper
+from log_shipper import LogShipper, TokenBucket, pack_chunks
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(log_shipper, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(log_shipper, "asyncio", types.SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep))
+    return clock
+
+
+class FloodWaitError(Exception):
+    def __init__(self, seconds):
+        super().__init__(f"flood wait {seconds}")
+        self.seconds = seconds
+
+
+class FakeBackend:
+    def __init__(self, fail_with=()):
+        self.messages = []
+        self.files = []
+        self.fail_with = list(fail_with)
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_to=None):
+        if self.fail_with:
+            raise self.fail_with.pop(0)
+        self.messages.append((chat_id, text, reply_to))
+
+    async def send_file(self, chat_id, filename, raw, caption=None, reply_to=None):
+        self.files.append((chat_id, filename, raw, reply_to))
+
+
+def test_pack_chunks_keeps_lines_and_limit():
+    lines = [f"<b>خط {i}</b> " + "x" * (i % 40) for i in range(300)]
+    text = "\n".join(lines)
+
+    chunks = pack_chunks(text, max_len=500)
+
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert "\n".join(chunks) == text
+    assert len(chunks) < 40
+
+
+def test_pack_chunks_cuts_only_overlong_line():
+    text = "a\n" + "y" * 25 + "\nb"
+
+    # باقی‌مانده‌ی خط بریده‌شده با خط بعدی در یک تکه می‌آید
+    assert pack_chunks(text, max_len=10) == ["a", "y" * 10, "y" * 10, "y" * 5 + "\nb"]
+    assert pack_chunks("") == []
+
+
+def test_ship_sends_numbered_parts_as_replies(clock):
+    backend = FakeBackend()
+    shipper = LogShipper(backend, bucket=TokenBucket(rate=100, capacity=100))
+    text = "\n".join("خط " + "z" * 100 for _ in range(100))
+
+    assert asyncio.run(shipper.ship(-100, text, reply_to=7))
+
+    total = len(pack_chunks(text))
+    assert total > 1 and shipper.sent == total
+    assert [reply_to for _, _, reply_to in backend.messages] == [7] * total
+    assert backend.messages[-1][1].endswith(f"بخش {total} از {total}</i>")
+    assert all(len(message) <= log_shipper.TELEGRAM_TEXT_LIMIT for _, message, _ in backend.messages)
+
+
+def test_long_log_is_attached_as_zip(clock):
+    backend = FakeBackend()
+    shipper = LogShipper(backend, attach_threshold=1000)
+    text = "<b>لاگ</b>\n" * 500
+
+    assert asyncio.run(shipper.ship(-100, text, reply_to=9))
+
+    assert backend.messages == []
+    (chat_id, filename, raw, reply_to), = backend.files
+    assert (chat_id, filename, reply_to) == (-100, "log_9.zip", 9)
+    with zipfile.ZipFile(io.BytesIO(raw)) as zf:
+        assert text in zf.read("log.html").decode("utf-8")
+
+
+def test_flood_wait_pauses_bucket_and_retries_same_chunk(clock):
+    backend = FakeBackend(fail_with=[FloodWaitError(12)])
+    shipper = LogShipper(backend, bucket=TokenBucket(rate=1, capacity=5))
+
+    assert asyncio.run(shipper.ship(-100, "سلام", reply_to=1))
+
+    assert shipper.flood_waits == 1
+    assert backend.messages == [(-100, "سلام", 1)]
+    # ۱۲ ثانیه صبر FloodWait قبل از ارسال دوباره
+    assert sum(clock.slept) >= 12
+
+
+def test_other_errors_are_not_retried(clock):
+    backend = FakeBackend(fail_with=[RuntimeError("boom")])
+    shipper = LogShipper(backend)
+
+    assert not asyncio.run(shipper.ship(-100, "سلام"))
+    assert shipper.failed == 1 and shipper.flood_waits == 0
+
+
+def test_token_bucket_allows_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    async def take(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    asyncio.run(take(3))
+    assert clock.slept == []
+
+    asyncio.run(take(4))
+    # بعد از burst هر توکن ۰.۵ ثانیه
+    assert sum(clock.slept) == pytest.approx(2.0)
@@ -0,0 +1,47 @@
+import pytest
+
+from search_index import SearchIndex
+from smart_search import score_items, score_items_batch
+
+
+# هم‌امتیازها (قسمت ۱ در همه‌ی درس‌ها)، بونوس نام فایل، مترادف و غلط تایپی
+QUERIES = ("قسمت 1", "آناتومی جلسه 1", "part 2", "فیزیولوژی جزوه", "صدا ژنتیک", "فارماکولوژي", "مرور")
+
+
+@pytest.fixture
+def index(search_library):
+    return SearchIndex().build(search_library)
+
+
+@pytest.mark.parametrize("scope", ["root", "s2", "s2-1"])
+@pytest.mark.parametrize("limit", [1, 5, 15, None])
+@pytest.mark.parametrize("min_score", [45, 70])
+def test_batch_matches_score_items(index, scope, limit, min_score):
+    items = list(index.items(scope))
+
+    for query in QUERIES:
+        expected = score_items(items, query, limit=limit, min_score=min_score)
+        assert score_items_batch(items, query, limit=limit, min_score=min_score, workers=1) == expected, query
+
+
+def test_batch_keeps_tie_order(index):
+    items = list(index.items("root"))
+
+    results = score_items_batch(items, "قسمت 1", limit=None, min_score=45, workers=1)
+    scores = [r["score"] for r in results]
+    order = {item["node_id"]: position for position, item in enumerate(items)}
+
+    assert len(set(scores)) < len(scores)
+    for previous, current in zip(results, results[1:]):
+        if previous["score"] == current["score"]:
+            assert order[previous["node_id"]] < order[current["node_id"]]
+
+
+def test_index_search_batch_flag(index):
+    for query in QUERIES:
+        assert index.search(query, scope="s0", batch=True, workers=1) == index.search(query, scope="s0")
+
+
+def test_empty_inputs():
+    assert score_items_batch([], "آناتومی") == []
+    assert score_items_batch([{"node_id": "x"}], "   ") == []
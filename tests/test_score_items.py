@@ -0,0 +1,102 @@
+import pytest
+from rapidfuzz import fuzz
+
+from search_index import SearchIndex
+from smart_search import combine_scores, expand_query_terms, get_exact_file_bonus, normalize_text, score_items
+
+
+QUERIES = ("قسمت 1", "قسمت 2", "آناتومی جلسه 1", "part 2", "فیزیولوژی جزوه", "صدا ژنتیک", "فارماکولوژي", "مرور")
+
+
+def _best(query_norm, strings, weights):
+    best_score, best_string = 0, ""
+    for value in strings:
+        score = max(
+            fuzz.token_set_ratio(query_norm, value) * weights[0],
+            fuzz.partial_ratio(query_norm, value) * weights[1],
+            fuzz.WRatio(query_norm, value) * weights[2],
+        )
+        if score > best_score:
+            best_score, best_string = score, value
+    return best_score, best_string
+
+
+def _synonym_bonus(terms, fields):
+    bonus = 0
+    for term in terms:
+        for text, value in zip(fields, (8, 6, 4, 3, 2)):
+            if text and term in text:
+                bonus += value
+                break
+    return min(bonus, 18)
+
+
+def _reference_score(item, query):
+    """
+    همان فرمول score_items بدون هیچ هرس یا score_cutoff
+    """
+    query_norm = normalize_text(query)
+    terms = [term for term in expand_query_terms(query) if term and term != query_norm]
+
+    n_norm, p_norm = item["node_name_norm"], item["path_norm"]
+    score_name = _best(query_norm, [n_norm] if n_norm else [], (1, 0.92, 0.95))[0]
+    score_path = _best(query_norm, [p_norm] if p_norm else [], (1, 0.85, 0.88))[0]
+    score_file_raw, best_file = _best(query_norm, item["file_names_norm"], (1, 1, 1))
+    score_caption_raw, best_caption = _best(query_norm, item["captions_norm"], (1, 0.9, 0.9))
+    score_text_raw, best_text = _best(query_norm, item["short_texts_norm"], (1, 0.88, 0.85))
+
+    return combine_scores(
+        score_name, score_path, min(100, score_file_raw * 1.25), score_caption_raw * 0.72, score_text_raw * 0.55,
+        get_exact_file_bonus(query_norm, best_file),
+        _synonym_bonus(terms, (best_file, n_norm, p_norm, best_caption, best_text)),
+        score_file_raw,
+    )
+
+
+def _reference(items, query, limit, min_score):
+    """
+    امتیازدهی کامل همه‌ی آیتم‌ها، مرتب‌سازی پایدار و برش [:limit]
+    """
+    results = []
+    for item in items:
+        score = _reference_score(item, query)
+        if score >= min_score:
+            results.append({"node_id": item["node_id"], "title": item["title"], "path": item["path"], "score": score})
+
+    results.sort(key=lambda x: x["score"], reverse=True)
+    return results if limit is None else results[:limit]
+
+
+@pytest.fixture
+def index(search_library):
+    return SearchIndex().build(search_library)
+
+
+@pytest.mark.parametrize("scope", ["root", "s2"])
+@pytest.mark.parametrize("limit", [1, 5, 15, None])
+@pytest.mark.parametrize("min_score", [45, 70])
+def test_pruned_scoring_matches_exhaustive_reference(index, scope, limit, min_score):
+    items = list(index.items(scope))
+
+    for query in QUERIES:
+        assert score_items(items, query, limit=limit, min_score=min_score) == \
+            _reference(items, query, limit, min_score), query
+
+
+def test_ties_cut_at_limit_keep_item_order(index):
+    items = list(index.items("root"))
+    reference = _reference(items, "قسمت 1", None, 45)
+
+    # limit وسط یک گروه هم‌امتیاز می‌بُرد
+    tied = [r for r in reference if r["score"] == reference[0]["score"]]
+    assert len(tied) > 5
+
+    assert score_items(items, "قسمت 1", limit=5) == tied[:5]
+
+
+def test_no_results_and_empty_query(index):
+    items = list(index.items("root"))
+
+    assert score_items(items, "zzzz qqqq", limit=5, min_score=70) == _reference(items, "zzzz qqqq", 5, 70)
+    assert score_items(items, "  ", limit=5) == []
+    assert score_items(items, "قسمت 1", limit=0) == []
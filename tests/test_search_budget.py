@@ -0,0 +1,92 @@
+import types
+
+import pytest
+
+import search_index
+import smart_search
+from search_cache import SearchResultCache
+from search_index import SearchIndex
+from smart_search import SearchResults
+
+
+QUERIES = ("قسمت 1", "آناتومی جلسه 1", "part 2", "صدا ژنتیک", "فیزیولژی")
+
+
+class StepClock:
+    """
+    ساعت ساختگی: هر بار خواندن step ثانیه جلو می‌رود.
+    """
+
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def monotonic(self):
+        self.now += self.step
+        return self.now
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # کتابخانه‌ی تست ۷۸ نود دارد؛ دسته‌های کوچک تا ادغام چند دسته هم سنجیده شود
+    monkeypatch.setattr(smart_search, "BUDGET_FIRST_CHUNK", 4)
+    monkeypatch.setattr(smart_search, "BUDGET_CHUNK_SIZE", 16)
+
+
+@pytest.fixture
+def index(search_library):
+    return SearchIndex().build(search_library)
+
+
+@pytest.mark.parametrize("prefilter", [True, False])
+@pytest.mark.parametrize("scope", ["root", "s1"])
+@pytest.mark.parametrize("limit", [1, 5, 15])
+def test_unexhausted_budget_matches_unbudgeted(index, small_chunks, prefilter, scope, limit):
+    for query in QUERIES:
+        expected = index.search(query, scope=scope, limit=limit, prefilter=prefilter)
+
+        by_items = index.search(query, scope=scope, limit=limit, prefilter=prefilter, max_items=10 ** 6)
+        by_time = index.search(query, scope=scope, limit=limit, prefilter=prefilter, time_budget=3600)
+
+        assert by_items == expected and not by_items.partial, query
+        assert by_time == expected and not by_time.partial, query
+
+
+def test_unexhausted_budget_matches_smart_search(search_library, small_chunks):
+    for query in QUERIES:
+        expected = smart_search.smart_search(search_library, query, limit=15)
+        budgeted = smart_search.smart_search(search_library, query, limit=15, max_items=10 ** 6)
+
+        assert budgeted == expected and not budgeted.partial
+
+
+def test_max_items_sets_partial(index, small_chunks):
+    results = index.search("قسمت 1", limit=15, prefilter=False, max_items=4)
+
+    assert results.partial
+    assert 0 < len(results) <= 4
+
+
+def test_time_budget_sets_partial(index, small_chunks, monkeypatch):
+    # هر خواندن ساعت ۱۰ ثانیه: بودجه‌ی ۵ ثانیه بعد از دسته‌ی اول تمام است
+    clock = StepClock(step=10.0)
+    fake_time = types.SimpleNamespace(monotonic=clock.monotonic)
+    monkeypatch.setattr(smart_search, "time", fake_time)
+    monkeypatch.setattr(search_index, "time", fake_time)
+
+    results = index.search("قسمت 1", limit=15, prefilter=False, time_budget=5)
+
+    # دسته‌ی اول همیشه امتیاز می‌گیرد؛ بعد از آن بودجه تمام است
+    assert results.partial
+    assert len(results) <= 4
+    assert results == index.search("قسمت 1", limit=15, prefilter=False, max_items=4)
+
+
+def test_partial_results_are_not_cached():
+    cache = SearchResultCache()
+
+    assert not cache.put_results("partial", SearchResults([{"node_id": "a"}], partial=True), "html")
+    assert cache.get("partial") is None
+
+    assert cache.put_results("full", SearchResults([{"node_id": "a"}]), "html")
+    assert cache.get("full") == "html"
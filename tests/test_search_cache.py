@@ -0,0 +1,84 @@
+import types
+
+import pytest
+
+import search_cache
+from search_cache import SearchResultCache, search_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(search_cache, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = SearchResultCache(max_entries=2, ttl=0)
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expires_entries(clock):
+    cache = SearchResultCache(max_entries=10, ttl=60)
+    cache.put("a", 1)
+
+    clock.now += 59
+    assert cache.get("a") == 1
+
+    clock.now += 1
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_zero_ttl_never_expires(clock):
+    cache = SearchResultCache(max_entries=10, ttl=0)
+    cache.put("a", 1)
+
+    clock.now += 10 ** 6
+    assert cache.get("a") == 1
+
+
+def test_disabled_cache_stores_nothing(clock):
+    cache = SearchResultCache(max_entries=0)
+    cache.put("a", 1)
+
+    assert cache.get("a") is None
+
+
+def test_clear_counts_invalidation(clock):
+    # save_db بعد از هر ذخیره clear را صدا می‌زند
+    cache = SearchResultCache()
+    cache.clear()
+    cache.put("a", 1)
+    cache.clear()
+
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_key_normalizes_query_and_includes_generation(clock):
+    cache = SearchResultCache()
+    cache.put(search_key("آناتومی  جلسه", "root", 3, "bot"), "results")
+
+    assert cache.get(search_key("اناتومی جلسه", "root", 3, "bot")) == "results"
+    # نسخه‌ی جدید کتابخانه یا ریشه‌ی دیگر: کلید دیگر
+    assert cache.get(search_key("اناتومی جلسه", "root", 4, "bot")) is None
+    assert cache.get(search_key("اناتومی جلسه", "s1", 3, "bot")) is None
+
+
+def test_stats_hit_ratio(clock):
+    cache = SearchResultCache()
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
@@ -0,0 +1,138 @@
+import copy
+import itertools
+
+import pytest
+
+import library_edits
+import library_ops
+from search_index import SearchIndex
+from smart_search import flatten_db_for_search
+
+
+def _ids():
+    counter = itertools.count()
+    return lambda: f"new-{next(counter)}"
+
+
+def _move(db, node_id, new_parent):
+    old_parent = db[node_id]["parent"]
+    db[old_parent]["children"].remove(node_id)
+    db[new_parent]["children"].append(node_id)
+    db[node_id]["parent"] = new_parent
+    return [
+        library_ops.set_children(old_parent, db[old_parent]["children"]),
+        library_ops.set_children(new_parent, db[new_parent]["children"]),
+        library_ops.set_fields(node_id, {"parent": new_parent}),
+    ]
+
+
+# هر مورد: (نام، تابعی که دیکشنری زنده را تغییر می‌دهد و رکوردهای library_ops را برمی‌گرداند)
+EDITS = [
+    ("add_node", lambda db: library_edits.add_child(db, "s1-2", "ویس جدید فیزیولوژی", node_id="new")[1]),
+    ("delete_subtree", lambda db: library_edits.delete_child(db, "s0", "s0-1")),
+    ("rename_leaf", lambda db: library_edits.rename(db, "s2-0-1", "قسمت آخر")),
+    ("rename_with_subtree", lambda db: library_edits.rename(db, "s3", "آسیب شناسی")),
+    ("set_children", lambda db: library_edits.reorder_children(db, "s4", ["s4-3", "s4-0", "s4-2", "s4-1"])),
+    ("set_layout", lambda db: library_edits.set_layout(db, "root", [["s5", "s4"], ["s3", "s2", "s1", "s0"]])),
+    ("clone_subtree", lambda db: library_edits.clone_subtree(db, "s0-0", "s5", new_id=_ids())[1]),
+    ("append_contents", lambda db: library_edits.append_contents(
+        db, "s1-0-0", [{"type": "document", "file_id": "x", "file_name": "اطلس آناتومی.pdf"}])),
+    ("remove_contents", lambda db: library_edits.remove_contents(db, "s2-1", 0, 1)[1]),
+    ("replace_contents", lambda db: library_edits.replace_contents(
+        db, "s2-2", 1, 1, [{"type": "text", "text": "متن جدید ژنتیک"}])[1]),
+    ("clear_contents", lambda db: library_edits.clear_contents(db, "s3-0")[1]),
+    ("move_leaf", lambda db: _move(db, "s0-0-1", "s5-3")),
+    ("move_subtree", lambda db: _move(db, "s1-1", "s4")),
+]
+
+
+def _state(index, db):
+    """
+    همه‌چیزی که جستجو از ایندکس می‌خواند، برای مقایسه با ساخت کامل
+    """
+    scopes = [node_id for node_id in db if node_id in index.entries]
+    return {
+        "entries": index.entries,
+        "children": index.children,
+        "postings": index.postings,
+        "grams": index.grams,
+        "items": {scope: list(index.items(scope)) for scope in scopes},
+        "ranked": [
+            index.ranked_candidates(query, scope, 0)
+            for query in ("آناتومی", "قسمت", "ویس فیزیولوژی", "ژنتیک")
+            for scope in ("root", "s1", "s4", "s5")
+            if scope in index.entries
+        ],
+    }
+
+
+def _assert_matches_rebuild(index, db):
+    rebuilt = SearchIndex().build(db, generation=index.generation)
+    assert _state(index, db) == _state(rebuilt, db)
+
+
+@pytest.mark.parametrize("name, edit", EDITS, ids=[name for name, _ in EDITS])
+def test_apply_ops_matches_rebuild(search_library, name, edit):
+    index = SearchIndex().build(search_library, generation=1)
+    # بازه‌ها قبل از تغییر شماره‌گذاری شده باشند (مثل بعد از اولین جستجو)
+    list(index.items("s1"))
+
+    ops = edit(search_library)
+    index.apply_ops(search_library, ops, generation=2)
+
+    _assert_matches_rebuild(index, search_library)
+
+
+def test_apply_ops_sequence_matches_rebuild(search_library):
+    index = SearchIndex().build(search_library, generation=0)
+
+    for generation, (_, edit) in enumerate(EDITS, start=1):
+        ops = edit(search_library)
+        index.apply_ops(search_library, ops, generation=generation)
+        list(index.items("root"))
+
+    _assert_matches_rebuild(index, search_library)
+
+
+def test_scoped_items_follow_edits(search_library):
+    index = SearchIndex().build(search_library, generation=1)
+    assert [item["node_id"] for item in index.items("s1-1")] == ["s1-1-0", "s1-1-1"]
+
+    ops = _move(search_library, "s1-1", "s4") + library_edits.rename(search_library, "s1-1-0", "مقدمه")
+    index.apply_ops(search_library, ops, generation=2)
+
+    assert [item["node_id"] for item in index.items("s1")] == ["s1-0", "s1-0-0", "s1-0-1", "s1-2", "s1-2-0",
+                                                                "s1-2-1", "s1-3", "s1-3-0", "s1-3-1"]
+    moved = {item["node_id"]: item for item in index.items("s4")}
+    assert moved["s1-1-0"]["path"] == "فارماکولوژی جزوه 2 ⬅️ فارماکولوژی جزوه 2 مقدمه"
+    assert moved["s1-1-0"]["title"] == "فارماکولوژی جزوه 2 مقدمه"
+
+
+def _node_ids(items):
+    return sorted(item["node_id"] for item in items)
+
+
+def test_orphans_are_searched_like_flatten(search_library):
+    search_library["lost"] = {"name": "جزوه گمشده", "parent": "deleted", "children": ["lost-1"], "contents": []}
+    search_library["lost-1"] = {"name": "ویس", "parent": "lost", "children": [], "contents": []}
+
+    index = SearchIndex().build(search_library)
+
+    assert _node_ids(index.items("root")) == _node_ids(flatten_db_for_search(search_library))
+    assert {item["node_id"]: item["path"] for item in index.items("root")}["lost-1"] == "جزوه گمشده ⬅️ جزوه گمشده ویس"
+    assert [item["path"] for item in index.items("lost")] == ["جزوه گمشده ویس"]
+    assert "lost-1" in index.candidates("ویس", "root")
+
+
+def test_orphan_from_ops_matches_rebuild(search_library):
+    index = SearchIndex().build(search_library, generation=1)
+    list(index.items("root"))
+
+    search_library["lost"] = {"name": "جزوه گمشده", "parent": None, "children": [], "contents": []}
+    index.apply_ops(search_library, [library_ops.add_node("lost", search_library["lost"])], generation=2)
+    _assert_matches_rebuild(index, search_library)
+
+    removed = copy.deepcopy(search_library)
+    del removed["lost"]
+    index.apply_ops(removed, [library_ops.delete_subtree("lost", None)], generation=3)
+    _assert_matches_rebuild(index, removed)
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+
+import pytest
+
+from search_pool import SearchBusyError, SearchPool
+
+
+class Gate:
+    """
+    جستجوی ساختگی که تا باز شدن در، روی ترد pool می‌ماند و هم‌زمانی را می‌شمارد.
+    """
+
+    def __init__(self):
+        self.opened = threading.Event()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def search(self, value):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            assert self.opened.wait(timeout=5)
+            return value
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+async def _until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+def test_second_search_of_same_user_is_rejected():
+    gate = Gate()
+    pool = SearchPool(workers=2, max_in_flight=4, per_user_limit=1)
+
+    async def scenario():
+        first = asyncio.create_task(pool.run("u1", gate.search, "a"))
+        await _until(lambda: gate.running == 1)
+
+        with pytest.raises(SearchBusyError):
+            await pool.run("u1", gate.search, "b")
+
+        # کاربر دیگر رد نمی‌شود
+        other = asyncio.create_task(pool.run("u2", gate.search, "c"))
+        await _until(lambda: gate.running == 2)
+
+        gate.opened.set()
+        return await first, await other
+
+    try:
+        assert asyncio.run(scenario()) == ("a", "c")
+    finally:
+        pool.shutdown()
+
+    assert pool.rejected == 1 and pool.completed == 2
+    assert pool.pending() == 0 and pool.pending("u1") == 0
+
+
+def test_semaphore_caps_searches_in_flight():
+    gate = Gate()
+    pool = SearchPool(workers=4, max_in_flight=2, per_user_limit=0)
+
+    async def scenario():
+        tasks = [asyncio.create_task(pool.run("u1", gate.search, i)) for i in range(5)]
+        await _until(lambda: gate.running == 2 and pool.waiting == 3)
+
+        assert pool.pending("u1") == 5
+        gate.opened.set()
+        return await asyncio.gather(*tasks)
+
+    try:
+        assert asyncio.run(scenario()) == [0, 1, 2, 3, 4]
+    finally:
+        pool.shutdown()
+
+    assert gate.peak == 2
+    assert pool.stats()["completed"] == 5 and pool.waiting == 0
+
+
+def test_failed_search_releases_user_slot():
+    pool = SearchPool(workers=1, per_user_limit=1)
+
+    def broken():
+        raise ValueError("boom")
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await pool.run("u1", broken)
+        return await pool.run("u1", lambda: "ok")
+
+    try:
+        assert asyncio.run(scenario()) == "ok"
+    finally:
+        pool.shutdown()
+
+    assert pool.pending() == 0
+
+
+def test_zero_workers_runs_on_the_loop():
+    pool = SearchPool(workers=0)
+
+    async def scenario():
+        return await pool.run("u1", threading.current_thread), threading.current_thread()
+
+    ran_on, loop_thread = asyncio.run(scenario())
+
+    assert ran_on is loop_thread
+    assert pool._executor is None
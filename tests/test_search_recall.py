@@ -0,0 +1,50 @@
+import pytest
+
+from search_index import SearchIndex
+
+
+# مستقیم، غلط تایپی، و کوئری‌هایی که فقط با مترادف به کتابخانه می‌رسند
+DIRECT_QUERIES = ("آناتومی", "فیزیولوژی", "پاتولوژی جزوه", "آناتومی part", "قسمت 2", "ژنتیک")
+TYPO_QUERIES = ("اناتومی جلسه", "فارماکولوژي", "فیزیولژی", "بیوشیمى")
+SYNONYM_QUERIES = ("کالبد شناسی", "صدا ژنتیک", "امتحان فیزیولوژی", "نمونه سوال آناتومی")
+
+QUERIES = DIRECT_QUERIES + TYPO_QUERIES + SYNONYM_QUERIES
+
+
+def _recall(index, queries, limit=10, min_score=60):
+    """
+    سهم نتایج امتیازدهی کامل (prefilter=False) که با پیش‌فیلتر هم پیدا می‌شوند
+    """
+    expected = found = 0
+
+    for query in queries:
+        full = {r["node_id"] for r in index.search(query, limit=limit, min_score=min_score, prefilter=False)}
+        prefiltered = {r["node_id"] for r in index.search(query, limit=limit, min_score=min_score)}
+        expected += len(full)
+        found += len(full & prefiltered)
+
+    assert expected, "fixture queries should have results"
+    return found / expected
+
+
+@pytest.mark.parametrize("queries", [DIRECT_QUERIES, TYPO_QUERIES, SYNONYM_QUERIES],
+                         ids=["direct", "typo", "synonym"])
+def test_default_cap_keeps_full_recall(search_library, queries):
+    index = SearchIndex().build(search_library)
+
+    assert _recall(index, queries) == 1.0
+
+
+def test_recall_floor_with_tight_cap(search_library):
+    # سقف خیلی کمتر از تعداد نودها (۲۰ از ۷۸): افت recall محدود می‌ماند
+    index = SearchIndex(max_candidates=20).build(search_library)
+
+    assert _recall(index, QUERIES) >= 0.85
+
+
+def test_unlimited_candidates_match_full_scoring(search_library):
+    index = SearchIndex(max_candidates=0).build(search_library)
+
+    for query in QUERIES:
+        full = index.search(query, limit=10, min_score=60, prefilter=False)
+        assert index.search(query, limit=10, min_score=60) == full
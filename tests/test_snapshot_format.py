@@ -0,0 +1,61 @@
+import pytest
+
+import snapshot_format
+
+
+def _library():
+    return {
+        "root": {"name": "خانه", "parent": None, "children": ["a"], "contents": []},
+        "a": {
+            "name": "آناتومی",
+            "parent": "root",
+            "children": [],
+            "contents": [{"type": "text", "text": "سلام"}, {"type": "document", "file_id": "f1"}],
+            "row_count": 3,
+        },
+    }
+
+
+@pytest.mark.parametrize("fmt", snapshot_format.FORMATS)
+def test_round_trip(fmt):
+    data = _library()
+
+    raw = snapshot_format.encode(data, fmt)
+
+    assert snapshot_format.decode(raw) == data
+
+
+@pytest.mark.parametrize("fmt, detected", [
+    ("json", "json"), ("compact", "json"), ("gzip", "gzip"), ("marshal", "marshal"),
+])
+def test_detect_format(fmt, detected):
+    assert snapshot_format.detect(snapshot_format.encode(_library(), fmt)) == detected
+
+
+def test_decode_accepts_utf8_bom():
+    raw = b"\xef\xbb\xbf" + snapshot_format.encode(_library(), "json")
+
+    assert snapshot_format.decode(raw) == _library()
+
+
+def test_gzip_output_is_deterministic():
+    assert snapshot_format.encode(_library(), "gzip") == snapshot_format.encode(_library(), "gzip")
+
+
+def test_untrusted_upload_rejects_marshal():
+    raw = snapshot_format.encode(_library(), "marshal")
+
+    with pytest.raises(ValueError):
+        snapshot_format.decode(raw, allow_marshal=False)
+
+
+@pytest.mark.parametrize("fmt", ["json", "compact", "gzip"])
+def test_untrusted_upload_accepts_json_formats(fmt):
+    raw = snapshot_format.encode(_library(), fmt)
+
+    assert snapshot_format.decode(raw, allow_marshal=False) == _library()
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        snapshot_format.encode(_library(), "pickle")
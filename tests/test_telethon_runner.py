@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from backup_spool import BackupDelivery, BackupSpool, CircuitBreaker
+from telethon_runner import TelethonRunner, TelethonUnavailable
+
+
+def _main_loop_runner():
+    """
+    حالت TELETHON_MAIN_LOOP: حلقه‌ی Telethon همان حلقه‌ی در حال اجراست.
+    """
+    runner = TelethonRunner(CircuitBreaker(failure_threshold=1), ready_timeout=0)
+    runner.loop = asyncio.get_running_loop()
+    runner.ready.set()
+    return runner
+
+
+def test_sync_call_on_main_loop_is_an_error_not_none():
+    ran = []
+
+    async def download():
+        ran.append(True)
+        return False
+
+    async def scenario():
+        runner = _main_loop_runner()
+        with pytest.raises(TelethonUnavailable):
+            runner.run(download())
+        return runner
+
+    runner = asyncio.run(scenario())
+
+    assert ran == []
+    # اجرا نشدن به خاطر حلقه‌ی اشتباه خطای مقصد نیست
+    assert runner.breaker.state == "closed" and runner.breaker.failures == 0
+
+
+def test_main_loop_async_and_thread_paths():
+    async def download():
+        return "raw"
+
+    async def scenario():
+        runner = _main_loop_runner()
+        direct = await runner.run_async(download())
+        # مثل restore_local_state: کد همزمان داخل ترد جدا
+        threaded = await asyncio.to_thread(runner.run, download())
+        return direct, threaded
+
+    assert asyncio.run(scenario()) == ("raw", "raw")
+
+
+def test_not_ready_raises_and_counts_failure():
+    runner = TelethonRunner(CircuitBreaker(failure_threshold=1), loop=None, ready_timeout=0)
+
+    async def download():
+        return True
+
+    with pytest.raises(TelethonUnavailable):
+        runner.run(download())
+
+    assert runner.breaker.state == "open"
+
+    # breaker باز: بدون انتظار و بدون شمردن خطای دوباره
+    with pytest.raises(TelethonUnavailable):
+        asyncio.run(runner.run_async(download()))
+    assert runner.breaker.failures == 1
+
+
+def _delivery(tmp_path, runner, uploaded, ok=True):
+    async def upload(meta, raw):
+        uploaded.append((meta["kind"], raw))
+        return ok
+
+    return BackupDelivery(BackupSpool(str(tmp_path)), runner.breaker, runner, upload)
+
+
+def test_deliver_sync_on_main_loop_uploads_in_background(tmp_path):
+    uploaded = []
+
+    async def scenario():
+        runner = _main_loop_runner()
+        delivery = _delivery(tmp_path, runner, uploaded)
+
+        assert delivery.deliver_sync({"kind": "db"}, b"1")
+        await asyncio.gather(*delivery._tasks)
+        return delivery
+
+    delivery = asyncio.run(scenario())
+
+    assert uploaded == [("db", b"1")]
+    assert delivery.spool.pending() == 0
+    assert delivery.breaker.state == "closed" and delivery.breaker.failures == 0
+
+
+def test_deliver_sync_from_thread_in_main_loop_mode(tmp_path):
+    uploaded = []
+
+    async def scenario():
+        runner = _main_loop_runner()
+        delivery = _delivery(tmp_path, runner, uploaded)
+        return await asyncio.to_thread(delivery.deliver_sync, {"kind": "userdata"}, b"u"), delivery
+
+    ok, delivery = asyncio.run(scenario())
+
+    assert ok and uploaded == [("userdata", b"u")]
+    assert delivery.spool.pending() == 0
+
+
+def test_failed_delivery_is_spooled(tmp_path):
+    uploaded = []
+
+    async def scenario():
+        runner = _main_loop_runner()
+        delivery = _delivery(tmp_path, runner, uploaded, ok=False)
+        return await delivery.deliver({"kind": "db"}, b"1"), delivery
+
+    ok, delivery = asyncio.run(scenario())
+
+    assert ok
+    assert delivery.spool.pending() == 1 and delivery.breaker.state == "open"
@@ -0,0 +1,137 @@
+import json
+
+import userdata_store
+from userdata_store import SqliteUserdataStore, UserdataStore
+
+
+def _sqlite_store(tmp_path):
+    store = SqliteUserdataStore(str(tmp_path / "userdata.json"), str(tmp_path / "userdata.db"))
+    store.open()
+    return store
+
+
+def test_list_users_with_null_id_from_update_user(tmp_path):
+    store = _sqlite_store(tmp_path)
+    store.update_user("42", favorites_disabled=True)
+
+    users = store.list_users()
+
+    assert [user["id"] for user in users] == [42]
+    assert store.count_users() == 1
+
+
+def test_list_users_with_legacy_record_without_id(tmp_path):
+    path = tmp_path / "userdata.json"
+    path.write_text(json.dumps({"users": {"7": {"full_name": "x", "message_count": 3}}}), encoding="utf-8")
+
+    store = SqliteUserdataStore(str(path), str(tmp_path / "userdata.db"))
+    store.open()
+
+    assert store.list_users() == [
+        {"id": 7, "full_name": "x", "username": None, "message_count": 3, "banned": False}
+    ]
+
+
+def test_json_store_list_users_without_id(tmp_path):
+    path = tmp_path / "userdata.json"
+    path.write_text(json.dumps({"users": {"5": {"id": None}}}), encoding="utf-8")
+
+    store = UserdataStore(str(path))
+
+    assert [user["id"] for user in store.list_users()] == [5]
+
+
+def _json_store(tmp_path, **kwargs):
+    path = tmp_path / "userdata.json"
+    path.write_text(json.dumps({"users": {}}), encoding="utf-8")
+    store = UserdataStore(str(path), **kwargs)
+    store.open()
+    return store, path
+
+
+def test_stale_flush_does_not_overwrite_restore(tmp_path):
+    store, path = _json_store(tmp_path)
+    store.update_user("1", full_name="قبل از ریستور")
+
+    # flusher snapshot را روی حلقه می‌گیرد، ولی نوشتنش در ترد دیرتر از ریستور ادمین می‌رسد
+    snapshot = store.take_snapshot()
+    restored = {"users": {"2": {"id": 2, "full_name": "ریستور"}}}
+    assert store.replace(restored, upload=False)
+    assert store.write_snapshot(snapshot)
+
+    assert json.loads(path.read_text(encoding="utf-8")) == restored
+
+
+def test_upload_runs_outside_write_lock(tmp_path):
+    seen = []
+    store, path = _json_store(tmp_path, uploader=lambda: seen.append(store._write_lock.locked()) or True)
+    store.update_user("1", full_name="x")
+
+    assert store.flush(force_upload=True)
+    assert seen == [False]
+
+
+def test_flush_writes_compact_json_of_live_data(tmp_path):
+    store, path = _json_store(tmp_path)
+    store.update_user("1", full_name="الف", message_count=3)
+    store.add_favorite("1", "n1", 0)
+    store.set_setting("sub_admins", [7])
+    assert store.flush()
+
+    store.update_user("2", full_name="ب")
+    store.set_setting("sub_admins", [])
+    assert store.flush()
+
+    text = path.read_text(encoding="utf-8")
+    assert json.loads(text) == store.load()
+    assert "\n" not in text and ", " not in text
+
+
+def test_snapshot_serializes_only_dirty_users(tmp_path, monkeypatch):
+    path = tmp_path / "userdata.json"
+    users = {str(i): {"id": i, "full_name": f"u{i}"} for i in range(100)}
+    path.write_text(json.dumps({"users": users}), encoding="utf-8")
+    store = UserdataStore(str(path))
+    store.open()
+
+    calls = []
+    original = userdata_store._compact_json
+    monkeypatch.setattr(userdata_store, "_compact_json", lambda value: calls.append(value) or original(value))
+
+    store.update_user("5", full_name="تغییر")
+    snapshot = store.take_snapshot()
+
+    # روی حلقه فقط همان یک رکورد؛ بقیه در ترد نوشتن کنار هم گذاشته می‌شوند
+    assert calls == [store.get_user("5")]
+    assert store.write_snapshot(snapshot)
+    assert json.loads(path.read_text(encoding="utf-8"))["users"]["5"]["full_name"] == "تغییر"
+
+
+def test_replace_defers_upload_to_flush(tmp_path):
+    uploads = []
+    store, path = _json_store(tmp_path, uploader=lambda: uploads.append(path.read_text(encoding="utf-8")) or True)
+
+    restored = {"users": {"2": {"id": 2}}, "sub_admins": [1]}
+    assert store.replace(restored)
+
+    assert uploads == []
+    assert json.loads(path.read_text(encoding="utf-8")) == restored
+    assert store.should_flush()
+
+    assert store.flush()
+    assert [json.loads(text) for text in uploads] == [restored]
+
+
+def test_sqlite_replace_defers_upload_to_flush(tmp_path):
+    uploads = []
+    store = SqliteUserdataStore(
+        str(tmp_path / "userdata.json"), str(tmp_path / "userdata.db"), uploader=lambda: uploads.append(1) or True
+    )
+    store.open()
+
+    assert store.replace({"users": {"3": {"id": 3, "full_name": "x"}}})
+    assert uploads == []
+
+    assert store.flush()
+    assert uploads == [1]
+    assert json.loads((tmp_path / "userdata.json").read_text(encoding="utf-8"))["users"]["3"]["full_name"] == "x"
@@ -0,0 +1,731 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# =========================================================
+# ۱) منطق مشترک flush و سیاست آپلود (write-behind)
+# =========================================================
+class _BaseUserdataStore:
+    """
+    تغییرات پرتکرار (مثل شمارش پیام‌ها) فقط علامت‌گذاری می‌شوند.
+    نوشتن فایل JSON و آپلود بکاپ توسط flusher (job_queue) و بر اساس
+    زمان یا تعداد رکوردهای کثیف انجام می‌شود.
+
+    سیاست آپلود: اولین پیام هر کاربر و هر upload_every پیام،
+    و همچنین هر تغییر تنظیمات/بن/علاقه‌مندی‌ها، در flush بعدی آپلود می‌شود.
+    """
+
+    def __init__(self, path, uploader=None, flush_interval=30, flush_threshold=50, upload_every=10):
+        # مسیر فایل JSON (همان فایلی که در گروه تلگرام بکاپ می‌شود)
+        self.path = path
+        self.uploader = uploader
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.upload_every = upload_every
+
+        self._dirty_users = set()
+        self._dirty_since = None
+        self._upload_pending = False
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+
+        # هر snapshot یک شماره‌ی ترتیبی می‌گیرد (زیر _lock، روی حلقه اصلی)؛
+        # نوشتنی که از آخرین نوشته‌شده قدیمی‌تر باشد (مثلاً flush کندی که بعد از
+        # ریستور ادمین به دیسک می‌رسد) کنار گذاشته می‌شود.
+        self._snapshot_seq = 0
+        self._written_seq = 0
+
+    # ---------- سیاست آپلود ----------
+    def _should_upload(self, old_count, new_count):
+        if old_count == 0:
+            return True
+        return new_count != old_count and new_count % self.upload_every == 0
+
+    def _mark_dirty(self, key, upload=False):
+        self._dirty_users.add(key)
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        if upload:
+            self._upload_pending = True
+
+    def _next_seq(self):
+        self._snapshot_seq += 1
+        return self._snapshot_seq
+
+    def _request_upload(self):
+        # آپلود در flush بعدی (داخل ترد flusher)، نه در ترد صدازننده
+        with self._lock:
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            self._upload_pending = True
+
+    def _clear_dirty(self):
+        self._dirty_users.clear()
+        self._dirty_since = None
+        self._upload_pending = False
+
+    # ---------- flush ----------
+    @property
+    def dirty_count(self):
+        return len(self._dirty_users)
+
+    def should_flush(self):
+        if self._dirty_since is None:
+            return False
+        if self._upload_pending or len(self._dirty_users) >= self.flush_threshold:
+            return True
+        return time.monotonic() - self._dirty_since >= self.flush_interval
+
+    def take_snapshot(self, force_upload=False):
+        """
+        روی ترد حلقه اصلی صدا زده شود؛ فقط بخش‌های کثیف آماده می‌شوند و ساختن
+        متن کامل فایل (_render) داخل ترد نوشتن انجام می‌شود.
+        خروجی: (payload, upload, seq) یا None اگر چیزی برای نوشتن نباشد.
+        """
+        with self._lock:
+            if self._dirty_since is None:
+                return None
+
+            upload = self._upload_pending or force_upload
+            payload = self._snapshot_payload(upload)
+            self._clear_dirty()
+
+            if payload is None:
+                return None
+            return payload, upload, self._next_seq()
+
+    def write_snapshot(self, snapshot):
+        """
+        می‌تواند داخل ترد جدا اجرا شود (نوشتن دیسک + آپلود).
+        """
+        payload, upload, seq = snapshot
+        ok = self._write(payload, upload, seq)
+
+        if not ok:
+            with self._lock:
+                if self._dirty_since is None:
+                    self._dirty_since = time.monotonic()
+                self._upload_pending = self._upload_pending or upload
+
+        return ok
+
+    def flush(self, force_upload=False):
+        snapshot = self.take_snapshot(force_upload=force_upload)
+        if snapshot is None:
+            return True
+        return self.write_snapshot(snapshot)
+
+    def _snapshot_payload(self, upload):
+        return self._serialize()
+
+    def _render(self, payload):
+        """
+        داخل ترد نوشتن: payload خروجی _snapshot_payload -> متن فایل JSON
+        """
+        return payload
+
+    def _serialize(self):
+        return _compact_json(self.load())
+
+    def _write(self, payload, upload, seq):
+        tmp_path = f"{self.path}.tmp"
+
+        with self._write_lock:
+            if seq <= self._written_seq:
+                # نسخه‌ی جدیدتری قبلاً نوشته شده؛ آپلود (در صورت نیاز) همان فایل جدید را می‌فرستد
+                print("⏭️ Skipping stale userdata snapshot")
+            else:
+                try:
+                    text = self._render(payload)
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(text)
+                    os.replace(tmp_path, self.path)
+                    self._written_seq = seq
+                    print("💾 Userdata saved locally")
+
+                except Exception as e:
+                    print("❌ Failed to save userdata locally:", e)
+                    return False
+
+        # آپلود بیرون از قفل: نوشتن‌های بعدی (مثلاً replace روی حلقه اصلی) پشت شبکه نمی‌مانند
+        if upload and self.uploader:
+            return bool(self.uploader())
+
+        return True
+
+
+def _compact_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _build_parts(data):
+    """
+    userdata -> (تنظیمات، کاربران) به صورت {کلید: متن JSON فشرده‌ی همان مقدار}
+    """
+    settings = {key: _compact_json(value) for key, value in data.items() if key != "users"}
+    users = {user_id: _compact_json(record) for user_id, record in (data.get("users") or {}).items()}
+    return settings, users
+
+
+def _join_parts(settings, users):
+    fields = [f"{_compact_json(key)}:{part}" for key, part in settings.items()]
+    fields.append('"users":{' + ",".join(f"{_compact_json(user_id)}:{part}" for user_id, part in users.items()) + "}")
+    return "{" + ",".join(fields) + "}"
+
+
+def _user_summary(user_id, data):
+    try:
+        count = int(data.get("message_count", 0))
+    except Exception:
+        count = 0
+
+    return {
+        # ردیف‌هایی که فقط با update_user ساخته شده‌اند (یا JSON قدیمی بدون id) ستون id خالی دارند
+        "id": int(data.get("id") or user_id),
+        "full_name": data.get("full_name") or "بدون نام",
+        "username": data.get("username"),
+        "message_count": count,
+        "banned": bool(data.get("banned", False))
+    }
+
+
+# =========================================================
+# ۲) موتور JSON (پیش‌فرض): کل userdata در حافظه
+# =========================================================
+class UserdataStore(_BaseUserdataStore):
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self._data = None
+
+        # متن JSON فشرده‌ی هر تنظیم و هر کاربر؛ در هر flush فقط کلیدهای کثیف دوباره
+        # serialize می‌شوند و ترد نوشتن همین تکه‌ها را کنار هم می‌گذارد
+        self._setting_parts = {}
+        self._user_parts = {}
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def is_loaded(self):
+        return self._data is not None
+
+    def open(self):
+        self.load()
+
+    def load(self):
+        """
+        دیکشنری زنده userdata (هر تغییری روی آن باید با replace ذخیره شود).
+        """
+        with self._lock:
+            if self._data is None:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._setting_parts, self._user_parts = _build_parts(data)
+                self._data = data
+            return self._data
+
+    def replace(self, data, upload=True):
+        """
+        ذخیره فوری کل userdata روی دیسک (برای ریستور)؛ آپلود به flush بعدی سپرده می‌شود.
+        از ترد جدا صدا زده شود (asyncio.to_thread): data هنوز فقط دست صدازننده است،
+        پس serialize آن بیرون از قفل انجام می‌شود.
+        """
+        setting_parts, user_parts = _build_parts(data)
+
+        with self._lock:
+            self._data = data
+            self._setting_parts, self._user_parts = setting_parts, user_parts
+            upload = upload or self._upload_pending
+            self._clear_dirty()
+            seq = self._next_seq()
+
+        ok = self._write((dict(setting_parts), dict(user_parts)), False, seq)
+        if ok and upload:
+            self._request_upload()
+        return ok
+
+    def _snapshot_payload(self, upload):
+        data = self.load()
+        users = data.get("users", {})
+
+        for key in self._dirty_users:
+            if key.startswith("setting:"):
+                name = key[len("setting:"):]
+                if name in data:
+                    self._setting_parts[name] = _compact_json(data[name])
+                else:
+                    self._setting_parts.pop(name, None)
+            elif key in users:
+                self._user_parts[key] = _compact_json(users[key])
+            else:
+                self._user_parts.pop(key, None)
+
+        # کپی سطحی نگاشت‌ها (فقط ارجاع به رشته‌ها)؛ تکه‌ها خودشان تغییرناپذیرند
+        return dict(self._setting_parts), dict(self._user_parts)
+
+    def _render(self, payload):
+        return _join_parts(*payload)
+
+    # ---------- کاربران ----------
+    def _users(self):
+        return self.load().setdefault("users", {})
+
+    def get_user(self, user_id):
+        return self.load().get("users", {}).get(str(user_id), {})
+
+    def put_user(self, user_id, record):
+        """
+        رکورد یک کاربر را در حافظه جایگزین کرده و کثیف علامت می‌زند.
+        """
+        user_id = str(user_id)
+
+        with self._lock:
+            users = self._users()
+            old_record = users.get(user_id, {})
+            old_count = int(old_record.get("message_count", 0))
+            new_count = int(record.get("message_count", 0))
+
+            if "favorites" in old_record and "favorites" not in record:
+                record["favorites"] = old_record["favorites"]
+
+            users[user_id] = record
+            self._mark_dirty(user_id, upload=self._should_upload(old_count, new_count))
+
+    def update_user(self, user_id, upload=True, **fields):
+        user_id = str(user_id)
+
+        with self._lock:
+            self._users().setdefault(user_id, {}).update(fields)
+            self._mark_dirty(user_id, upload=upload)
+
+    def user_ids(self):
+        return list(self.load().get("users", {}).keys())
+
+    def count_users(self, filter_mode="all"):
+        return len(self._filtered_users(filter_mode))
+
+    def list_users(self, filter_mode="all", offset=0, limit=None):
+        result = self._filtered_users(filter_mode)
+        result.sort(key=lambda x: x["message_count"], reverse=True)
+
+        if limit is None:
+            return result[offset:]
+        return result[offset:offset + limit]
+
+    def _filtered_users(self, filter_mode):
+        result = []
+
+        for user_id, data in self.load().get("users", {}).items():
+            item = _user_summary(user_id, data)
+
+            if filter_mode == "banned" and not item["banned"]:
+                continue
+            if filter_mode == "not_banned" and item["banned"]:
+                continue
+
+            result.append(item)
+
+        return result
+
+    # ---------- پوشه دلخواه ----------
+    def get_favorites(self, user_id):
+        return self.get_user(user_id).get("favorites", [])
+
+    def add_favorite(self, user_id, node_id, content_index):
+        item = {"node_id": node_id, "content_index": content_index}
+
+        with self._lock:
+            favorites = self._users().setdefault(str(user_id), {}).setdefault("favorites", [])
+            if item in favorites:
+                return False
+
+            favorites.append(item)
+            self._mark_dirty(str(user_id), upload=True)
+            return True
+
+    def remove_favorite(self, user_id, node_id, content_index):
+        item = {"node_id": node_id, "content_index": content_index}
+
+        with self._lock:
+            favorites = self.get_user(user_id).get("favorites", [])
+            if item not in favorites:
+                return False
+
+            favorites.remove(item)
+            self._mark_dirty(str(user_id), upload=True)
+            return True
+
+    def set_favorites(self, user_id, favorites):
+        with self._lock:
+            self._users().setdefault(str(user_id), {})["favorites"] = list(favorites)
+            self._mark_dirty(str(user_id), upload=True)
+
+    # ---------- تنظیمات ----------
+    def get_setting(self, key, default=None):
+        return self.load().get(key, default)
+
+    def set_setting(self, key, value):
+        with self._lock:
+            self.load()[key] = value
+            self._mark_dirty(f"setting:{key}", upload=True)
+
+
+# =========================================================
+# ۳) موتور SQLite (اختیاری): جدول‌های users / favorites / settings
+# =========================================================
+_USER_COLUMNS = (
+    "id",
+    "full_name",
+    "username",
+    "message_count",
+    "banned",
+    "first_seen",
+    "last_seen",
+    "smart_search_disabled",
+    "favorites_disabled",
+    "search_mode",
+)
+_BOOL_COLUMNS = {"banned", "smart_search_disabled", "favorites_disabled"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    id INTEGER,
+    full_name TEXT,
+    username TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    banned INTEGER NOT NULL DEFAULT 0,
+    first_seen TEXT,
+    last_seen TEXT,
+    smart_search_disabled INTEGER,
+    favorites_disabled INTEGER,
+    search_mode TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_banned ON users(banned);
+CREATE INDEX IF NOT EXISTS idx_users_message_count ON users(message_count);
+
+CREATE TABLE IF NOT EXISTS favorites (
+    user_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    node_id TEXT NOT NULL,
+    content_index INTEGER NOT NULL,
+    PRIMARY KEY (user_id, node_id, content_index)
+);
+CREATE INDEX IF NOT EXISTS idx_favorites_user ON favorites(user_id, position);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SqliteUserdataStore(_BaseUserdataStore):
+    """
+    هر کاربر یک ردیف است؛ خواندن و نوشتن تکی با کلید اصلی (O(log n)) انجام می‌شود
+    و لیست کاربران پنل ادمین با LIMIT/OFFSET روی ایندکس message_count صفحه‌بندی می‌شود.
+
+    فایل JSON (self.path) فقط برای بکاپ تلگرام و ورود/خروج userdata ساخته می‌شود.
+    """
+
+    def __init__(self, path, db_path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.db_path = db_path
+        self._conn = None
+
+    def exists(self):
+        return os.path.exists(self.db_path)
+
+    def is_loaded(self):
+        return self._conn is not None
+
+    def open(self):
+        self._db()
+
+    def _db(self):
+        with self._lock:
+            if self._conn is not None:
+                return self._conn
+
+            is_new = not os.path.exists(self.db_path)
+
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+
+            # اولین اجرا: اگر userdata.json (مثلاً دانلودشده از تلگرام) هست، وارد کن
+            if is_new and os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._import(json.load(f))
+                print("📥 Userdata imported into SQLite")
+
+            return conn
+
+    # ---------- تبدیل رکورد <-> ردیف ----------
+    @staticmethod
+    def _record_to_row(user_id, record):
+        row = {"user_id": str(user_id)}
+        extra = {}
+
+        for key, value in record.items():
+            if key == "favorites":
+                continue
+            if key in _USER_COLUMNS:
+                row[key] = int(bool(value)) if key in _BOOL_COLUMNS else value
+            else:
+                extra[key] = value
+
+        try:
+            row["message_count"] = int(row.get("message_count") or 0)
+        except (TypeError, ValueError):
+            row["message_count"] = 0
+        row["banned"] = row.get("banned") or 0
+        row["extra"] = json.dumps(extra, ensure_ascii=False) if extra else None
+        return row
+
+    @staticmethod
+    def _row_to_record(row):
+        record = {}
+
+        for key in _USER_COLUMNS:
+            value = row[key]
+            if value is None:
+                continue
+            record[key] = bool(value) if key in _BOOL_COLUMNS else value
+
+        if row["extra"]:
+            record.update(json.loads(row["extra"]))
+
+        return record
+
+    def _upsert_row(self, conn, row):
+        columns = list(row.keys())
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(f"{c}=excluded.{c}" for c in columns if c != "user_id")
+
+        conn.execute(
+            f"INSERT INTO users ({', '.join(columns)}) VALUES ({placeholders}) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {updates}",
+            [row[c] for c in columns]
+        )
+
+    # ---------- ورود / خروج JSON ----------
+    def load(self):
+        """
+        خروجی کامل userdata با همان فرمت userdata.json (کپی، نه داده زنده).
+        """
+        conn = self._db()
+
+        with self._lock:
+            users = {}
+            for row in conn.execute("SELECT * FROM users ORDER BY rowid"):
+                users[row["user_id"]] = self._row_to_record(row)
+
+            for fav in conn.execute("SELECT user_id, node_id, content_index FROM favorites ORDER BY user_id, position"):
+                record = users.setdefault(fav["user_id"], {})
+                record.setdefault("favorites", []).append({
+                    "node_id": fav["node_id"],
+                    "content_index": fav["content_index"],
+                })
+
+            data = {"users": users}
+            for row in conn.execute("SELECT key, value FROM settings ORDER BY rowid"):
+                data[row["key"]] = json.loads(row["value"])
+
+            return data
+
+    def _import(self, data):
+        conn = self._conn
+
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM users")
+            conn.execute("DELETE FROM favorites")
+            conn.execute("DELETE FROM settings")
+
+            for user_id, record in (data.get("users") or {}).items():
+                self._upsert_row(conn, self._record_to_row(user_id, record))
+
+                for position, fav in enumerate(record.get("favorites") or []):
+                    conn.execute(
+                        "INSERT OR IGNORE INTO favorites (user_id, position, node_id, content_index) VALUES (?, ?, ?, ?)",
+                        (str(user_id), position, fav.get("node_id"), fav.get("content_index"))
+                    )
+
+            for key, value in data.items():
+                if key == "users":
+                    continue
+                conn.execute(
+                    "INSERT INTO settings (key, value) VALUES (?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False))
+                )
+
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def replace(self, data, upload=True):
+        """
+        جایگزینی کامل userdata (ریستور از JSON) در یک تراکنش.
+        """
+        self._db()
+
+        with self._lock:
+            self._import(data)
+            upload = upload or self._upload_pending
+            self._clear_dirty()
+            seq = self._next_seq()
+
+        ok = self._write(True, False, seq)
+        if ok and upload:
+            self._request_upload()
+        return ok
+
+    def _snapshot_payload(self, upload):
+        # ردیف‌ها همان لحظه روی دیسک نوشته شده‌اند؛ JSON فقط برای بکاپ لازم است
+        if not upload:
+            return None
+        return True
+
+    def _render(self, payload):
+        # خروجی گرفتن از جدول‌ها داخل ترد نوشتن (load زیر قفل کپی می‌گیرد)
+        return self._serialize()
+
+    # ---------- کاربران ----------
+    def get_user(self, user_id):
+        row = self._db().execute("SELECT * FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+        return self._row_to_record(row) if row else {}
+
+    def put_user(self, user_id, record):
+        conn = self._db()
+        user_id = str(user_id)
+
+        with self._lock:
+            old = conn.execute("SELECT message_count FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            old_count = old["message_count"] if old else 0
+            new_count = int(record.get("message_count", 0))
+
+            self._upsert_row(conn, self._record_to_row(user_id, record))
+            self._mark_dirty(user_id, upload=self._should_upload(old_count, new_count))
+
+    def update_user(self, user_id, upload=True, **fields):
+        conn = self._db()
+        user_id = str(user_id)
+
+        with self._lock:
+            record = self.get_user(user_id)
+            record.update(fields)
+            self._upsert_row(conn, self._record_to_row(user_id, record))
+            self._mark_dirty(user_id, upload=upload)
+
+    def user_ids(self):
+        return [row[0] for row in self._db().execute("SELECT user_id FROM users ORDER BY rowid")]
+
+    @staticmethod
+    def _filter_clause(filter_mode):
+        if filter_mode == "banned":
+            return "WHERE banned = 1"
+        if filter_mode == "not_banned":
+            return "WHERE banned = 0"
+        return ""
+
+    def count_users(self, filter_mode="all"):
+        sql = f"SELECT COUNT(*) FROM users {self._filter_clause(filter_mode)}"
+        return self._db().execute(sql).fetchone()[0]
+
+    def list_users(self, filter_mode="all", offset=0, limit=None):
+        sql = (
+            "SELECT user_id, id, full_name, username, message_count, banned FROM users "
+            f"{self._filter_clause(filter_mode)} "
+            "ORDER BY message_count DESC, rowid LIMIT ? OFFSET ?"
+        )
+        rows = self._db().execute(sql, (-1 if limit is None else limit, offset))
+        return [_user_summary(row["user_id"], dict(row)) for row in rows]
+
+    # ---------- پوشه دلخواه ----------
+    def get_favorites(self, user_id):
+        rows = self._db().execute(
+            "SELECT node_id, content_index FROM favorites WHERE user_id = ? ORDER BY position",
+            (str(user_id),)
+        )
+        return [{"node_id": row["node_id"], "content_index": row["content_index"]} for row in rows]
+
+    def add_favorite(self, user_id, node_id, content_index):
+        conn = self._db()
+        user_id = str(user_id)
+
+        with self._lock:
+            next_position = conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM favorites WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()[0]
+
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO favorites (user_id, position, node_id, content_index) VALUES (?, ?, ?, ?)",
+                (user_id, next_position, node_id, content_index)
+            )
+            if cursor.rowcount == 0:
+                return False
+
+            self._mark_dirty(user_id, upload=True)
+            return True
+
+    def remove_favorite(self, user_id, node_id, content_index):
+        with self._lock:
+            cursor = self._db().execute(
+                "DELETE FROM favorites WHERE user_id = ? AND node_id = ? AND content_index = ?",
+                (str(user_id), node_id, content_index)
+            )
+            if cursor.rowcount == 0:
+                return False
+
+            self._mark_dirty(str(user_id), upload=True)
+            return True
+
+    def set_favorites(self, user_id, favorites):
+        conn = self._db()
+        user_id = str(user_id)
+
+        with self._lock:
+            conn.execute("BEGIN")
+            try:
+                conn.execute("DELETE FROM favorites WHERE user_id = ?", (user_id,))
+                for position, fav in enumerate(favorites):
+                    conn.execute(
+                        "INSERT OR IGNORE INTO favorites (user_id, position, node_id, content_index) VALUES (?, ?, ?, ?)",
+                        (user_id, position, fav.get("node_id"), fav.get("content_index"))
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            self._mark_dirty(user_id, upload=True)
+
+    # ---------- تنظیمات ----------
+    def get_setting(self, key, default=None):
+        row = self._db().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_setting(self, key, value):
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+            self._mark_dirty(f"setting:{key}", upload=True)
+
+
+def create_userdata_store(backend, path, db_path=None, **kwargs):
+    if backend == "sqlite":
+        return SqliteUserdataStore(path, db_path, **kwargs)
+    return UserdataStore(path, **kwargs)